@@ -1,11 +1,16 @@
 """主应用文件"""
 
 import os
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request
 from app.config import ConfigManager
-from app.controllers import analysis_bp, config_bp
-from app.utils import setup_logger, get_logger, create_error_response
+from app.controllers import analysis_bp, config_bp, monitor_bp, blob_bp, ioc_bp
+from app.utils import (
+    setup_logger, get_logger, create_error_response,
+    set_request_id, get_request_id, get_elapsed_ms, clear_request_context, set_client_context,
+    set_deadline, deadline_policy, asset_pipeline, cancellation_registry
+)
 from app.services import ai_service
+from app.services.provider_scheduler import client_identity
 
 # 初始化配置管理器
 config_manager = ConfigManager('app/config/config.ini')
@@ -15,6 +20,9 @@ setup_logger()
 
 logger = get_logger(__name__)
 
+# 标识客户端的API密钥请求头，缺省时按来源地址区分客户端
+CLIENT_KEY_HEADER = config_manager.get_config_value('scheduler', 'client_header', 'X-API-Key')
+
 def create_app():
     """创建Flask应用"""
     app = Flask(__name__)
@@ -27,6 +35,54 @@ def create_app():
     # 注册蓝图
     app.register_blueprint(analysis_bp, url_prefix='/api')
     app.register_blueprint(config_bp, url_prefix='/api')
+    app.register_blueprint(monitor_bp, url_prefix='/api')
+    app.register_blueprint(blob_bp, url_prefix='/api')
+    app.register_blueprint(ioc_bp, url_prefix='/api')
+    
+    # 本地模型预加载
+    ai_service.warmup()
+    
+    # 构建带指纹的预压缩静态资源，模板通过 asset_url 引用
+    asset_pipeline.build()
+    app.jinja_env.globals['asset_url'] = asset_pipeline.url
+    
+    # 请求上下文：请求ID与耗时
+    @app.before_request
+    def bind_request_context():
+        """为每个请求绑定请求ID、客户端标识、截止时间和取消令牌"""
+        request_id = set_request_id(request.headers.get('X-Request-ID'))
+        client_id = client_identity(request.headers.get(CLIENT_KEY_HEADER), request.remote_addr)
+        set_client_context(client_id, request.endpoint.rsplit('.', 1)[-1] if request.endpoint else None)
+        # 开发服务器和gunicorn会提供客户端连接的套接字，用于探测客户端是否已断开
+        if request.path.startswith('/api') and request.method == 'POST':
+            # 截止时间按接口默认值，客户端可用 X-Request-Timeout（秒）缩短或在上限内延长
+            set_deadline(deadline_policy.resolve(
+                request.endpoint.rsplit('.', 1)[-1] if request.endpoint else None,
+                request.headers.get('X-Request-Timeout')
+            ))
+            cancellation_registry.open(
+                request_id, client_id,
+                request.environ.get('werkzeug.socket') or request.environ.get('gunicorn.socket')
+            )
+    
+    @app.after_request
+    def log_request_timing(response):
+        """记录请求耗时并回传请求ID"""
+        response.headers['X-Request-ID'] = get_request_id() or ''
+        if request.path.startswith('/api'):
+            logger.info("请求完成", extra={
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "duration_ms": get_elapsed_ms()
+            })
+        return response
+    
+    @app.teardown_request
+    def unbind_request_context(error=None):
+        """清除请求上下文"""
+        cancellation_registry.close(get_request_id())
+        clear_request_context()
     
     # 主页路由
     @app.route('/')
@@ -43,6 +99,12 @@ def create_app():
             logger.error(f"渲染主页失败: {e}")
             return create_error_response("页面加载失败", 500)
     
+    # 带指纹的静态资源
+    @app.route('/assets/<path:filename>')
+    def serve_asset(filename):
+        """返回预压缩的静态资源"""
+        return asset_pipeline.serve(filename)
+    
     # Chrome开发者工具支持
     @app.route('/.well-known/appspecific/com.chrome.devtools.json')
     def chrome_devtools():
@@ -41,6 +41,9 @@ class LoggingConfig:
     file: str = 'logs/app.log'
     max_size: str = '10MB'
     backup_count: int = 5
+    format: str = 'json'
+    sample_rate: float = 1.0
+    queue_size: int = 10000
 
 
 @dataclass
@@ -88,6 +91,16 @@ model = moonshotai/moonlight-16b-a3b-instruct:free
 [ollama]
 api_url = http://localhost:11434/api/chat
 model = qwen2.5-coder:14b
+# 模型在内存中的常驻时长，-1 表示一直常驻
+keep_alive = 30m
+# 初始上下文大小，提示词更长时按2的幂扩大
+num_ctx = 8192
+# 上下文大小上限，分块按此上限切分
+num_ctx_max = 32768
+# Ollama服务端的并行槽位数（OLLAMA_NUM_PARALLEL），同时发往Ollama的调用不超过该值
+parallel = 1
+# 启动和重新加载配置时预加载模型
+warmup = true
 
 [ui]
 default_theme = dark
@@ -97,6 +110,206 @@ level = INFO
 file = logs/app.log
 max_size = 10MB
 backup_count = 5
+# 日志格式: json, text
+format = json
+# 高频INFO日志采样率 (0-1)
+sample_rate = 1.0
+queue_size = 10000
+
+[process]
+# 追加的已知进程知识库文件，多个用逗号分隔
+extra_knowledge_base = 
+# 多主机分析：出现主机数不超过 max(fleet_min_rare_hosts, 主机总数*fleet_rare_ratio) 视为稀有
+fleet_rare_ratio = 0.01
+fleet_min_rare_hosts = 2
+
+[javascript]
+# 追加的第三方库指纹文件，多个用逗号分隔
+extra_fingerprints = 
+# 用户内容哈希库（JSON），登记的已知库文件哈希保存在这里
+hash_db = 
+# 仅凭版权注释/代码特征识别（未经哈希验证）的库是否也从审计代码中剔除
+strip_unverified = false
+# 危险点切片时每个危险点前后保留的上下文行数
+slice_context_lines = 6
+# 单个切片片段的最大行数，超出后拆分为新片段
+slice_max_lines = 80
+
+[regex]
+# 单个候选正则的验证超时（秒），超时视为灾难性回溯
+verify_timeout = 3
+# ReDoS对抗输入的重复长度
+adversarial_length = 2048
+# 对抗输入匹配耗时超过该值（毫秒）视为存在回溯风险
+slow_threshold_ms = 100
+# 每次最多验证的候选数
+max_candidates = 8
+# 全部候选未通过时重新生成的次数
+max_retries = 1
+# 简单的提取需求先根据示例在本地合成正则，精确匹配时不调用大模型
+local_synthesis = true
+
+[translation]
+# 片段级翻译记忆库（SQLite），留空则不缓存
+memory_db = data/translation_memory.db
+# 每批合并翻译的最大token数和片段数
+batch_tokens = 1500
+batch_segments = 20
+# 并行翻译请求数
+max_workers = 4
+
+[traffic]
+# 抓包批量分析的并发请求数
+capture_concurrency = 4
+# 单次最多分析的去重后请求数，超出部分只计入汇总
+capture_max_requests = 500
+# 抓包文件上传大小上限（MB）
+capture_max_size_mb = 256
+# 抓包批量分析的默认输出模式: text, structured, verdict
+capture_output_mode = verdict
+
+[batching]
+# 是否将并发到达的短流量分析/解码请求合并为一次模型调用
+enabled = false
+# 合并等待窗口（毫秒）
+window_ms = 30
+# 单次合并的最大条目数
+max_items = 8
+# 单条输入估算token数不超过该值才参与合并
+max_item_tokens = 500
+
+[structured]
+# 结构化输出模式的回复token上限
+max_tokens = 800
+# 仅判定模式的回复token上限
+verdict_max_tokens = 64
+
+[admission]
+# 是否启用准入控制
+enabled = true
+# 全局同时在途的请求数上限
+max_concurrency = 8
+# 全局在途请求估算token数上限
+max_tokens = 400000
+# 等待队列长度，队列满时直接返回429
+queue_size = 32
+# 排队超时秒数，超时返回503
+queue_timeout = 30
+# 接口级限制，格式为 视图函数名:并发数:token数，逗号分隔，token数可省略
+endpoint_limits = analyze_web_logs:3, analyze_capture:2, translate:4
+
+[scheduler]
+# 是否启用模型调用的公平调度
+enabled = true
+# 同时进行的模型调用数上限
+provider_slots = 4
+# 交互通道与批量通道的调度权重
+interactive_weight = 4
+bulk_weight = 1
+# 属于交互通道的视图函数名，其余接口走批量通道
+interactive_endpoints = decode, generate_regex, analyze_traffic, chat_weblog, test_config
+# 标识客户端的API密钥请求头，缺省时按来源地址区分客户端
+client_header = X-API-Key
+
+[blobs]
+# 上传内容存储目录
+dir = data/blobs
+# 存储总大小上限（MB），超出时按最近使用淘汰
+max_total_mb = 1024
+# 单个上传内容大小上限（MB）
+max_blob_mb = 64
+
+[assets]
+# 启动时压缩静态资源并生成带指纹的文件名和gzip/brotli版本（brotli需安装Brotli包）
+enabled = true
+static_dir = static
+# 构建输出目录
+output_dir = static/dist
+# 需要处理的文件，相对于static_dir
+files = js/index.js, js/hash-worker.js, css/style.css
+
+[tail]
+# 允许跟踪的日志目录，逗号分隔
+allowed_dirs = /var/log
+# 同时运行的跟踪任务数上限
+max_jobs = 4
+# 检查新内容的间隔（秒）
+poll_interval = 2
+# 默认窗口时长（秒）和窗口大小上限（KB），先到者结束当前窗口
+window_seconds = 300
+window_max_kb = 512
+# 滚动统计覆盖的窗口数
+rolling_windows = 24
+# 每个任务保留的发现条数
+max_findings = 100
+# 文件inode和偏移的检查点文件
+checkpoint_file = data/tail_checkpoints.json
+
+[ioc]
+# 是否把分析结果中的威胁指标记入本地索引
+enabled = true
+# SQLite索引文件
+db_file = data/ioc.db
+# 单次分析最多提取的指标数
+max_indicators = 500
+# 分析结果中附带的历史出现指标数上限
+max_prior = 20
+# 保存并进入全文索引的结果文本长度
+summary_chars = 4000
+
+[log_sampler]
+# 日志超出单次提示预算时的默认处理方式：chunk 分块分析，sample 本地评分分层抽样后只调用一次模型
+reduction = chunk
+# 统计摘要中列出的高频IP和异常会话数
+summary_top = 10
+# 每层按评分选取的比例，其余按时间均匀选取作为常态样本
+top_score_share = 0.6
+
+[early_exit]
+# 分块分析时，某一块得出明确结论后跳过其余分块的分析类型（请求中 full_report 为 true 时不跳过）
+analysis_types = traffic_analysis, webshell_detection
+# 结构化流量分析判定为攻击且置信度为该值时结束
+traffic_confidence = 高
+# 判定为WebShell且威胁等级为其中之一时结束
+webshell_threat_levels = 高危
+
+[cancellation]
+# 探测客户端是否已断开的间隔（秒），0 表示只支持显式取消
+poll_interval = 1
+
+[deadline]
+# 请求的默认时限（秒），客户端可通过 X-Request-Timeout 请求头指定，0 表示不限
+default_seconds = 300
+# 请求头可指定的最大时限（秒），0 表示不限
+max_seconds = 1800
+# 按接口覆盖默认时限，格式为 接口名:秒数，逗号分隔
+endpoint_seconds = analyze_web_logs:900, analyze_capture:1800, analyze_process_fleet:900, translate:600
+# 连接模型服务的超时（秒）
+connect_timeout = 5
+# 分块分析时每次调用至少分到的时间（秒）
+min_call_seconds = 30
+
+[weblog]
+# 选择多个分析选项时每项使用专用提示单独调用并行执行，false 时合并为一次调用
+fan_out = true
+# 分项分析的并行请求数
+max_workers = 4
+
+[cpu_pool]
+# 日志解析、JavaScript拆包切片、分块token估算等CPU密集任务的工作进程数，0 表示在请求线程中执行
+workers = 2
+# 小于该大小（千字符）的输入直接在请求线程中执行
+inline_kb = 64
+# 不小于该大小（千字符）的输入写入内存映射的临时文件传给工作进程，不经过pickle复制
+spool_kb = 256
+# 每个工作进程的地址空间上限（MB），超出时任务以内存不足失败，0 表示不限
+task_memory_mb = 1024
+# 每个工作进程执行该数量的任务后重启，0 表示不重启
+max_tasks_per_child = 200
+# 工作进程的启动方式：forkserver 或 spawn
+start_method = forkserver
+# 临时文件目录，留空时使用 /dev/shm（不存在时使用系统临时目录）
+spool_dir =
 
 [server]
 host = 0.0.0.0
@@ -139,7 +352,10 @@ debug = false
             level=self.get_config_value('logging', 'level', 'INFO'),
             file=self.get_config_value('logging', 'file', 'logs/app.log'),
             max_size=self.get_config_value('logging', 'max_size', '10MB'),
-            backup_count=int(self.get_config_value('logging', 'backup_count', '5'))
+            backup_count=int(self.get_config_value('logging', 'backup_count', '5')),
+            format=self.get_config_value('logging', 'format', 'json').lower(),
+            sample_rate=float(self.get_config_value('logging', 'sample_rate', '1.0')),
+            queue_size=int(self.get_config_value('logging', 'queue_size', '10000'))
         )
     
     def get_server_config(self) -> ServerConfig:
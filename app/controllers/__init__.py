@@ -2,5 +2,8 @@
 
 from .analysis_controller import analysis_bp
 from .config_controller import config_bp
+from .monitor_controller import monitor_bp
+from .blob_controller import blob_bp
+from .ioc_controller import ioc_bp
 
-__all__ = ['analysis_bp', 'config_bp']
\ No newline at end of file
+__all__ = ['analysis_bp', 'config_bp', 'monitor_bp', 'blob_bp', 'ioc_bp']
\ No newline at end of file
@@ -1,33 +1,105 @@
 """分析功能控制器"""
 
-from flask import Blueprint, request, jsonify
+import json
+import math
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from ..config import config_manager
 from ..services import analysis_service
+from ..services.admission import admission_controlled
+from ..services.blob_store import blob_store
+from ..services.log_tail import tail_manager
+from ..services.structured_output import OUTPUT_MODES
 from ..utils import handle_api_error, ErrorHandler, Validator
 
+# 抓包文件上传大小上限（MB），高于全局请求大小限制
+CAPTURE_MAX_SIZE = int(config_manager.get_config_value('traffic', 'capture_max_size_mb', '256')) * 1024 * 1024
+
+# Web日志分析选项
+WEBLOG_ANALYSIS_OPTIONS = ["攻击检测", "异常行为", "访问统计", "性能分析"]
+
+# 日志跟踪的默认窗口时长（秒）和窗口大小上限（KB）
+TAIL_WINDOW_SECONDS = float(config_manager.get_config_value('tail', 'window_seconds', '300'))
+TAIL_WINDOW_MAX_KB = int(config_manager.get_config_value('tail', 'window_max_kb', '512'))
+
 analysis_bp = Blueprint('analysis', __name__)
 
 
 @analysis_bp.route('/analyze_traffic', methods=['POST'])
 @handle_api_error
+@admission_controlled
 def analyze_traffic():
     """流量分析接口"""
     data = request.get_json()
     if not data:
         return ErrorHandler.format_validation_errors(["请求数据不能为空"]), 400
     
+    # 引用已上传内容时取出正文
+    blob_store.resolve(data, 'http_data')
+    
     http_data = data.get('http_data', '')
     if not http_data:
         return ErrorHandler.format_validation_errors(["HTTP数据不能为空"]), 400
     
+    output_mode = data.get('output_mode', 'text')
+    if output_mode not in OUTPUT_MODES:
+        return ErrorHandler.format_validation_errors([f"output_mode必须是以下之一: {', '.join(OUTPUT_MODES)}"]), 400
+    
+    # 为 true 时分析全部分块，不在得出结论后提前结束
+    full_report = data.get('full_report', False)
+    if not isinstance(full_report, bool):
+        return ErrorHandler.format_validation_errors(["full_report 必须是布尔值"]), 400
+    
     # 记录请求信息
-    ErrorHandler.log_request_info(request, {"data_length": len(http_data)})
+    ErrorHandler.log_request_info(request, {
+        "data_length": len(http_data), "output_mode": output_mode, "full_report": full_report
+    })
     
-    result = analysis_service.analyze_traffic(http_data)
+    result = analysis_service.analyze_traffic(http_data, output_mode, full_report)
     return jsonify(result)
 
 
+@analysis_bp.route('/analyze_capture', methods=['POST'])
+@handle_api_error
+@admission_controlled
+def analyze_capture():
+    """抓包批量流量分析接口
+
+    接收 multipart 上传的 file 字段或原始请求体（HAR/PCAP/PCAPNG），
+    以 NDJSON 流式返回每个去重后请求的判定，最后一行为汇总。
+    output_mode 可通过表单字段或查询参数指定，默认仅判定。
+    """
+    request.max_content_length = CAPTURE_MAX_SIZE
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, file_name = upload.stream, upload.filename
+    elif request.content_length:
+        stream, file_name = request.stream, ''
+    else:
+        return ErrorHandler.format_validation_errors(["请上传HAR、PCAP或PCAPNG抓包文件"]), 400
+    
+    output_mode = request.form.get('output_mode') or request.args.get('output_mode', '')
+    if output_mode and output_mode not in OUTPUT_MODES:
+        return ErrorHandler.format_validation_errors([f"output_mode必须是以下之一: {', '.join(OUTPUT_MODES)}"]), 400
+    
+    # 记录请求信息
+    ErrorHandler.log_request_info(request, {
+        "file_name": file_name,
+        "data_length": request.content_length,
+        "output_mode": output_mode
+    })
+    
+    verdicts = analysis_service.analyze_capture(stream, output_mode)
+    
+    def generate():
+        for event in verdicts:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @analysis_bp.route('/decode', methods=['POST'])
 @handle_api_error
+@admission_controlled
 def decode():
     """智能解码接口"""
     data = request.get_json()
@@ -47,31 +119,53 @@ def decode():
 
 @analysis_bp.route('/audit_js', methods=['POST'])
 @handle_api_error
+@admission_controlled
 def audit_js():
     """JavaScript审计接口"""
     data = request.get_json()
     if not data:
         return ErrorHandler.format_validation_errors(["请求数据不能为空"]), 400
     
+    # 引用已上传内容时取出正文
+    blob_store.resolve(data, 'js_code')
+    
     js_code = data.get('js_code', '')
     if not js_code:
         return ErrorHandler.format_validation_errors(["JavaScript代码不能为空"]), 400
     
+    # 是否在本地识别并剔除第三方库，默认开启
+    strip_libraries = data.get('strip_libraries', True)
+    if not isinstance(strip_libraries, bool):
+        return ErrorHandler.format_validation_errors(["strip_libraries 必须是布尔值"]), 400
+    
+    # 是否只把本地定位到的危险点片段交给AI，默认关闭
+    slice_sinks = data.get('slice_sinks', False)
+    if not isinstance(slice_sinks, bool):
+        return ErrorHandler.format_validation_errors(["slice_sinks 必须是布尔值"]), 400
+    
     # 记录请求信息
-    ErrorHandler.log_request_info(request, {"code_length": len(js_code)})
+    ErrorHandler.log_request_info(request, {
+        "code_length": len(js_code), "strip_libraries": strip_libraries, "slice_sinks": slice_sinks
+    })
     
-    result = analysis_service.analyze_javascript(js_code)
+    result = analysis_service.analyze_javascript(
+        js_code, strip_libraries=strip_libraries, slice_sinks=slice_sinks
+    )
     return jsonify(result)
 
 
 @analysis_bp.route('/analyze_process', methods=['POST'])
 @handle_api_error
+@admission_controlled
 def analyze_process():
     """进程分析接口"""
     data = request.get_json()
     if not data:
         return ErrorHandler.format_validation_errors(["请求数据不能为空"]), 400
     
+    # 引用已上传内容时取出正文
+    blob_store.resolve(data, 'process_data')
+    
     process_data = data.get('process_data', '')
     if not process_data:
         return ErrorHandler.format_validation_errors(["进程数据不能为空"]), 400
@@ -83,14 +177,41 @@ def analyze_process():
     return jsonify(result)
 
 
+@analysis_bp.route('/analyze_process_fleet', methods=['POST'])
+@handle_api_error
+@admission_controlled
+def analyze_process_fleet():
+    """多主机进程稀有度分析接口"""
+    data = request.get_json()
+    if not data:
+        return ErrorHandler.format_validation_errors(["请求数据不能为空"]), 400
+    
+    hosts = data.get('hosts', {})
+    if not hosts or not isinstance(hosts, dict):
+        return ErrorHandler.format_validation_errors(["主机进程数据不能为空，格式为 {主机名: 进程列表}"]), 400
+    
+    # 记录请求信息
+    ErrorHandler.log_request_info(request, {
+        "host_count": len(hosts),
+        "data_length": sum(len(str(dump)) for dump in hosts.values())
+    })
+    
+    result = analysis_service.analyze_process_fleet(hosts)
+    return jsonify(result)
+
+
 @analysis_bp.route('/generate_regex', methods=['POST'])
 @handle_api_error
+@admission_controlled
 def generate_regex():
     """正则表达式生成接口"""
     data = request.get_json()
     if not data:
         return ErrorHandler.format_validation_errors(["请求数据不能为空"]), 400
     
+    # 引用已上传内容时取出正文
+    blob_store.resolve(data, 'source_text')
+    
     source_text = data.get('source_text', '')
     target_text = data.get('target_text', '')
     
@@ -111,46 +232,65 @@ def generate_regex():
 
 @analysis_bp.route('/detect_webshell', methods=['POST'])
 @handle_api_error
+@admission_controlled
 def detect_webshell():
     """WebShell检测接口"""
     data = request.get_json()
     if not data:
         return ErrorHandler.format_validation_errors(["请求数据不能为空"]), 400
     
+    # 引用已上传内容时取出正文
+    blob_store.resolve(data, 'file_content')
+    
     file_content = data.get('file_content', '')
     file_name = data.get('file_name', '')
     
     if not file_content:
         return ErrorHandler.format_validation_errors(["文件内容不能为空"]), 400
     
+    output_mode = data.get('output_mode', 'text')
+    if output_mode not in OUTPUT_MODES:
+        return ErrorHandler.format_validation_errors([f"output_mode必须是以下之一: {', '.join(OUTPUT_MODES)}"]), 400
+    
+    # 为 true 时分析全部分块，不在得出结论后提前结束
+    full_report = data.get('full_report', False)
+    if not isinstance(full_report, bool):
+        return ErrorHandler.format_validation_errors(["full_report 必须是布尔值"]), 400
+    
     # 记录请求信息
     ErrorHandler.log_request_info(request, {
         "file_name": file_name,
-        "content_length": len(file_content)
+        "content_length": len(file_content),
+        "output_mode": output_mode,
+        "full_report": full_report
     })
     
-    result = analysis_service.detect_webshell(file_content, file_name)
+    result = analysis_service.detect_webshell(file_content, file_name, output_mode, full_report)
     return jsonify(result)
 
 
 @analysis_bp.route('/analyze_weblog', methods=['POST'])
 @handle_api_error
+@admission_controlled
 def analyze_web_logs():
     """Web日志分析接口"""
     data = request.get_json()
     if not data:
         return ErrorHandler.format_validation_errors(["请求数据不能为空"]), 400
     
+    # 引用已上传内容时取出正文
+    blob_store.resolve(data, 'log_content')
+    
     log_content = data.get('log_content', '')
     analysis_options = data.get('analysis_types', [])
+    reduction = data.get('reduction', '')
     
     if not log_content:
         return ErrorHandler.format_validation_errors(["日志内容不能为空"]), 400
     
     # 验证分析选项
-    valid_options = ["攻击检测", "异常行为", "访问统计", "性能分析"]
     if analysis_options:
-        invalid_options = [opt for opt in analysis_options if opt not in valid_options]
+        invalid_options = [opt for opt in analysis_options if opt not in WEBLOG_ANALYSIS_OPTIONS]
         if invalid_options:
             return ErrorHandler.format_validation_errors([
                 f"无效的分析选项: {', '.join(invalid_options)}"
@@ -159,21 +299,99 @@ def analyze_web_logs():
     # 记录请求信息
     ErrorHandler.log_request_info(request, {
         "log_length": len(log_content),
-        "analysis_options": analysis_options
+        "analysis_options": analysis_options,
+        "reduction": reduction
     })
     
-    result = analysis_service.analyze_web_logs(log_content, analysis_options)
+    result = analysis_service.analyze_web_logs(log_content, analysis_options, reduction)
     return jsonify(result)
 
 
+@analysis_bp.route('/tail/start', methods=['POST'])
+@handle_api_error
+def start_log_tail():
+    """开始跟踪服务器上的日志文件，按窗口分析新追加的行"""
+    data = request.get_json()
+    if not data:
+        return ErrorHandler.format_validation_errors(["请求数据不能为空"]), 400
+    
+    paths = data.get('paths') or ([data['path']] if data.get('path') else [])
+    if not isinstance(paths, list) or not paths or not all(isinstance(path, str) and path for path in paths):
+        return ErrorHandler.format_validation_errors(["paths必须是非空的日志文件路径列表"]), 400
+    
+    analysis_options = data.get('analysis_types', [])
+    if not isinstance(analysis_options, list):
+        return ErrorHandler.format_validation_errors(["analysis_types必须是列表"]), 400
+    invalid_options = [opt for opt in analysis_options if opt not in WEBLOG_ANALYSIS_OPTIONS]
+    if invalid_options:
+        return ErrorHandler.format_validation_errors([
+            f"无效的分析选项: {', '.join(invalid_options)}"
+        ]), 400
+    
+    try:
+        window_seconds = float(data.get('window_seconds', TAIL_WINDOW_SECONDS))
+        window_max_bytes = int(data.get('window_max_kb', TAIL_WINDOW_MAX_KB)) * 1024
+    except (TypeError, ValueError, OverflowError):
+        return ErrorHandler.format_validation_errors(["window_seconds和window_max_kb必须是数字"]), 400
+    if not math.isfinite(window_seconds) or window_seconds <= 0 or window_max_bytes <= 0:
+        return ErrorHandler.format_validation_errors(["window_seconds和window_max_kb必须是大于0的有限数"]), 400
+    
+    # 是否对每个窗口调用模型分析（默认开启），以及是否从文件开头读起（默认只读新追加的行）
+    analyze = data.get('analyze', True)
+    from_start = data.get('from_start', False)
+    if not isinstance(analyze, bool) or not isinstance(from_start, bool):
+        return ErrorHandler.format_validation_errors(["analyze和from_start必须是布尔值"]), 400
+    
+    # 记录请求信息
+    ErrorHandler.log_request_info(request, {
+        "paths": paths,
+        "analysis_options": analysis_options,
+        "window_seconds": window_seconds
+    })
+    
+    result = tail_manager.start(
+        paths, analysis_options, window_seconds, window_max_bytes,
+        analyze=analyze,
+        from_start=from_start
+    )
+    return jsonify(result)
+
+
+@analysis_bp.route('/tail', methods=['GET'])
+@handle_api_error
+def list_log_tails():
+    """列出日志跟踪任务"""
+    return jsonify({"jobs": tail_manager.list()})
+
+
+@analysis_bp.route('/tail/<job_id>', methods=['GET'])
+@handle_api_error
+def get_log_tail(job_id):
+    """获取跟踪任务的滚动统计和发现，since 为已取得的最后一个窗口序号"""
+    since = request.args.get('since', 0, type=int)
+    return jsonify(tail_manager.get(job_id).describe(since))
+
+
+@analysis_bp.route('/tail/<job_id>/stop', methods=['POST'])
+@handle_api_error
+def stop_log_tail(job_id):
+    """停止跟踪任务并返回最终状态"""
+    ErrorHandler.log_request_info(request, {"job_id": job_id})
+    return jsonify(tail_manager.stop(job_id))
+
+
 @analysis_bp.route('/chat_weblog', methods=['POST'])
 @handle_api_error
+@admission_controlled
 def chat_weblog():
     """Web日志对话接口"""
     data = request.get_json()
     if not data:
         return ErrorHandler.format_validation_errors(["请求数据不能为空"]), 400
     
+    # 引用已上传内容时取出正文
+    blob_store.resolve(data, 'log_content', 'analysis_result')
+    
     question = data.get('question', '')
     log_content = data.get('log_content', '')
     analysis_result = data.get('analysis_result', '')
@@ -199,12 +417,16 @@ def chat_weblog():
 
 @analysis_bp.route('/translate', methods=['POST'])
 @handle_api_error
+@admission_controlled
 def translate():
     """AI翻译接口"""
     data = request.get_json()
     if not data:
         return ErrorHandler.format_validation_errors(["请求数据不能为空"]), 400
     
+    # 引用已上传内容时取出正文
+    blob_store.resolve(data, 'text')
+    
     text = data.get('text', '')
     source_lang = data.get('source_lang', '')
     target_lang = data.get('target_lang', '')
@@ -0,0 +1,39 @@
+"""上传内容存储控制器"""
+
+from flask import Blueprint, request, jsonify
+from ..services.blob_store import blob_store, is_digest
+from ..utils import handle_api_error, ErrorHandler
+
+blob_bp = Blueprint('blob', __name__)
+
+
+@blob_bp.route('/blobs/<digest>', methods=['GET'])
+@handle_api_error
+def get_blob(digest):
+    """查询是否已有该摘要的内容（HEAD 请求只看状态码）"""
+    if not is_digest(digest):
+        return ErrorHandler.format_validation_errors(["摘要必须是64位小写十六进制SHA-256"]), 400
+    
+    size = blob_store.size(digest)
+    if size is None:
+        return jsonify({"hash": digest, "exists": False}), 404
+    return jsonify({"hash": digest, "exists": True, "size": size})
+
+
+@blob_bp.route('/blobs/<digest>', methods=['PUT'])
+@handle_api_error
+def put_blob(digest):
+    """上传内容，请求体为原始字节，服务端校验摘要"""
+    if not is_digest(digest):
+        return ErrorHandler.format_validation_errors(["摘要必须是64位小写十六进制SHA-256"]), 400
+    
+    request.max_content_length = blob_store.max_blob_bytes
+    data = request.get_data(cache=False)
+    if not data:
+        return ErrorHandler.format_validation_errors(["上传内容不能为空"]), 400
+    
+    # 记录请求信息
+    ErrorHandler.log_request_info(request, {"hash": digest, "data_length": len(data)})
+    
+    blob_store.put(data, digest)
+    return jsonify({"hash": digest, "exists": True, "size": len(data)}), 201
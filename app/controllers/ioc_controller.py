@@ -0,0 +1,34 @@
+"""威胁指标查询控制器"""
+
+from flask import Blueprint, request, jsonify
+from ..services.ioc_index import ioc_index, INDICATOR_TYPES
+from ..utils import handle_api_error, ErrorHandler
+
+ioc_bp = Blueprint('ioc', __name__)
+
+
+@ioc_bp.route('/ioc/lookup', methods=['GET'])
+@handle_api_error
+def lookup_indicator():
+    """按值精确查找指标的历史出现记录，type 可选"""
+    value = request.args.get('value', '').strip()
+    kind = request.args.get('type', '').strip()
+    if not value:
+        return ErrorHandler.format_validation_errors(["value不能为空"]), 400
+    if kind and kind not in INDICATOR_TYPES:
+        return ErrorHandler.format_validation_errors([f"type必须是以下之一: {', '.join(INDICATOR_TYPES)}"]), 400
+    
+    return jsonify({"value": value, "indicators": ioc_index.lookup(value, kind or None)})
+
+
+@ioc_bp.route('/ioc/search', methods=['GET'])
+@handle_api_error
+def search_analyses():
+    """在历史分析结果中全文检索"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return ErrorHandler.format_validation_errors(["q不能为空"]), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    
+    return jsonify({"query": query, "analyses": ioc_index.search(query, limit)})
+
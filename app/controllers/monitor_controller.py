@@ -0,0 +1,33 @@
+"""运行状态监控控制器"""
+
+from flask import Blueprint, jsonify
+from ..services import ai_service
+from ..services.admission import admission_controller
+from ..services.provider_scheduler import provider_scheduler
+from ..services.ioc_index import ioc_index
+from ..utils import handle_api_error, cancellation_registry, cpu_pool, get_client_id
+
+monitor_bp = Blueprint('monitor', __name__)
+
+
+@monitor_bp.route('/metrics', methods=['GET'])
+@handle_api_error
+def metrics():
+    """准入排队、模型调用调度、用量、指标索引、请求取消与CPU进程池统计"""
+    return jsonify({
+        "admission": admission_controller.get_stats(),
+        "scheduler": provider_scheduler.get_stats(),
+        "usage": ai_service.get_usage_stats(),
+        "ioc": ioc_index.get_stats(),
+        "cancellation": cancellation_registry.get_stats(),
+        "cpu_pool": cpu_pool.get_stats()
+    })
+
+
+@monitor_bp.route('/requests/<request_id>/cancel', methods=['POST'])
+@handle_api_error
+def cancel_request(request_id):
+    """取消同一客户端进行中的请求：中止正在进行的模型调用，不再发起后续分块"""
+    if not cancellation_registry.cancel(request_id, get_client_id()):
+        return jsonify({"request_id": request_id, "cancelled": False}), 404
+    return jsonify({"request_id": request_id, "cancelled": True})
@@ -0,0 +1,274 @@
+"""准入控制与过载保护
+
+调用大模型的接口耗时长、占用大，突发流量下若全部放行，所有请求都会一起变慢直至超时。
+这里按全局和接口两级限制同时在途的请求数与估算token数；超出限制的请求进入有界等待队列，
+队列已满时立即返回 429，排队超时返回 503，均带 Retry-After，队列深度和等待时间可供监控。
+"""
+
+import functools
+import math
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+from flask import Response, request
+from .blob_store import blob_store
+from ..config import config_manager
+from ..utils import LoggerMixin, OverloadError
+
+# 等待时间统计保留的最近样本数
+_WAIT_SAMPLES = 1000
+
+
+@dataclass
+class EndpointLimit:
+    """接口级限制，0 表示不单独限制"""
+    max_concurrency: int = 0
+    max_tokens: int = 0
+
+
+@dataclass
+class _Usage:
+    """一个限制范围内的在途占用和计数"""
+    inflight: int = 0
+    tokens: int = 0
+    queued: int = 0
+    admitted: int = 0
+    rejected_full: int = 0
+    rejected_timeout: int = 0
+
+
+@dataclass
+class _Ticket:
+    endpoint: str
+    tokens: int
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class AdmissionTicket:
+    """已准入请求的占用凭证，release 可重复调用"""
+
+    def __init__(self, controller: 'AdmissionController', endpoint: str, tokens: int):
+        self._controller = controller
+        self.endpoint = endpoint
+        self.tokens = tokens
+        self.started_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+
+class AdmissionController(LoggerMixin):
+    """全局与接口两级准入控制
+
+    等待者按到达顺序排队；排在前面但仍放不下的请求（例如其接口已满）不会阻塞后面能放下的请求。
+    单个请求的估算token数超过上限时按上限计，即只在空闲时独占执行，而不是永远无法准入。
+    """
+
+    def __init__(self, enabled: bool, max_concurrency: int, max_tokens: int,
+                 queue_size: int, queue_timeout: float,
+                 endpoint_limits: Optional[Dict[str, EndpointLimit]] = None):
+        self.enabled = enabled
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_tokens = max(1, max_tokens)
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout = queue_timeout
+        self.endpoint_limits = endpoint_limits or {}
+        self._cond = threading.Condition()
+        self._queue: List[_Ticket] = []
+        self._global = _Usage()
+        self._endpoints: Dict[str, _Usage] = {}
+        self._waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        # 请求平均占用时长（秒），用于估算 Retry-After
+        self._service_time = 1.0
+
+    def acquire(self, endpoint: str, tokens: int) -> AdmissionTicket:
+        """申请准入，放不下时排队；队列满或排队超时抛出 OverloadError"""
+        tokens = min(max(0, tokens), self.max_tokens)
+        limit = self.endpoint_limits.get(endpoint)
+        if limit and limit.max_tokens:
+            tokens = min(tokens, limit.max_tokens)
+        if not self.enabled:
+            return AdmissionTicket(self, endpoint, tokens)
+
+        ticket = _Ticket(endpoint, tokens)
+        with self._cond:
+            usage = self._endpoints.setdefault(endpoint, _Usage())
+            if self._fits(ticket) and not any(self._fits(waiting) for waiting in self._queue):
+                return self._admit(ticket, usage)
+            if len(self._queue) >= self.queue_size:
+                usage.rejected_full += 1
+                self._global.rejected_full += 1
+                raise OverloadError(
+                    "服务繁忙，等待队列已满，请稍后重试",
+                    status_code=429,
+                    retry_after=self._retry_after(),
+                    error_code="QUEUE_FULL",
+                    details={"endpoint": endpoint, "queue_depth": len(self._queue)}
+                )
+
+            self._queue.append(ticket)
+            usage.queued += 1
+            self._global.queued += 1
+            deadline = ticket.enqueued_at + self.queue_timeout
+            try:
+                while not self._can_admit(ticket):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        usage.rejected_timeout += 1
+                        self._global.rejected_timeout += 1
+                        raise OverloadError(
+                            "服务繁忙，排队等待超时，请稍后重试",
+                            status_code=503,
+                            retry_after=self._retry_after(),
+                            error_code="QUEUE_TIMEOUT",
+                            details={"endpoint": endpoint, "waited_ms": int(self.queue_timeout * 1000)}
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._queue.remove(ticket)
+                usage.queued -= 1
+                self._global.queued -= 1
+                # 出队后后面的等待者可能已能准入
+                self._cond.notify_all()
+            return self._admit(ticket, usage)
+
+    def _fits(self, ticket: _Ticket) -> bool:
+        if self._global.inflight >= self.max_concurrency:
+            return False
+        if self._global.inflight and self._global.tokens + ticket.tokens > self.max_tokens:
+            return False
+        limit = self.endpoint_limits.get(ticket.endpoint)
+        if limit:
+            usage = self._endpoints[ticket.endpoint]
+            if limit.max_concurrency and usage.inflight >= limit.max_concurrency:
+                return False
+            if limit.max_tokens and usage.inflight and usage.tokens + ticket.tokens > limit.max_tokens:
+                return False
+        return True
+
+    def _can_admit(self, ticket: _Ticket) -> bool:
+        """能放下且前面没有同样能放下的等待者"""
+        for waiting in self._queue:
+            if waiting is ticket:
+                return self._fits(ticket)
+            if self._fits(waiting):
+                return False
+        return False
+
+    def _admit(self, ticket: _Ticket, usage: _Usage) -> AdmissionTicket:
+        for scope in (self._global, usage):
+            scope.inflight += 1
+            scope.tokens += ticket.tokens
+            scope.admitted += 1
+        self._waits.append(time.monotonic() - ticket.enqueued_at)
+        return AdmissionTicket(self, ticket.endpoint, ticket.tokens)
+
+    def _release(self, admitted: AdmissionTicket) -> None:
+        if not self.enabled:
+            return
+        with self._cond:
+            for scope in (self._global, self._endpoints[admitted.endpoint]):
+                scope.inflight -= 1
+                scope.tokens -= admitted.tokens
+            elapsed = time.monotonic() - admitted.started_at
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+            self._cond.notify_all()
+
+    def _retry_after(self) -> int:
+        """按平均占用时长和排队深度估算重试间隔（秒）"""
+        rounds = (len(self._queue) + 1) / self.max_concurrency
+        return min(120, max(1, math.ceil(self._service_time * rounds)))
+
+    def get_stats(self) -> Dict:
+        """准入状态与排队指标"""
+        with self._cond:
+            waits = sorted(self._waits)
+            endpoints = {
+                name: {
+                    "inflight": usage.inflight,
+                    "inflight_tokens": usage.tokens,
+                    "queued": usage.queued,
+                    "admitted": usage.admitted,
+                    "rejected_queue_full": usage.rejected_full,
+                    "rejected_timeout": usage.rejected_timeout
+                }
+                for name, usage in self._endpoints.items()
+            }
+            return {
+                "enabled": self.enabled,
+                "inflight": self._global.inflight,
+                "inflight_tokens": self._global.tokens,
+                "queue_depth": len(self._queue),
+                "admitted": self._global.admitted,
+                "rejected_queue_full": self._global.rejected_full,
+                "rejected_timeout": self._global.rejected_timeout,
+                "wait_ms": {
+                    "avg": round(sum(waits) / len(waits) * 1000, 1) if waits else 0,
+                    "p95": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0,
+                    "max": round(waits[-1] * 1000, 1) if waits else 0
+                },
+                "avg_service_ms": round(self._service_time * 1000, 1),
+                "limits": {
+                    "max_concurrency": self.max_concurrency,
+                    "max_tokens": self.max_tokens,
+                    "queue_size": self.queue_size,
+                    "queue_timeout": self.queue_timeout
+                },
+                "endpoints": endpoints
+            }
+
+
+def admission_controlled(func: Callable) -> Callable:
+    """控制器准入装饰器
+
+    按请求体及其引用的上传内容大小估算token数（每3字节约1个token，偏保守）。流式响应在响应关闭时才释放占用。
+    需放在 handle_api_error 之下，使 OverloadError 被转换为带 Retry-After 的响应。
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        size = (request.content_length or 0) + blob_store.referenced_bytes(request.get_json(silent=True))
+        ticket = admission_controller.acquire(func.__name__, size // 3)
+        deferred = False
+        try:
+            response = func(*args, **kwargs)
+            if isinstance(response, Response) and response.is_streamed:
+                response.call_on_close(ticket.release)
+                deferred = True
+            return response
+        finally:
+            if not deferred:
+                ticket.release()
+
+    return wrapper
+
+
+def _parse_endpoint_limits(value: str) -> Dict[str, EndpointLimit]:
+    """解析 "接口名:并发数:token数" 列表，逗号分隔，token数可省略"""
+    limits = {}
+    for entry in value.split(','):
+        parts = [part.strip() for part in entry.split(':')]
+        if not parts[0]:
+            continue
+        limits[parts[0]] = EndpointLimit(
+            max_concurrency=int(parts[1]) if len(parts) > 1 and parts[1] else 0,
+            max_tokens=int(parts[2]) if len(parts) > 2 and parts[2] else 0
+        )
+    return limits
+
+
+# 全局准入控制实例
+admission_controller = AdmissionController(
+    enabled=config_manager.get_config_value('admission', 'enabled', 'true').lower() == 'true',
+    max_concurrency=int(config_manager.get_config_value('admission', 'max_concurrency', '8')),
+    max_tokens=int(config_manager.get_config_value('admission', 'max_tokens', '400000')),
+    queue_size=int(config_manager.get_config_value('admission', 'queue_size', '32')),
+    queue_timeout=float(config_manager.get_config_value('admission', 'queue_timeout', '30')),
+    endpoint_limits=_parse_endpoint_limits(
+        config_manager.get_config_value('admission', 'endpoint_limits', '')
+    )
+)
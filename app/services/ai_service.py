@@ -1,32 +1,137 @@
 """AI服务层"""
 
+import contextvars
 import requests
 import json
 import re
-from typing import Optional, Dict, Any, List
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .prompt_templates import PromptTemplate, CHUNK_SUMMARY_TEMPLATE, estimate_tokens
+from .provider_scheduler import provider_scheduler
 from ..config import config_manager, APIConfig
 from ..utils import (
-    AIServiceError, AuthenticationError, RateLimitError, 
-    handle_service_error, LoggerMixin
+    AIServiceError, AuthenticationError, RateLimitError, RequestCancelledError, DeadlineExceededError,
+    handle_service_error, LoggerMixin, cancellable_session, get_cancel_token, raise_if_cancelled,
+    check_deadline, deadline_policy, get_remaining_time, set_partial_result, cpu_pool
 )
 
 
+# Ollama未指定回复长度时为回复预留的token数
+OLLAMA_REPLY_TOKENS = 2048
+
+# 最近一次模型调用的token用量，按线程/上下文隔离
+_last_usage: contextvars.ContextVar = contextvars.ContextVar('last_usage', default=None)
+
+
+@dataclass
+class EarlyExit:
+    """分块分析的提前结束条件：某一块的结果满足 decisive 时跳过其余分块，并记录在哪一块结束"""
+    decisive: Callable[[Any], bool]
+    chunk: int = 0
+    chunks: int = 0
+
+    def check(self, result: Any, index: int, total: int) -> bool:
+        if index < total and self.decisive(result):
+            self.chunk, self.chunks = index, total
+            return True
+        return False
+
+    @property
+    def report(self) -> Optional[Dict[str, int]]:
+        if not self.chunk:
+            return None
+        return {"chunk": self.chunk, "chunks": self.chunks, "skipped": self.chunks - self.chunk}
+
+
 class AIService(LoggerMixin):
     """AI服务统一接口"""
     
     def __init__(self):
         self.config = config_manager.get_api_config()
         self.timeout = 120
+        # 连接可被请求的取消令牌关闭，客户端断开或取消时正在进行的模型调用立即中止
+        self.session = cancellable_session()
+        self._usage_lock = threading.Lock()
+        self._usage_totals = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        self._load_ollama_settings()
     
     def reload_config(self) -> None:
         """重新加载配置"""
         config_manager.load_config()
         self.config = config_manager.get_api_config()
+        self._load_ollama_settings()
         self.logger.info(f"AI服务配置已重新加载: {self.config.api_type}")
+        self.warmup()
+    
+    def _load_ollama_settings(self) -> None:
+        """读取Ollama的常驻时长、上下文大小和并行槽位配置"""
+        self.ollama_keep_alive = config_manager.get_config_value('ollama', 'keep_alive', '30m')
+        self.ollama_num_ctx = int(config_manager.get_config_value('ollama', 'num_ctx', '8192'))
+        self.ollama_num_ctx_max = max(self.ollama_num_ctx,
+                                      int(config_manager.get_config_value('ollama', 'num_ctx_max', '32768')))
+        self.ollama_parallel = int(config_manager.get_config_value('ollama', 'parallel', '1'))
+        self.ollama_warmup = config_manager.get_config_value('ollama', 'warmup', 'true').lower() == 'true'
+        # 当前使用的上下文大小，只增不减：Ollama在num_ctx变化时会重新加载模型
+        self._ollama_ctx = self.ollama_num_ctx
+        # 同时发往Ollama的调用不超过其并行槽位，多出的在调度器中排队而不是在Ollama内部排队
+        provider_scheduler.set_capacity(self.ollama_parallel if self.config.api_type == "ollama" else None)
+    
+    def warmup(self) -> None:
+        """后台预加载Ollama模型，避免空闲后第一个请求承担模型加载时间"""
+        if self.config.api_type != "ollama" or not self.ollama_warmup or self.config.validate():
+            return
+        threading.Thread(target=self._warmup_ollama, name="ollama-warmup", daemon=True).start()
+    
+    def _warmup_ollama(self) -> None:
+        # messages 为空时Ollama只加载模型，不做生成
+        payload = {
+            "model": self.config.model,
+            "messages": [],
+            "keep_alive": self.ollama_keep_alive,
+            "options": {"num_ctx": self._ollama_ctx}
+        }
+        start_time = time.perf_counter()
+        try:
+            response = self.session.post(self.config.api_url, json=payload, timeout=self.timeout)
+            if response.status_code != 200:
+                self.logger.warning(f"Ollama模型预加载失败，状态码: {response.status_code}")
+                return
+            self.logger.info("Ollama模型预加载完成", extra={
+                "model": self.config.model,
+                "num_ctx": self._ollama_ctx,
+                "duration_ms": round((time.perf_counter() - start_time) * 1000, 2)
+            })
+        except requests.exceptions.RequestException as e:
+            self.logger.warning(f"Ollama模型预加载失败: {str(e)}")
+    
+    def _ollama_context_size(self, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> int:
+        """按本次提示词和回复预算确定num_ctx，按2的幂取整以减少模型重新加载"""
+        needed = sum(self._estimate_tokens(message["content"]) for message in messages)
+        needed += max_tokens or OLLAMA_REPLY_TOKENS
+        if needed > self.ollama_num_ctx_max:
+            self.logger.warning(f"提示词估算{needed}个token，超过Ollama上下文上限{self.ollama_num_ctx_max}，可能被截断")
+        size = self.ollama_num_ctx
+        while size < needed and size < self.ollama_num_ctx_max:
+            size *= 2
+        size = min(size, self.ollama_num_ctx_max)
+        if size > self._ollama_ctx:
+            self.logger.info(f"Ollama上下文扩大: {self._ollama_ctx} -> {size}")
+            self._ollama_ctx = size
+        return self._ollama_ctx
     
     @handle_service_error
-    def chat_completion(self, prompt: str, temperature: float = 0.3) -> str:
-        """统一的聊天完成接口"""
+    def chat_completion(self, prompt: str, temperature: float = 0.3, max_tokens: Optional[int] = None,
+                        stop: Optional[List[str]] = None, json_schema: Optional[Dict[str, Any]] = None,
+                        system: Optional[str] = None, timeout: Optional[float] = None) -> str:
+        """统一的聊天完成接口
+
+        system 为固定的系统消息（见 prompt_templates），prompt 为用户消息。
+        max_tokens 和 stop 限制回复长度；传入 json_schema 时要求模型输出JSON
+        （Ollama按Schema约束解码，DeepSeek/OpenRouter使用JSON模式）。
+        timeout 为本次调用分到的时间，读取超时不超过它和请求剩余时间中的较小者。
+        """
         self.logger.info(f"开始AI请求: {self.config.api_type}, prompt长度: {len(prompt)}")
         
         # 验证配置
@@ -34,20 +139,108 @@ class AIService(LoggerMixin):
         if errors:
             raise AIServiceError(f"配置验证失败: {'; '.join(errors)}")
         
-        try:
-            if self.config.api_type == "deepseek":
-                return self._call_deepseek(prompt, temperature)
-            elif self.config.api_type == "openrouter":
-                return self._call_openrouter(prompt, temperature)
-            elif self.config.api_type == "ollama":
-                return self._call_ollama(prompt, temperature)
-            else:
-                raise AIServiceError(f"不支持的API类型: {self.config.api_type}")
-        except Exception as e:
-            self.logger.error(f"AI请求失败: {str(e)}")
-            raise
+        raise_if_cancelled()
+        check_deadline()
+        _last_usage.set(None)
+        messages = self._build_messages(prompt, system)
+        queued_at = time.perf_counter()
+        # 按通道和客户端公平分配模型调用槽位
+        with provider_scheduler.slot():
+            start_time = time.perf_counter()
+            try:
+                generation = {"max_tokens": max_tokens, "stop": stop, "json_schema": json_schema, "timeout": timeout}
+                if self.config.api_type == "deepseek":
+                    result = self._call_deepseek(messages, temperature, **generation)
+                elif self.config.api_type == "openrouter":
+                    result = self._call_openrouter(messages, temperature, **generation)
+                elif self.config.api_type == "ollama":
+                    result = self._call_ollama(messages, temperature, **generation)
+                else:
+                    raise AIServiceError(f"不支持的API类型: {self.config.api_type}")
+            except Exception as e:
+                token = get_cancel_token()
+                if token is not None and token.cancelled:
+                    self.logger.info("AI请求已随请求取消而中止", extra={
+                        "duration_ms": round((time.perf_counter() - start_time) * 1000, 2)
+                    })
+                    raise RequestCancelledError("请求已取消", "REQUEST_CANCELLED", {"reason": token.reason}) from e
+                remaining = get_remaining_time()
+                if remaining is not None and remaining <= 0:
+                    self.logger.warning("AI请求因请求超过截止时间而中止")
+                    raise DeadlineExceededError("请求已超过截止时间", "DEADLINE_EXCEEDED") from e
+                self.logger.error(f"AI请求失败: {str(e)}", extra={
+                    "duration_ms": round((time.perf_counter() - start_time) * 1000, 2)
+                })
+                raise
+        
+        self.logger.info("AI请求完成", extra={
+            "api_type": self.config.api_type,
+            "queue_ms": round((start_time - queued_at) * 1000, 2),
+            "duration_ms": round((time.perf_counter() - start_time) * 1000, 2),
+            "response_length": len(result),
+            **(_last_usage.get() or {})
+        })
+        return result
+    
+    def _http_timeout(self, budget: Optional[float]) -> Tuple[float, float]:
+        """(连接超时, 读取超时)：读取超时取本次调用分到的时间和请求剩余时间中的较小者，无截止时间时使用默认值"""
+        remaining = get_remaining_time()
+        read = self.timeout if remaining is None else remaining
+        if budget is not None:
+            read = min(read, budget)
+        if read <= 0:
+            raise DeadlineExceededError("请求已超过截止时间", "DEADLINE_EXCEEDED")
+        return min(deadline_policy.connect_timeout, read), read
+    
+    @staticmethod
+    def _build_messages(prompt: str, system: Optional[str]) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": system}] if system else []
+        messages.append({"role": "user", "content": prompt})
+        return messages
+    
+    def _record_usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int],
+                      cached_tokens: Optional[int]) -> None:
+        """记录单次调用的token用量（含命中提供方前缀缓存的token数）并累计"""
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens
+        }
+        _last_usage.set(usage)
+        with self._usage_lock:
+            self._usage_totals["calls"] += 1
+            for key, value in usage.items():
+                self._usage_totals[key] += value or 0
+    
+    def last_usage(self) -> Optional[Dict[str, Any]]:
+        """当前线程最近一次调用的token用量"""
+        return _last_usage.get()
     
-    def _call_deepseek(self, prompt: str, temperature: float) -> str:
+    def get_usage_stats(self) -> Dict[str, Any]:
+        """累计token用量与前缀缓存命中率"""
+        with self._usage_lock:
+            stats = dict(self._usage_totals)
+        stats["cache_hit_ratio"] = (
+            round(stats["cached_tokens"] / stats["prompt_tokens"], 4) if stats["prompt_tokens"] else 0.0
+        )
+        return stats
+    
+    @staticmethod
+    def _openai_generation_options(max_tokens: Optional[int], stop: Optional[List[str]],
+                                   json_schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """OpenAI兼容接口的长度、停止序列和JSON输出参数"""
+        options: Dict[str, Any] = {}
+        if max_tokens:
+            options["max_tokens"] = max_tokens
+        if stop:
+            options["stop"] = stop
+        if json_schema:
+            options["response_format"] = {"type": "json_object"}
+        return options
+    
+    def _call_deepseek(self, messages: List[Dict[str, str]], temperature: float, max_tokens: Optional[int] = None,
+                       stop: Optional[List[str]] = None, json_schema: Optional[Dict[str, Any]] = None,
+                       timeout: Optional[float] = None) -> str:
         """调用DeepSeek API"""
         headers = {
             "Authorization": f"Bearer {self.config.api_key}",
@@ -56,16 +249,17 @@ class AIService(LoggerMixin):
         
         payload = {
             "model": self.config.model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": temperature
+            "messages": messages,
+            "temperature": temperature,
+            **self._openai_generation_options(max_tokens, stop, json_schema)
         }
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.config.api_url,
                 headers=headers,
                 json=payload,
-                timeout=self.timeout
+                timeout=self._http_timeout(timeout)
             )
             
             return self._handle_response(response, "DeepSeek")
@@ -77,7 +271,9 @@ class AIService(LoggerMixin):
         except requests.exceptions.RequestException as e:
             raise AIServiceError(f"DeepSeek API请求失败: {str(e)}")
     
-    def _call_openrouter(self, prompt: str, temperature: float) -> str:
+    def _call_openrouter(self, messages: List[Dict[str, str]], temperature: float, max_tokens: Optional[int] = None,
+                         stop: Optional[List[str]] = None, json_schema: Optional[Dict[str, Any]] = None,
+                       timeout: Optional[float] = None) -> str:
         """调用OpenRouter API"""
         headers = {
             "Authorization": f"Bearer {self.config.api_key}",
@@ -88,16 +284,17 @@ class AIService(LoggerMixin):
         
         payload = {
             "model": self.config.model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": temperature
+            "messages": messages,
+            "temperature": temperature,
+            **self._openai_generation_options(max_tokens, stop, json_schema)
         }
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.config.api_url,
                 headers=headers,
                 json=payload,
-                timeout=self.timeout
+                timeout=self._http_timeout(timeout)
             )
             
             return self._handle_response(response, "OpenRouter")
@@ -109,22 +306,32 @@ class AIService(LoggerMixin):
         except requests.exceptions.RequestException as e:
             raise AIServiceError(f"OpenRouter API请求失败: {str(e)}")
     
-    def _call_ollama(self, prompt: str, temperature: float) -> str:
+    def _call_ollama(self, messages: List[Dict[str, str]], temperature: float, max_tokens: Optional[int] = None,
+                     stop: Optional[List[str]] = None, json_schema: Optional[Dict[str, Any]] = None,
+                     timeout: Optional[float] = None) -> str:
         """调用Ollama API"""
         payload = {
             "model": self.config.model,
-            "messages": [{"role": "user", "content": prompt}],
+            "messages": messages,
             "stream": False,
+            "keep_alive": self.ollama_keep_alive,
             "options": {
-                "temperature": temperature
+                "temperature": temperature,
+                "num_ctx": self._ollama_context_size(messages, max_tokens)
             }
         }
+        if max_tokens:
+            payload["options"]["num_predict"] = max_tokens
+        if stop:
+            payload["options"]["stop"] = stop
+        if json_schema:
+            payload["format"] = json_schema
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.config.api_url,
                 json=payload,
-                timeout=self.timeout
+                timeout=self._http_timeout(timeout)
             )
             
             if response.status_code != 200:
@@ -135,6 +342,9 @@ class AIService(LoggerMixin):
                 if "message" not in response_data or "content" not in response_data["message"]:
                     raise AIServiceError("Ollama API响应格式错误")
                 
+                # Ollama复用KV缓存时 prompt_eval_count 只统计重新计算的token，不单独给出缓存命中数
+                self._record_usage(response_data.get("prompt_eval_count"), response_data.get("eval_count"), None)
+                
                 content = response_data["message"]["content"]
                 # 移除思考标签
                 content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL)
@@ -180,6 +390,13 @@ class AIService(LoggerMixin):
             if not content:
                 raise AIServiceError(f"{api_name} API返回空内容")
             
+            usage = response_data.get("usage") or {}
+            # DeepSeek 返回 prompt_cache_hit_tokens，OpenAI兼容接口返回 prompt_tokens_details.cached_tokens
+            cached_tokens = usage.get("prompt_cache_hit_tokens")
+            if cached_tokens is None:
+                cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+            self._record_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"), cached_tokens)
+            
             return content
             
         except json.JSONDecodeError:
@@ -217,7 +434,8 @@ class AIService(LoggerMixin):
             "api_type": self.config.api_type,
             "api_url": self.config.api_url,
             "model": self.config.model,
-            "has_api_key": bool(self.config.api_key and self.config.api_key.strip())
+            "has_api_key": bool(self.config.api_key and self.config.api_key.strip()),
+            "usage": self.get_usage_stats()
         }
     
     def _estimate_tokens(self, text: str) -> int:
@@ -225,12 +443,7 @@ class AIService(LoggerMixin):
         # 对于中文文本，1个token约等于1.5-2个字符
         # 对于英文文本，1个token约等于4个字符
         # 为了安全起见，使用更保守的估算
-        chinese_chars = len([c for c in text if '\u4e00' <= c <= '\u9fff'])
-        other_chars = len(text) - chinese_chars
-        
-        # 中文字符按1.5个字符=1个token计算，其他字符按3个字符=1个token计算
-        estimated_tokens = int(chinese_chars / 1.5 + other_chars / 3)
-        return estimated_tokens
+        return estimate_tokens(text)
     
     def _get_max_tokens(self) -> int:
         """获取当前模型的最大token限制"""
@@ -245,73 +458,49 @@ class AIService(LoggerMixin):
         
         # 默认使用65536，为安全起见留出更多余量
         max_tokens = model_limits.get(self.config.model, 65536)
+        if self.config.api_type == "ollama":
+            # Ollama的上下文由num_ctx决定，按其上限分块，避免超长部分被静默截断
+            max_tokens = self.ollama_num_ctx_max
         return int(max_tokens * 0.6)  # 留出40%的余量给系统提示和响应，更加保守
     
+    def content_budget(self, template: PromptTemplate, context: str = "") -> int:
+        """单次调用中留给待分析内容的token数，不超过它的内容不会被分块"""
+        return self._get_max_tokens() - template.overhead_tokens - self._estimate_tokens(context)
+    
     def _split_text_by_lines(self, text: str, max_tokens: int) -> List[str]:
-        """按行分割文本，确保每个块不超过token限制"""
-        lines = text.split('\n')
-        chunks = []
-        current_chunk = []
-        current_tokens = 0
-        
-        for line in lines:
-            line_tokens = self._estimate_tokens(line)
-            
-            # 如果单行就超过限制，需要进一步分割
-            if line_tokens > max_tokens:
-                # 先保存当前块
-                if current_chunk:
-                    chunks.append('\n'.join(current_chunk))
-                    current_chunk = []
-                    current_tokens = 0
-                
-                # 分割长行
-                char_limit = max_tokens * 4  # 粗略估算字符数
-                for i in range(0, len(line), char_limit):
-                    chunks.append(line[i:i + char_limit])
-                continue
-            
-            # 检查是否会超过限制
-            if current_tokens + line_tokens > max_tokens:
-                # 保存当前块并开始新块
-                if current_chunk:
-                    chunks.append('\n'.join(current_chunk))
-                current_chunk = [line]
-                current_tokens = line_tokens
-            else:
-                # 添加到当前块
-                current_chunk.append(line)
-                current_tokens += line_tokens
-        
-        # 添加最后一个块
-        if current_chunk:
-            chunks.append('\n'.join(current_chunk))
-        
-        return chunks
+        """按行分割文本，确保每个块不超过token限制
+
+        逐行估算在CPU进程池中进行，只传回各块的起止位置，再在本进程中切出各块。
+        """
+        return [text[start:end] for start, end in cpu_pool.run(split_line_spans, text, max_tokens)]
     
-    def chat_completion_with_chunking(self, base_prompt: str, content: str, 
-                                    temperature: float = 0.3, 
-                                    chunk_prompt_template: str = None) -> str:
-        """支持文本分块的聊天完成接口"""
-        # 估算总token数
-        total_tokens = self._estimate_tokens(base_prompt + content)
+    def chat_completion_with_chunking(self, template: PromptTemplate, content: str,
+                                      temperature: float = 0.3, context: str = "",
+                                      early_exit: Optional[EarlyExit] = None) -> str:
+        """支持文本分块的聊天完成接口
+
+        template 的固定说明作为系统消息发送，context（文件名、分析选项等可变信息）和
+        分块序号放在用户消息开头，待分析内容放在最后，各块共享相同的缓存前缀。
+        指定 early_exit 时，某一块得出明确结论后跳过其余分块，也不再生成总结。
+        请求有截止时间时，剩余时间按还要进行的调用数分配；到期时返回已完成分块的结果并标记为部分结果。
+        """
+        # 估算总token数，模板部分的token数在注册时已计算
+        overhead_tokens = template.overhead_tokens + self._estimate_tokens(context)
+        total_tokens = overhead_tokens + self._estimate_tokens(content)
         max_tokens = self._get_max_tokens()
         
-        self.logger.info(f"文本分块处理 - 内容长度: {len(content)}, 估算token数: {total_tokens}, 最大限制: {max_tokens}")
+        self.logger.info(f"文本分块处理 - 模板: {template.name}, 内容长度: {len(content)}, 估算token数: {total_tokens}, 最大限制: {max_tokens}")
         
         # 如果不超过限制，直接调用原方法
         if total_tokens <= max_tokens:
-            full_prompt = base_prompt.replace("{content}", content)
-            return self.chat_completion(full_prompt, temperature)
+            return self.chat_completion(template.render(content, context), temperature, system=template.system)
         
         # 需要分块处理
         self.logger.info("内容过长，开始分块处理")
         
-        # 计算可用于内容的token数
-        base_tokens = self._estimate_tokens(base_prompt)
-        # 留出更多缓冲：基础提示 + 分块说明 + 响应空间
-        buffer_tokens = 2000  # 增加缓冲区
-        available_tokens = max_tokens - base_tokens - buffer_tokens
+        # 留出更多缓冲：分块说明 + 响应空间
+        buffer_tokens = 2000
+        available_tokens = max_tokens - overhead_tokens - buffer_tokens
         
         if available_tokens <= 0:
             raise AIServiceError("基础提示过长，无法进行分块处理")
@@ -323,58 +512,105 @@ class AIService(LoggerMixin):
         # 记录每个块的大小
         for i, chunk in enumerate(chunks, 1):
             chunk_tokens = self._estimate_tokens(chunk)
-            self.logger.info(f"第{i}块: {len(chunk)}字符, 估算{chunk_tokens}个token")
-        
-        # 设置分块提示模板
-        if chunk_prompt_template is None:
-            chunk_prompt_template = base_prompt + "\n\n注意：这是第{chunk_index}/{total_chunks}部分内容，请分析这部分内容：\n{content}"
+            self.logger.info(f"第{i}块: {len(chunk)}字符, 估算{chunk_tokens}个token", extra={'high_volume': True})
         
         # 处理每个块
         results = []
+        summarize = len(chunks) > 3
+        completed = 0
         for i, chunk in enumerate(chunks, 1):
-            # 先替换base_prompt中的{content}占位符
-            current_prompt = base_prompt.replace("{content}", chunk)
-            # 如果使用自定义模板，则格式化模板
-            if chunk_prompt_template != base_prompt + "\n\n注意：这是第{chunk_index}/{total_chunks}部分内容，请分析这部分内容：\n{content}":
-                chunk_prompt = chunk_prompt_template.format(
-                    chunk_index=i,
-                    total_chunks=len(chunks),
-                    content=chunk
-                )
-            else:
-                chunk_prompt = current_prompt + f"\n\n注意：这是第{i}/{len(chunks)}部分内容。"
+            chunk_note = f"注意：这是第{i}/{len(chunks)}部分内容。"
+            chunk_context = f"{context.strip()}\n\n{chunk_note}" if context.strip() else chunk_note
             
-            self.logger.info(f"处理第 {i}/{len(chunks)} 个块")
+            self.logger.info(f"处理第 {i}/{len(chunks)} 个块", extra={'high_volume': True})
+            # 剩余时间按本块、其余分块和总结平分
+            budget = deadline_policy.call_budget(len(chunks) - i + 1 + summarize)
             try:
-                result = self.chat_completion(chunk_prompt, temperature)
+                result = self.chat_completion(template.render(chunk, chunk_context), temperature,
+                                              system=template.system, timeout=budget)
                 results.append(f"=== 第{i}部分分析结果 ===\n{result}")
+                completed += 1
+            except RequestCancelledError:
+                self.logger.info(f"请求已取消，停止分块处理（已完成 {i - 1}/{len(chunks)} 块）")
+                raise
+            except DeadlineExceededError:
+                if not completed:
+                    raise
+                self.logger.warning(f"已到达截止时间，返回部分结果（已完成 {completed}/{len(chunks)} 块）")
+                results.append(f"=== 已到达截止时间，第{i}-{len(chunks)}部分未分析，以上为部分结果 ===")
+                set_partial_result({"reason": "deadline", "completed_chunks": completed, "chunks": len(chunks)})
+                return "\n\n".join(results)
             except Exception as e:
                 self.logger.error(f"处理第 {i} 个块时出错: {str(e)}")
                 results.append(f"=== 第{i}部分分析失败 ===\n错误: {str(e)}")
+                continue
+            if early_exit is not None and early_exit.check(result, i, len(chunks)):
+                self.logger.info(f"第 {i} 块已得出明确结论，跳过其余 {len(chunks) - i} 块")
+                results.append(f"=== 第{i}部分已得出明确结论，其余{len(chunks) - i}部分未分析 ===")
+                break
         
         # 合并结果
         combined_result = "\n\n".join(results)
         
         # 如果合并后的结果仍然很长，可以进行总结
-        if len(results) > 3:  # 如果有超过3个块，生成总结
-            summary_prompt = f"""请对以下分块分析结果进行总结和汇总：
-
-{combined_result}
-
-请提供一个综合性的分析总结，包括：
-1. 主要发现和威胁
-2. 整体安全状况评估
-3. 关键建议和处置方案"""
-            
+        if summarize and not (early_exit and early_exit.report):  # 如果有超过3个块，生成总结
             try:
-                summary = self.chat_completion(summary_prompt, temperature)
+                summary = self.chat_completion(
+                    CHUNK_SUMMARY_TEMPLATE.render(combined_result), temperature,
+                    system=CHUNK_SUMMARY_TEMPLATE.system
+                )
                 return f"{combined_result}\n\n=== 综合分析总结 ===\n{summary}"
+            except RequestCancelledError:
+                raise
+            except DeadlineExceededError:
+                self.logger.warning("已到达截止时间，跳过综合总结")
+                set_partial_result({
+                    "reason": "deadline", "completed_chunks": completed, "chunks": len(chunks), "summary": False
+                })
+                return f"{combined_result}\n\n=== 已到达截止时间，未生成综合总结 ==="
             except Exception as e:
                 self.logger.error(f"生成总结时出错: {str(e)}")
                 return combined_result
         
         return combined_result
 
-
 # 全局AI服务实例
-ai_service = AIService()
\ No newline at end of file
+ai_service = AIService()
+
+
+def split_line_spans(text: str, max_tokens: int) -> List[Tuple[int, int]]:
+    """按行分块，返回每块在 text 中的起止位置；单行超过限制时按字符数切开"""
+    spans = []
+    chunk_start: Optional[int] = None
+    chunk_end = 0
+    current_tokens = 0
+    position = 0
+    
+    for line in text.split('\n'):
+        start, end = position, position + len(line)
+        position = end + 1
+        line_tokens = estimate_tokens(line)
+        
+        # 如果单行就超过限制，需要进一步分割
+        if line_tokens > max_tokens:
+            if chunk_start is not None:
+                spans.append((chunk_start, chunk_end))
+                chunk_start, current_tokens = None, 0
+            char_limit = max_tokens * 4  # 粗略估算字符数
+            spans.extend((i, min(i + char_limit, end)) for i in range(start, end, char_limit))
+            continue
+        
+        if current_tokens + line_tokens > max_tokens:
+            # 保存当前块并开始新块
+            if chunk_start is not None:
+                spans.append((chunk_start, chunk_end))
+            chunk_start, chunk_end, current_tokens = start, end, line_tokens
+        else:
+            if chunk_start is None:
+                chunk_start = start
+            chunk_end = end
+            current_tokens += line_tokens
+    
+    if chunk_start is not None:
+        spans.append((chunk_start, chunk_end))
+    return spans
@@ -1,9 +1,102 @@
 """安全分析服务层"""
 
-from typing import Dict, Any, List
-from .ai_service import ai_service
-from ..utils import handle_service_error, LoggerMixin, Validator
-from ..utils.exceptions import ValidationError, APIException
+import contextvars
+import json
+import re
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import BinaryIO, Dict, Any, Iterator, List, Optional, Tuple
+from .ai_service import EarlyExit, ai_service
+from .process_parser import process_parser
+from .process_knowledge import process_knowledge_base
+from .process_fleet import fleet_process_analyzer
+from .js_fingerprint import fingerprint_js
+from .js_slicer import slice_js
+from .regex_verifier import regex_verifier, parse_targets
+from .regex_synthesizer import regex_synthesizer
+from .translation_memory import split_segments, translation_memory
+from .micro_batcher import BatchKind, micro_batcher
+from .ioc_index import ioc_index
+from .log_sampler import focus_log, sample_log
+from .traffic_capture import CaptureStats, RequestGroup, traffic_capture_parser
+from .structured_output import (
+    OUTPUT_MODES, OutputSchema, TRAFFIC_SCHEMA, WEBSHELL_SCHEMA, output_budget
+)
+from .prompt_templates import (
+    TRAFFIC_TEMPLATE, TRAFFIC_BATCH_TEMPLATE, DECODE_TEMPLATE, DECODE_BATCH_TEMPLATE,
+    JS_AUDIT_TEMPLATE, JS_SINK_TEMPLATE, PROCESS_REVIEW_TEMPLATE, PROCESS_FLEET_TEMPLATE,
+    PROCESS_RAW_TEMPLATE, REGEX_TEMPLATE, WEBSHELL_TEMPLATE, WEBLOG_TEMPLATE,
+    WEBLOG_SECTION_TEMPLATES, WEBLOG_CHAT_TEMPLATE, TRANSLATE_TEMPLATE, TRANSLATE_BATCH_TEMPLATE, STRUCTURED_TEMPLATES
+)
+from ..config import config_manager
+from ..utils import (
+    handle_service_error, LoggerMixin, Validator, deadline_policy, get_remaining_time,
+    get_partial_result, set_partial_result, cpu_pool
+)
+from ..utils.exceptions import (
+    ValidationError, APIException, AIServiceError, DeadlineExceededError, RequestCancelledError
+)
+
+# 翻译：单批最大token数、单批最大片段数和并行请求数
+TRANSLATION_BATCH_TOKENS = int(config_manager.get_config_value('translation', 'batch_tokens', '1500'))
+TRANSLATION_BATCH_SEGMENTS = int(config_manager.get_config_value('translation', 'batch_segments', '20'))
+TRANSLATION_MAX_WORKERS = int(config_manager.get_config_value('translation', 'max_workers', '4'))
+# 抓包批量分析：并发请求数和单次最多分析的去重后请求数
+CAPTURE_CONCURRENCY = int(config_manager.get_config_value('traffic', 'capture_concurrency', '4'))
+CAPTURE_MAX_REQUESTS = int(config_manager.get_config_value('traffic', 'capture_max_requests', '500'))
+# 抓包批量分析默认使用仅判定的结构化输出
+CAPTURE_OUTPUT_MODE = config_manager.get_config_value('traffic', 'capture_output_mode', 'verdict').strip()
+
+# Web日志超出单次提示预算时的处理方式：chunk 分块逐块分析，sample 本地评分抽样后只调用一次
+LOG_REDUCTION_MODES = ("chunk", "sample")
+LOG_REDUCTION_MODE = config_manager.get_config_value('log_sampler', 'reduction', 'chunk').strip()
+
+# Web日志各分析选项对应的分析任务；控制器中的选项名作为别名映射到同一项
+WEBLOG_TASKS = {
+    "攻击检测": "识别SQL注入、XSS、文件包含、命令执行等攻击行为",
+    "异常分析": "检测异常访问模式、可疑IP、异常User-Agent",
+    "统计分析": "统计访问频率、热门页面、错误代码分布",
+    "性能分析": "分析响应时间、资源消耗、性能瓶颈",
+}
+WEBLOG_OPTION_ALIASES = {"异常行为": "异常分析", "访问统计": "统计分析"}
+# 选择多个分析选项时每项单独调用并行执行，以及并行请求数
+WEBLOG_FAN_OUT = config_manager.get_config_value('weblog', 'fan_out', 'true').lower() == 'true'
+WEBLOG_MAX_WORKERS = int(config_manager.get_config_value('weblog', 'max_workers', '4'))
+WEBLOG_SAMPLE_NOTE = ("注意：日志超出单次分析的长度，正文开头是基于全部日志的本地统计，"
+                      "其后是按异常评分分层抽取的行，统计结论请以本地统计为准。")
+
+# 判定类分析在某一块得出明确结论后跳过其余分块：开启的分析类型、流量判定所需的置信度、WebShell判定所需的威胁等级
+EARLY_EXIT_TYPES = {
+    name.strip() for name in config_manager.get_config_value(
+        'early_exit', 'analysis_types', 'traffic_analysis, webshell_detection'
+    ).split(',') if name.strip()
+}
+EARLY_EXIT_TRAFFIC_CONFIDENCE = config_manager.get_config_value('early_exit', 'traffic_confidence', '高').strip()
+EARLY_EXIT_WEBSHELL_LEVELS = [
+    level.strip() for level in config_manager.get_config_value(
+        'early_exit', 'webshell_threat_levels', '高危'
+    ).split(',') if level.strip()
+]
+
+# 可微批合并的请求类型
+TRAFFIC_BATCH = BatchKind(
+    name="traffic",
+    item_label="HTTP请求",
+    template=TRAFFIC_BATCH_TEMPLATE,
+    required_marker="【分析结果】"
+)
+DECODE_BATCH = BatchKind(
+    name="decode",
+    item_label="待解码字符串",
+    template=DECODE_BATCH_TEMPLATE,
+    required_marker="【最终结果】"
+)
+
+
+def _strip_placeholders(code: str) -> str:
+    """去掉第三方库占位注释，用于判断是否还有需要审计的业务代码"""
+    return re.sub(r'/\* \[已移除第三方库: [^\]]*\] \*/|[;,()\[\]{}!\s]', '', code)
 
 
 class AnalysisService(LoggerMixin):
@@ -13,43 +106,253 @@ class AnalysisService(LoggerMixin):
         self.ai_service = ai_service
     
     @handle_service_error
-    def analyze_traffic(self, http_data: str) -> Dict[str, Any]:
-        """分析网络流量"""
+    def analyze_traffic(self, http_data: str, output_mode: str = "text", full_report: bool = False) -> Dict[str, Any]:
+        """分析网络流量
+
+        output_mode 为 structured 时按JSON Schema输出并解析为字段，verdict 时只输出判定。
+        内容需要分块时，某一块判定为攻击即结束；full_report 为 True 时分析全部分块。
+        """
         # 验证输入
         Validator.validate_http_data(http_data)
+        self._validate_output_mode(output_mode)
         
-        self.logger.info(f"开始流量分析，数据长度: {len(http_data)}")
+        self.logger.info(f"开始流量分析，数据长度: {len(http_data)}, 输出模式: {output_mode}")
         
-        # 构建流量分析提示模板
-        base_prompt = """请进行网络安全分析。请严格按照以下步骤执行：
-1. 分析以下HTTP请求的各个组成部分
-2. 识别是否存在SQL注入、XSS、CSRF、反序列化、文件上传、路径遍历、OWASPTop10、等常见攻击特征
-3. 检查User-Agent等头部信息是否可疑
-4. 如果数据包中有一些编码后的内容，一定要解码后再进行分析
-5. 最终结论：是否为攻击流量（是/否）
-
-请用中文按以下格式响应：
-【分析结果】是/否
-【依据】简明扼要列出技术依据
-
-HTTP请求数据：
-{content}"""
+        if output_mode != "text":
+            early_exit = self._early_exit("traffic_analysis", full_report, lambda item: (
+                item["is_attack"] and item.get("confidence", EARLY_EXIT_TRAFFIC_CONFIDENCE) == EARLY_EXIT_TRAFFIC_CONFIDENCE
+            ))
+            structured = self._structured_completion(TRAFFIC_SCHEMA, http_data, output_mode == "verdict",
+                                                     early_exit=early_exit)
+            self.logger.info(f"流量分析完成，检测结果: {'攻击' if structured['is_attack'] else '正常'}")
+            return self._with_sightings(self._with_progress({
+                "result": TRAFFIC_SCHEMA.render(structured),
+                "is_attack": structured["is_attack"],
+                "structured": structured,
+                "output_mode": output_mode,
+                "analysis_type": "traffic_analysis"
+            }, early_exit), http_data, structured["is_attack"])
         
-        # 使用支持分块的方法处理长文本
-        result = self.ai_service.chat_completion_with_chunking(
-            base_prompt=base_prompt,
-            content=http_data,
-            temperature=0.3
+        # 短请求开启微批时与并发请求合并调用，其余使用支持分块的方法处理长文本
+        early_exit = self._early_exit("traffic_analysis", full_report, lambda text: "【分析结果】是" in text)
+        result = micro_batcher.submit(
+            TRAFFIC_BATCH,
+            http_data,
+            lambda: self.ai_service.chat_completion_with_chunking(
+                template=TRAFFIC_TEMPLATE,
+                content=http_data,
+                temperature=0.3,
+                early_exit=early_exit
+            )
         )
         is_attack = "【分析结果】是" in result
         
         self.logger.info(f"流量分析完成，检测结果: {'攻击' if is_attack else '正常'}")
         
-        return {
+        return self._with_sightings(self._with_progress({
             "result": result,
             "is_attack": is_attack,
+            "output_mode": output_mode,
             "analysis_type": "traffic_analysis"
+        }, early_exit), http_data, is_attack)
+    
+    @staticmethod
+    def _with_sightings(result: Dict[str, Any], content: str, flagged: Optional[bool]) -> Dict[str, Any]:
+        """把输入和结果中的指标记入索引，并附上这些指标此前出现过的记录"""
+        result["prior_sightings"] = ioc_index.record(result["analysis_type"], content, result["result"], flagged)
+        return result
+    
+    @staticmethod
+    def _early_exit(analysis_type: str, full_report: bool, decisive) -> Optional[EarlyExit]:
+        """该分析类型开启提前结束且未要求完整报告时返回结束条件"""
+        if full_report or analysis_type not in EARLY_EXIT_TYPES:
+            return None
+        return EarlyExit(decisive)
+    
+    @staticmethod
+    def _with_progress(result: Dict[str, Any], early_exit: Optional[EarlyExit] = None) -> Dict[str, Any]:
+        """附上提前结束的说明，以及截止时间到达时已完成的部分"""
+        if early_exit is not None and early_exit.report:
+            result["early_exit"] = early_exit.report
+        partial = get_partial_result()
+        if partial:
+            result["partial"] = partial
+        return result
+    
+    @staticmethod
+    def _validate_output_mode(output_mode: str) -> None:
+        if output_mode not in OUTPUT_MODES:
+            raise ValidationError(f"输出模式必须是以下之一: {', '.join(OUTPUT_MODES)}")
+    
+    def _structured_completion(self, schema: OutputSchema, content: str, verdict_only: bool,
+                               context: str = "", early_exit: Optional[EarlyExit] = None) -> Dict[str, Any]:
+        """按结构化输出模式调用模型，内容过长时分块调用并合并各块字段
+
+        指定 early_exit 时按顺序调用，某一块得出明确结论后不再调用其余分块。
+        """
+        template = STRUCTURED_TEMPLATES[(schema.name, verdict_only)]
+        max_tokens = self.ai_service._get_max_tokens()
+        overhead_tokens = template.overhead_tokens + self.ai_service._estimate_tokens(context)
+        if overhead_tokens + self.ai_service._estimate_tokens(content) <= max_tokens:
+            chunks = [content]
+        else:
+            chunks = self.ai_service._split_text_by_lines(content, max_tokens - overhead_tokens - 2000)
+            self.logger.info(f"结构化分析内容过长，分为 {len(chunks)} 块")
+        
+        results = []
+        for i, chunk in enumerate(chunks, 1):
+            try:
+                results.append(self._structured_call(schema, template.system, template.render(chunk, context),
+                                                     verdict_only, deadline_policy.call_budget(len(chunks) - i + 1)))
+            except DeadlineExceededError:
+                if not results:
+                    raise
+                self.logger.warning(f"已到达截止时间，第 {i}-{len(chunks)} 块未分析，返回部分结果")
+                set_partial_result({"reason": "deadline", "completed_chunks": len(results), "chunks": len(chunks)})
+                break
+            if early_exit is not None and early_exit.check(results[-1], i, len(chunks)):
+                self.logger.info(f"第 {i} 块已得出明确结论，跳过其余 {len(chunks) - i} 块")
+                break
+        return schema.merge(results)
+    
+    def _structured_call(self, schema: OutputSchema, system: str, prompt: str,
+                         verdict_only: bool, timeout: Optional[float] = None) -> Dict[str, Any]:
+        budget = output_budget(verdict_only)
+        error = None
+        # 首次解析失败时去掉停止序列重试一次，避免停止序列截断了字段内容
+        for stop in (budget.stop, None):
+            response = self.ai_service.chat_completion(
+                prompt,
+                temperature=0.1,
+                max_tokens=budget.max_tokens,
+                stop=stop,
+                json_schema=schema.json_schema(verdict_only),
+                system=system,
+                timeout=timeout
+            )
+            try:
+                return schema.parse(response, verdict_only)
+            except ValueError as e:
+                error = e
+                self.logger.warning(f"结构化结果解析失败: {e}")
+        raise AIServiceError(f"模型未返回有效的结构化结果: {error}")
+    
+    @handle_service_error
+    def analyze_capture(self, stream: BinaryIO, output_mode: str = "") -> Iterator[Dict[str, Any]]:
+        """批量分析HAR/PCAP/PCAPNG抓包
+
+        抓包在本地解析、重组和去重后才开始调用大模型，格式错误在返回流式结果前抛出；
+        返回的迭代器按完成顺序逐条产出每个请求的判定，最后产出汇总。
+        output_mode 留空时使用配置的 capture_output_mode（默认仅判定）。
+        """
+        output_mode = output_mode or CAPTURE_OUTPUT_MODE
+        self._validate_output_mode(output_mode)
+        stats = CaptureStats()
+        groups = traffic_capture_parser.deduplicate(traffic_capture_parser.parse(stream, stats))
+        if not groups:
+            raise ValidationError("抓包中没有找到HTTP/1.x请求")
+        
+        self.logger.info(
+            f"抓包解析完成，格式: {stats.format}, 数据包: {stats.packets}, "
+            f"请求: {sum(group.count for group in groups)}, 去重后: {len(groups)}"
+        )
+        return self._stream_capture_verdicts(groups, stats, output_mode)
+    
+    def _stream_capture_verdicts(self, groups: List[RequestGroup], stats: CaptureStats,
+                                 output_mode: str) -> Iterator[Dict[str, Any]]:
+        started = time.time()
+        selected = groups[:CAPTURE_MAX_REQUESTS]
+        total = sum(group.count for group in groups)
+        yield {
+            "type": "start",
+            "format": stats.format,
+            "requests": total,
+            "unique_requests": len(groups),
+            "analyzing": len(selected),
+            "output_mode": output_mode
         }
+        
+        attacks = errors = attack_requests = 0
+        attacked_hosts: Counter = Counter()
+        queue = iter(selected)
+        executor = ThreadPoolExecutor(max_workers=CAPTURE_CONCURRENCY)
+        
+        submitted = 0
+        
+        def submit_next(running: dict) -> None:
+            nonlocal submitted
+            remaining = get_remaining_time()
+            if remaining is not None and remaining <= 0:
+                # 已到截止时间，不再提交剩余请求，汇总中计为未分析
+                return
+            group = next(queue, None)
+            if group is not None:
+                submitted += 1
+                # 每个任务单独复制上下文，保留请求ID等日志字段
+                future = executor.submit(contextvars.copy_context().run, self._analyze_capture_group,
+                                         group, output_mode)
+                running[future] = group
+        
+        running: Dict[Any, RequestGroup] = {}
+        try:
+            # 只保持有限个任务在途，客户端中途断开时不会留下大量排队请求
+            for _ in range(CAPTURE_CONCURRENCY):
+                submit_next(running)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    group = running.pop(future)
+                    verdict = future.result()
+                    if "error" in verdict:
+                        errors += 1
+                    elif verdict["is_attack"]:
+                        attacks += 1
+                        attack_requests += group.count
+                        attacked_hosts[group.sample.host] += group.count
+                    yield verdict
+                    submit_next(running)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        
+        self.logger.info(f"抓包批量分析完成，攻击: {attacks}, 失败: {errors}")
+        
+        yield {
+            "type": "summary",
+            "format": stats.format,
+            "packets": stats.packets,
+            "skipped_packets": stats.skipped_packets,
+            "tcp_streams": stats.streams,
+            "reassembly_gaps": stats.gaps,
+            "requests": total,
+            "unique_requests": len(groups),
+            "analyzed": submitted,
+            "not_analyzed": len(groups) - submitted,
+            "deadline_reached": submitted < len(selected),
+            "attacks": attacks,
+            "attack_requests": attack_requests,
+            "errors": errors,
+            "attacked_hosts": dict(attacked_hosts.most_common(10)),
+            "elapsed": round(time.time() - started, 2),
+            "analysis_type": "capture_analysis"
+        }
+    
+    def _analyze_capture_group(self, group: RequestGroup, output_mode: str) -> Dict[str, Any]:
+        verdict = {"type": "verdict", **group.sample.to_dict(), "duplicates": group.count - 1}
+        try:
+            result = self.analyze_traffic(group.sample.raw, output_mode)
+        except RequestCancelledError:
+            raise
+        except APIException as e:
+            self.logger.warning(f"抓包请求 #{group.sample.index} 分析失败: {e.message}")
+            verdict["error"] = e.message
+            return verdict
+        verdict["is_attack"] = result["is_attack"]
+        verdict["result"] = result["result"]
+        if "structured" in result:
+            verdict["structured"] = result["structured"]
+        if result["prior_sightings"]:
+            verdict["prior_sightings"] = result["prior_sightings"]
+        return verdict
     
     @handle_service_error
     def decode_string(self, encoded_str: str) -> Dict[str, Any]:
@@ -59,177 +362,416 @@ HTTP请求数据：
         
         self.logger.info(f"开始字符串解码，长度: {len(encoded_str)}")
         
-        # 构建解码提示模板
-        base_prompt = """请完整分析并解码以下字符串，要求：
-1. 识别所有可能的编码方式（包括嵌套编码）
-2. 通过自己重新编码，确认自己解码正确
-3. 展示完整的解码过程
-4. 输出最终解码结果
-
-原始字符串：{content}
-
-请用中文按以下格式响应：
-【编码分析】列出检测到的编码类型及层级
-【解码过程】逐步展示解码步骤
-【最终结果】解码后的明文内容"""
-        
-        # 使用支持分块的方法处理长文本
-        result = self.ai_service.chat_completion_with_chunking(
-            base_prompt=base_prompt,
-            content=encoded_str,
-            temperature=0.3
+        result = micro_batcher.submit(
+            DECODE_BATCH,
+            encoded_str,
+            lambda: self.ai_service.chat_completion_with_chunking(
+                template=DECODE_TEMPLATE,
+                content=encoded_str,
+                temperature=0.3
+            )
         )
         
         self.logger.info("字符串解码完成")
         
-        return {
+        return self._with_progress({
             "result": result,
             "analysis_type": "string_decode"
-        }
+        })
     
     @handle_service_error
-    def analyze_javascript(self, js_code: str) -> Dict[str, Any]:
-        """JavaScript安全审计"""
+    def analyze_javascript(self, js_code: str, strip_libraries: bool = True,
+                           slice_sinks: bool = False) -> Dict[str, Any]:
+        """JavaScript安全审计
+
+        默认先在本地拆分打包文件并识别第三方库，已知库的版本漏洞直接由指纹库给出，
+        只把剩余的业务代码交给大模型审计。开启 slice_sinks 时进一步在本地定位危险点，
+        只把危险点附近带行号的片段交给大模型。
+        """
         # 验证输入
         Validator.validate_js_code(js_code)
         
         self.logger.info(f"开始JavaScript审计，代码长度: {len(js_code)}")
         
-        # 构建JavaScript审计提示模板
-        base_prompt = """请对以下JavaScript代码进行完整的安全审计，要求：
-1. 识别XSS、CSRF、不安全的DOM操作、敏感信息泄露、eval使用等安全问题
-2. 检查第三方库的安全性和版本漏洞
-3. 分析代码逻辑漏洞
-4. 提供修复建议
-
-请用中文按以下格式响应：
-【高危漏洞】列出高危安全问题及位置
-【中低危问题】列出中低风险问题
-【修复建议】提供具体修复方案
-
-JavaScript代码：
-{content}"""
+        libraries = []
+        audit_code = js_code
+        if strip_libraries:
+            fingerprint = cpu_pool.run(fingerprint_js, js_code)
+            libraries = fingerprint.libraries
+            audit_code = fingerprint.first_party_code
+            self.logger.info(
+                f"第三方库识别完成，打包格式: {fingerprint.bundle_format}, 识别库: {len(libraries)}, "
+                f"剔除代码: {fingerprint.vendor_length}/{fingerprint.total_length}"
+            )
+        has_first_party = bool(_strip_placeholders(audit_code).strip())
         
-        # 使用支持分块的方法处理长文本
-        result = self.ai_service.chat_completion_with_chunking(
-            base_prompt=base_prompt,
-            content=js_code,
-            temperature=0.3
-        )
+        # 在原始代码上定位危险点，行号与提交的代码一致；已剔除的库区间不参与定位
+        findings = []
+        if slice_sinks and has_first_party:
+            excluded = [(lib.start, lib.end) for lib in libraries if lib.stripped]
+            slice_result = cpu_pool.run(slice_js, js_code, excluded)
+            findings = slice_result.findings
+            audit_code = slice_result.content
+        
+        # 切片模式使用带行号的危险点审计模板
+        template = JS_SINK_TEMPLATE if slice_sinks else JS_AUDIT_TEMPLATE
+        
+        ai_result = ""
+        if has_first_party and (findings or not slice_sinks):
+            # 使用支持分块的方法处理长文本
+            ai_result = self.ai_service.chat_completion_with_chunking(
+                template=template,
+                content=audit_code,
+                temperature=0.3
+            )
+        
+        if strip_libraries:
+            result = self._format_library_report(libraries, ai_result, has_first_party)
+        else:
+            result = ai_result
+        if slice_sinks:
+            result = self._format_sink_report(findings, result)
         
         self.logger.info("JavaScript审计完成")
         
-        return {
+        return self._with_progress({
             "result": result,
+            "libraries": [lib.to_dict() for lib in libraries],
+            "vulnerable_libraries": [lib.label for lib in libraries if lib.vulnerabilities],
+            "sinks": [finding.to_dict() for finding in findings],
+            "audited_length": len(audit_code),
             "analysis_type": "javascript_audit"
-        }
+        })
+    
+    @staticmethod
+    def _format_library_report(libraries: list, ai_result: str, has_first_party: bool = True) -> str:
+        """生成第三方库识别与AI审计合并后的报告"""
+        lines = ["【第三方库识别】"]
+        if libraries:
+            for lib in libraries:
+                if lib.verified:
+                    note = "内容哈希验证，已剔除"
+                elif lib.stripped:
+                    note = f"{lib.method}识别，未经哈希验证，已剔除"
+                else:
+                    note = f"{lib.method}识别，未经哈希验证，代码保留审计"
+                lines.append(f"• {lib.label}（{note}）")
+        else:
+            lines.append("• 未识别到已知第三方库")
+        
+        lines.append("【已知漏洞组件】")
+        vulnerable = [lib for lib in libraries if lib.vulnerabilities]
+        for lib in vulnerable:
+            for vuln in lib.vulnerabilities:
+                lines.append(
+                    f"• {lib.label}: {', '.join(vuln.get('identifiers', []))} "
+                    f"[{vuln.get('severity', 'unknown')}] {vuln.get('summary', '')}"
+                )
+        if not vulnerable:
+            lines.append("• 未发现")
+        
+        if ai_result:
+            lines.append("")
+            lines.append("=== AI审计（业务代码） ===")
+            lines.append(ai_result)
+        elif not has_first_party:
+            lines.append("代码均为已识别的第三方库，未调用AI审计。")
+        
+        return "\n".join(lines)
+    
+    @staticmethod
+    def _format_sink_report(findings: list, report: str) -> str:
+        """在审计报告前附加本地危险点定位结果"""
+        lines = ["【危险点定位】"]
+        for finding in findings:
+            lines.append(
+                f"• 第{finding.line}行（原始位置 {finding.original_line}:{finding.original_column}）"
+                f"[{finding.kind}] {finding.description}"
+            )
+        if not findings:
+            lines.append("• 未定位到危险点，未调用AI审计")
+        if report:
+            lines.append("")
+            lines.append(report)
+        return "\n".join(lines)
     
     @handle_service_error
     def analyze_process(self, process_data: str) -> Dict[str, Any]:
-        """进程分析"""
+        """进程分析
+
+        先在本地解析进程列表并用已知进程知识库分类，只有未知或可疑的进程
+        （按映像名去重后）才交给大模型研判。
+        """
         # 验证输入
         Validator.validate_process_data(process_data)
         
         self.logger.info(f"开始进程分析，数据长度: {len(process_data)}")
         
-        prompt = f"""你是一个Windows/Linux进程分析工程师，要求：
-1. 用户将输出tasklist或者ps aux的结果
-2. 帮助用户分析输出你所有认识的进程信息
-3. 识别可能的恶意进程
-4. 识别杀毒软件进程
-5. 识别其他软件进程
-
-tasklist或者ps aux的结果：{process_data}
+        process_format, records = process_parser.parse(process_data)
+        if not records:
+            self.logger.info("无法识别进程列表格式，回退到整体分析")
+            return self._analyze_process_raw(process_data)
+        
+        classifications = process_knowledge_base.classify(records)
+        review_groups = process_knowledge_base.group_for_review(classifications)
+        
+        stats = {}
+        for item in classifications:
+            stats[item.category] = stats.get(item.category, 0) + 1
+        
+        self.logger.info(
+            f"进程列表解析完成，格式: {process_format}, 进程数: {len(records)}, "
+            f"待研判映像: {len(review_groups)}, 分类统计: {stats}"
+        )
+        
+        ai_result = ""
+        if review_groups:
+            review_content = "\n".join(
+                json.dumps(group, ensure_ascii=False) for group in review_groups.values()
+            )
+            ai_result = self.ai_service.chat_completion_with_chunking(
+                template=PROCESS_REVIEW_TEMPLATE,
+                content=review_content,
+                temperature=0.3
+            )
+        
+        result = self._format_process_report(process_format, classifications, review_groups, ai_result)
+        
+        self.logger.info("进程分析完成")
+        
+        return self._with_progress({
+            "result": result,
+            "process_format": process_format,
+            "process_count": len(records),
+            "category_stats": stats,
+            "reviewed_images": list(review_groups.keys()),
+            "analysis_type": "process_analysis"
+        })
+    
+    @handle_service_error
+    def analyze_process_fleet(self, host_dumps: Dict[str, str]) -> Dict[str, Any]:
+        """多主机进程稀有度分析
 
-按优先级列出需要关注的进程
-【可疑进程】
-【杀软进程】
-【第三方软件进程】
-给出具体操作建议：
-• 安全进程的可终止性评估"""
+        统计主机群中各映像名、命令行模式和运行用户的出现频率，只把稀有的离群进程
+        和命中本地规则的进程合并成一批交给大模型，分析成本取决于异常数量而非主机数量。
+        """
+        # 验证输入
+        if not isinstance(host_dumps, dict) or len(host_dumps) < 2:
+            raise ValidationError("多主机分析至少需要2台主机的进程列表")
+        for host, dump in host_dumps.items():
+            Validator.validate_required(str(host), "主机名")
+            if not isinstance(dump, str):
+                raise ValidationError(f"主机 {host} 的进程列表必须是字符串")
+            Validator.validate_process_data(dump)
+        
+        self.logger.info(f"开始多主机进程分析，主机数: {len(host_dumps)}")
+        
+        stats = fleet_process_analyzer.build_statistics(host_dumps)
+        outliers = fleet_process_analyzer.find_outliers(stats)
+        threshold = fleet_process_analyzer.rarity_threshold(stats.host_count)
+        
+        self.logger.info(
+            f"多主机统计完成，进程总数: {stats.process_count}, 映像数: {len(stats.image_hosts)}, "
+            f"稀有阈值: {threshold}, 离群项: {len(outliers)}"
+        )
+        
+        ai_result = ""
+        if outliers or stats.unparsed_dumps:
+            # 无法解析的主机以原始文本形式加入同一批次研判
+            outlier_content = "\n".join(
+                [json.dumps(item, ensure_ascii=False) for item in outliers] +
+                [f"[unparsed] host={host}\n{dump}" for host, dump in stats.unparsed_dumps.items()]
+            )
+            ai_result = self.ai_service.chat_completion_with_chunking(
+                template=PROCESS_FLEET_TEMPLATE,
+                content=outlier_content,
+                temperature=0.3,
+                context=f"主机总数: {stats.host_count} 台，稀有阈值: 出现主机数不超过 {threshold} 台"
+            )
         
-        result = self.ai_service.chat_completion(prompt)
+        summary = (
+            f"【主机群概览】已解析主机 {stats.host_count} 台，无法解析 {len(stats.unparsed_hosts)} 台"
+            f"{'（原始列表已一并交给AI研判）' if stats.unparsed_hosts else ''}，"
+            f"进程 {stats.process_count} 个，不同映像 {len(stats.image_hosts)} 个，"
+            f"稀有阈值 ≤{threshold} 台，离群项 {len(outliers)} 个"
+        )
+        result = f"{summary}\n\n=== AI研判（离群项） ===\n{ai_result}" if ai_result else f"{summary}\n未发现离群进程。"
+        
+        self.logger.info("多主机进程分析完成")
+        
+        return self._with_progress({
+            "result": result,
+            "host_count": stats.host_count,
+            "unparsed_hosts": stats.unparsed_hosts,
+            "process_count": stats.process_count,
+            "distinct_images": len(stats.image_hosts),
+            "rarity_threshold": threshold,
+            "outliers": outliers,
+            "analysis_type": "process_fleet_analysis"
+        })
+    
+    def _analyze_process_raw(self, process_data: str) -> Dict[str, Any]:
+        """无法解析时，将原始进程列表交给大模型分析"""
+        result = self.ai_service.chat_completion_with_chunking(
+            template=PROCESS_RAW_TEMPLATE,
+            content=process_data,
+            temperature=0.3
+        )
         
         self.logger.info("进程分析完成")
         
-        return {
+        return self._with_progress({
             "result": result,
             "analysis_type": "process_analysis"
-        }
+        })
+    
+    @staticmethod
+    def _format_process_report(process_format: str, classifications: list,
+                               review_groups: dict, ai_result: str) -> str:
+        """生成本地分类与AI研判合并后的进程分析报告"""
+        def products(category: str) -> List[str]:
+            seen = {}
+            for item in classifications:
+                if item.category == category and item.info:
+                    label = item.info.product or item.info.vendor
+                    seen.setdefault(label, set()).add(item.record.image)
+            return [f"• {label}: {', '.join(sorted(images))}" for label, images in seen.items()]
+        
+        known = sum(1 for item in classifications if not item.needs_review)
+        lines = [
+            f"【进程概览】格式: {process_format}，共 {len(classifications)} 个进程，"
+            f"知识库已识别 {known} 个，待研判映像 {len(review_groups)} 个"
+        ]
+        
+        suspicious = [group for group in review_groups.values() if group["category"] in ('suspicious', 'dual_use')]
+        if suspicious:
+            lines.append("【本地规则告警】")
+            lines.extend(
+                f"• {group['image']} (PID: {', '.join(group['pids'])}): {'; '.join(group['reasons'])}"
+                for group in suspicious
+            )
+        
+        lines.append("【杀软进程】（知识库识别）")
+        lines.extend(products('security') or ["• 未发现"])
+        lines.append("【第三方软件进程】（知识库识别）")
+        lines.extend(products('software') or ["• 未发现"])
+        
+        system_count = sum(1 for item in classifications if item.category == 'system')
+        lines.append(f"【系统进程】共 {system_count} 个，均为已知系统进程")
+        
+        if ai_result:
+            lines.append("")
+            lines.append("=== AI研判（未知/可疑进程） ===")
+            lines.append(ai_result)
+        else:
+            lines.append("所有进程均已被本地知识库识别，未发现需要AI研判的进程。")
+        
+        return "\n".join(lines)
     
     @handle_service_error
     def generate_regex(self, source_text: str, target_text: str) -> Dict[str, Any]:
-        """生成正则表达式"""
+        """生成正则表达式
+
+        简单的提取需求先在本地根据示例合成正则，合成结果精确匹配目标时直接返回；
+        否则由模型生成，候选正则在本地编译并用源文本、目标文本测试，同时做ReDoS检查和耗时测试，
+        全部候选未通过时把失败原因反馈给模型重新生成。
+        """
         # 验证输入
         Validator.validate_required(source_text, "源文本")
         Validator.validate_required(target_text, "目标文本")
         
         self.logger.info(f"开始生成正则表达式，源文本长度: {len(source_text)}, 目标长度: {len(target_text)}")
         
-        prompt = f"""请根据以下要求生成正则表达式：
-
-源文本：
-{source_text}
-
-需要匹配的目标：
-{target_text}
+        synthesized = regex_synthesizer.synthesize(source_text, target_text)
+        if synthesized:
+            return {
+                "result": regex_synthesizer.format_result(synthesized, parse_targets(target_text)),
+                "best_regex": synthesized.pattern,
+                "verified": True,
+                "candidates": [synthesized.candidate.to_dict()],
+                "retries": 0,
+                "synthesized": True,
+                "analysis_type": "regex_generation"
+            }
+        
+        prompt = REGEX_TEMPLATE.render(source_text, context=f"需要匹配的目标：\n{target_text}")
+        
+        result = self.ai_service.chat_completion(prompt, system=REGEX_TEMPLATE.system)
+        report = regex_verifier.verify_response(result, source_text, target_text)
+        
+        retries = 0
+        while not report.passed and retries < regex_verifier.max_retries:
+            retries += 1
+            self.logger.info(f"候选正则均未通过本地验证，第 {retries} 次重新生成")
+            retry_prompt = f"""{prompt}
 
-要求：
-1. 生成能够准确匹配目标文本的正则表达式
-2. 考虑边界情况和特殊字符
-3. 提供多种匹配方案（严格匹配、宽松匹配等）
-4. 解释正则表达式的含义
-5. 提供测试用例
+你上一次给出的正则已在本地用源文本和目标文本测试，全部未通过：
+{regex_verifier.describe_failures(report)}
 
-请用中文按以下格式响应：
-【推荐正则】最佳匹配方案
-【备选方案】其他可选的正则表达式
-【表达式解释】详细说明正则含义
-【测试用例】提供测试示例"""
+请针对上述问题重新生成正则表达式：目标必须被完整匹配，源文本中的其他内容不能被匹配，
+避免嵌套量词和可重叠的相邻量词。每个正则单独放在【推荐正则】或【备选方案】下的代码块中。"""
+            retry_result = self.ai_service.chat_completion(retry_prompt, system=REGEX_TEMPLATE.system)
+            result = f"{result}\n\n=== 根据本地验证结果重新生成（第{retries}次） ===\n{retry_result}"
+            report = regex_verifier.verify_response(retry_result, source_text, target_text, previous=report)
         
-        result = self.ai_service.chat_completion(prompt)
-        
-        self.logger.info("正则表达式生成完成")
+        best = report.best
+        self.logger.info(f"正则表达式生成完成，验证通过: {report.passed}, 重新生成次数: {retries}")
         
         return {
-            "result": result,
+            "result": f"{result}\n\n{regex_verifier.format_report(report)}",
+            "best_regex": best.pattern if best and report.passed else None,
+            "verified": report.passed,
+            "candidates": [candidate.to_dict() for candidate in report.candidates],
+            "retries": retries,
+            "synthesized": False,
             "analysis_type": "regex_generation"
         }
     
     @handle_service_error
-    def detect_webshell(self, file_content: str, file_name: str = "") -> Dict[str, Any]:
-        """WebShell检测"""
+    def detect_webshell(self, file_content: str, file_name: str = "", output_mode: str = "text",
+                        full_report: bool = False) -> Dict[str, Any]:
+        """WebShell检测
+
+        内容需要分块时，某一块以配置的威胁等级判定为WebShell即结束；full_report 为 True 时分析全部分块。
+        """
         # 验证输入
         Validator.validate_file_content(file_content)
+        self._validate_output_mode(output_mode)
         
-        self.logger.info(f"开始WebShell检测，文件: {file_name}, 内容长度: {len(file_content)}")
+        self.logger.info(f"开始WebShell检测，文件: {file_name}, 内容长度: {len(file_content)}, 输出模式: {output_mode}")
         
-        # 构建WebShell检测提示模板
-        base_prompt = f"""请对以下文件进行WebShell检测分析：
-
-文件名：{file_name or '未知'}
-文件内容：
-{{content}}
-
-要求：
-1. 识别是否为WebShell
-2. 分析WebShell类型和功能
-3. 识别危险函数和恶意代码
-4. 评估威胁等级
-5. 提供处置建议
-
-请用中文按以下格式响应：
-【检测结果】是否为WebShell（是/否）
-【威胁等级】高危/中危/低危/无威胁
-【恶意特征】列出发现的恶意代码特征
-【功能分析】分析WebShell的主要功能
-【处置建议】提供具体的安全处置方案"""
+        if output_mode != "text":
+            early_exit = self._early_exit("webshell_detection", full_report, lambda item: (
+                item["is_webshell"] and item["threat_level"] in EARLY_EXIT_WEBSHELL_LEVELS
+            ))
+            structured = self._structured_completion(
+                WEBSHELL_SCHEMA, file_content, output_mode == "verdict", context=f"文件名：{file_name or '未知'}",
+                early_exit=early_exit
+            )
+            self.logger.info(
+                f"WebShell检测完成，结果: {'发现WebShell' if structured['is_webshell'] else '未发现WebShell'}, "
+                f"威胁等级: {structured['threat_level']}"
+            )
+            return self._with_sightings(self._with_progress({
+                "result": WEBSHELL_SCHEMA.render(structured),
+                "is_webshell": structured["is_webshell"],
+                "threat_level": structured["threat_level"],
+                "structured": structured,
+                "file_name": file_name,
+                "output_mode": output_mode,
+                "analysis_type": "webshell_detection"
+            }, early_exit), f"{file_name}\n{file_content}", structured["is_webshell"])
         
         # 使用支持分块的方法处理长文本
+        early_exit = self._early_exit("webshell_detection", full_report, lambda text: (
+            "【检测结果】是" in text and any(f"【威胁等级】{level}" in text for level in EARLY_EXIT_WEBSHELL_LEVELS)
+        ))
         result = self.ai_service.chat_completion_with_chunking(
-            base_prompt=base_prompt,
+            template=WEBSHELL_TEMPLATE,
             content=file_content,
-            temperature=0.3
+            temperature=0.3,
+            context=f"文件名：{file_name or '未知'}",
+            early_exit=early_exit
         )
         is_webshell = "【检测结果】是" in result
         
@@ -246,65 +788,126 @@ tasklist或者ps aux的结果：{process_data}
         
         self.logger.info(f"WebShell检测完成，结果: {'发现WebShell' if is_webshell else '未发现WebShell'}, 威胁等级: {threat_level}")
         
-        return {
+        return self._with_sightings(self._with_progress({
             "result": result,
             "is_webshell": is_webshell,
             "threat_level": threat_level,
             "file_name": file_name,
+            "output_mode": output_mode,
             "analysis_type": "webshell_detection"
-        }
+        }, early_exit), f"{file_name}\n{file_content}", is_webshell)
     
     @handle_service_error
-    def analyze_web_logs(self, log_content: str, analysis_options: List[str]) -> Dict[str, Any]:
-        """Web日志分析"""
+    def analyze_web_logs(self, log_content: str, analysis_options: List[str], reduction: str = "") -> Dict[str, Any]:
+        """Web日志分析
+
+        reduction 为 sample 时，超出单次提示预算的日志先在本地评分并分层抽样，只调用一次模型。
+        """
         # 验证输入
         Validator.validate_file_content(log_content)
+        reduction = reduction or LOG_REDUCTION_MODE
+        if reduction not in LOG_REDUCTION_MODES:
+            raise ValidationError(f"reduction必须是以下之一: {', '.join(LOG_REDUCTION_MODES)}")
         
         if not analysis_options:
             analysis_options = ["攻击检测", "异常分析", "统计分析"]
+        sections = list(dict.fromkeys(
+            WEBLOG_OPTION_ALIASES.get(option, option) for option in analysis_options
+            if WEBLOG_OPTION_ALIASES.get(option, option) in WEBLOG_TASKS
+        ))
         
-        self.logger.info(f"开始Web日志分析，日志长度: {len(log_content)}, 分析选项: {analysis_options}")
+        self.logger.info(f"开始Web日志分析，日志长度: {len(log_content)}, 分析选项: {analysis_options}, 处理方式: {reduction}")
         
         # 构建分析提示
-        analysis_tasks = []
-        if "攻击检测" in analysis_options:
-            analysis_tasks.append("识别SQL注入、XSS、文件包含、命令执行等攻击行为")
-        if "异常分析" in analysis_options:
-            analysis_tasks.append("检测异常访问模式、可疑IP、异常User-Agent")
-        if "统计分析" in analysis_options:
-            analysis_tasks.append("统计访问频率、热门页面、错误代码分布")
-        if "性能分析" in analysis_options:
-            analysis_tasks.append("分析响应时间、资源消耗、性能瓶颈")
-        
-        # 构建基础提示模板
-        base_prompt = f"""请对以下Web访问日志进行安全分析：
-
-分析任务：
-{chr(10).join(f'{i+1}. {task}' for i, task in enumerate(analysis_tasks))}
-
-Web访问日志：
-{{content}}
-
-请用中文按以下格式响应：
-【攻击检测】列出发现的攻击行为和威胁
-【异常分析】识别异常访问模式和可疑活动
-【统计分析】提供访问统计和趋势分析
-【安全建议】提供具体的安全加固建议"""
+        context = "分析任务：\n" + "\n".join(f'{i+1}. {WEBLOG_TASKS[section]}' for i, section in enumerate(sections))
         
-        # 使用支持分块的方法处理长文本
-        result = self.ai_service.chat_completion_with_chunking(
-            base_prompt=base_prompt,
-            content=log_content,
-            temperature=0.3
-        )
+        content, sampling = log_content, None
+        if reduction == "sample":
+            sample_context = f"{context}\n\n{WEBLOG_SAMPLE_NOTE}"
+            budget = self.ai_service.content_budget(WEBLOG_TEMPLATE, sample_context)
+            sample = cpu_pool.run(sample_log, log_content, budget)
+            if sample.report["sampled"]:
+                content, context, sampling = sample.text, sample_context, sample.report
+        
+        if WEBLOG_FAN_OUT and len(sections) > 1:
+            result = self._analyze_weblog_sections(sections, content, sampled=sampling is not None)
+        else:
+            # 使用支持分块的方法处理长文本，分析任务随选项变化，放在用户消息中
+            result = self.ai_service.chat_completion_with_chunking(
+                template=WEBLOG_TEMPLATE,
+                content=content,
+                temperature=0.3,
+                context=context
+            )
         
         self.logger.info("Web日志分析完成")
         
-        return {
+        response = {
             "result": result,
             "analysis_options": analysis_options,
+            "reduction": reduction,
             "analysis_type": "web_log_analysis"
         }
+        if sampling:
+            response["sampling"] = sampling
+        return self._with_sightings(self._with_progress(response), log_content, None)
+    
+    def _analyze_weblog_sections(self, sections: List[str], content: str, sampled: bool) -> str:
+        """每个分析选项使用专用提示并行调用，结果按选项顺序加上小节标题合并
+
+        未抽样时先在本地解析一次日志：攻击检测只分析可疑行，统计分析附上基于全部日志的统计。
+        部分小节失败或超过截止时间时返回其余小节，并在部分结果中注明；全部失败时抛出第一个错误。
+        """
+        focus = None if sampled else cpu_pool.run(focus_log, content)
+        
+        def run(section: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+            section_content, context = content, WEBLOG_SAMPLE_NOTE if sampled else ""
+            if focus is not None and section == "攻击检测" and focus.suspicious is not None:
+                section_content = focus.suspicious
+                context = f"以下为从全部日志中筛选出的 {focus.suspicious_lines} 行可疑请求。"
+            elif focus is not None and section == "统计分析":
+                context = focus.summary
+            result = self.ai_service.chat_completion_with_chunking(
+                template=WEBLOG_SECTION_TEMPLATES[section],
+                content=section_content,
+                temperature=0.3,
+                context=context
+            )
+            # 分块的部分结果记在工作线程的上下文中，随结果一起带回
+            return result, get_partial_result()
+        
+        results: Dict[str, str] = {}
+        partial: Dict[str, Dict[str, Any]] = {}
+        first_error: Optional[APIException] = None
+        failures = 0
+        with ThreadPoolExecutor(max_workers=min(WEBLOG_MAX_WORKERS, len(sections))) as executor:
+            futures = {
+                section: executor.submit(contextvars.copy_context().run, run, section) for section in sections
+            }
+            for section, future in futures.items():
+                try:
+                    results[section], section_partial = future.result()
+                    if section_partial:
+                        partial[section] = section_partial
+                except RequestCancelledError:
+                    raise
+                except DeadlineExceededError as e:
+                    first_error, failures = first_error or e, failures + 1
+                    results[section] = "已到达截止时间，该项未完成分析。"
+                    partial[section] = {"reason": "deadline", "completed_chunks": 0}
+                except APIException as e:
+                    first_error, failures = first_error or e, failures + 1
+                    self.logger.warning(f"Web日志{section}失败: {e.message}")
+                    results[section] = f"该项分析失败：{e.message}"
+                    partial[section] = {"reason": "error", "error": e.message}
+        
+        if failures == len(sections):
+            raise first_error
+        if partial:
+            reasons = {item["reason"] for item in partial.values()}
+            set_partial_result({"reason": "deadline" if "deadline" in reasons else "error", "sections": partial})
+        self.logger.info(f"Web日志分项分析完成: {len(sections)} 项，未完整完成: {len(partial)} 项")
+        return "\n\n".join(f"【{section}】\n{results[section].strip()}" for section in sections)
     
     @handle_service_error
     def chat_weblog(self, question: str, log_content: str, analysis_result: Any) -> Dict[str, Any]:
@@ -338,33 +941,18 @@ Web访问日志：
                 self.logger.warning(f"处理分析结果时出错: {e}, 使用默认值")
                 analysis_text = "暂无分析结果"
             
-            # 构建对话提示模板
-            base_prompt = f"""你是一个专业的网络安全分析师，正在协助用户分析Web访问日志。
-
-之前的分析结果：
-{analysis_text}
-
-用户问题：{question}
-
-原始日志内容：
-{{content}}
-
-请基于上述日志内容和分析结果，详细回答用户的问题。回答要求：
-1. 准确引用日志中的具体信息
-2. 结合安全专业知识进行解释
-3. 提供实用的安全建议
-4. 使用中文回答
-5. 如果问题涉及具体的攻击行为，请详细说明攻击手法和防护措施
-6. 如果无法从日志中找到相关信息，请明确说明"""
+            # 之前的分析结果和用户问题放在用户消息中，固定说明使用对话模板
+            chat_context = f"之前的分析结果：\n{analysis_text}\n\n用户问题：{question}"
             
-            self.logger.info(f"基础提示长度: {len(base_prompt)}")
+            self.logger.info(f"对话上下文长度: {len(chat_context)}")
             
             # 使用支持分块的方法处理长文本
             try:
                 result = self.ai_service.chat_completion_with_chunking(
-                    base_prompt=base_prompt,
+                    template=WEBLOG_CHAT_TEMPLATE,
                     content=log_content,
-                    temperature=0.3
+                    temperature=0.3,
+                    context=chat_context
                 )
                 
                 if not result or not result.strip():
@@ -373,19 +961,21 @@ Web访问日志：
                 
                 self.logger.info(f"Web日志对话完成，回答长度: {len(result)}")
                 
+            except (RequestCancelledError, DeadlineExceededError):
+                raise
             except Exception as e:
                 self.logger.error(f"AI服务调用失败: {e}")
                 # 提供降级回答
                 result = f"抱歉，处理您的问题时遇到技术问题：{str(e)}。请稍后重试或联系管理员。"
             
-            return {
+            return self._with_progress({
                 "result": result,
                 "question": question,
                 "analysis_type": "web_log_chat"
-            }
+            })
             
-        except ValidationError:
-            # 重新抛出验证错误
+        except (ValidationError, RequestCancelledError, DeadlineExceededError):
+            # 重新抛出验证错误、取消和超时
             raise
         except Exception as e:
             self.logger.error(f"Web日志对话处理失败: {e}")
@@ -393,7 +983,11 @@ Web访问日志：
     
     @handle_service_error
     def translate_text(self, text: str, source_lang: str, target_lang: str) -> Dict[str, Any]:
-        """AI翻译"""
+        """AI翻译
+
+        按段落切分并查询翻译记忆库，只把新增或修改过的片段分批并行交给大模型，
+        代码块原样保留，译文按原顺序拼接。
+        """
         # 验证输入
         Validator.validate_required(text, "翻译文本")
         Validator.validate_required(source_lang, "源语言")
@@ -401,25 +995,27 @@ Web访问日志：
         
         self.logger.info(f"开始AI翻译，文本长度: {len(text)}, {source_lang} -> {target_lang}")
         
-        # 构建翻译提示模板
-        base_prompt = f"""请将以下文本从{source_lang}翻译成{target_lang}：
-
-原文：
-{{content}}
-
-要求：
-1. 保持原文的语义和语调
-2. 确保翻译的准确性和流畅性
-3. 如果是技术文档，保持专业术语的准确性
-4. 如果包含代码或特殊格式，请保持不变
-
-请直接提供翻译结果，不需要额外说明。"""
+        segments = split_segments(text)
+        model = f"{self.ai_service.config.api_type}:{self.ai_service.config.model}"
+        translatable = {segment.key: segment.text for segment in segments if segment.translatable}
+        cached = translation_memory.lookup(list(translatable), source_lang, target_lang, model)
+        pending = {key: value for key, value in translatable.items() if key not in cached}
         
-        # 使用支持分块的方法处理长文本
-        result = self.ai_service.chat_completion_with_chunking(
-            base_prompt=base_prompt,
-            content=text,
-            temperature=0.1
+        self.logger.info(f"翻译片段: {len(translatable)}, 记忆库命中: {len(cached)}, 待翻译: {len(pending)}")
+        
+        translations = dict(cached)
+        translated, error = self._translate_segments(pending, source_lang, target_lang)
+        translations.update(translated)
+        translation_memory.store(
+            [(pending[key], value) for key, value in translated.items()], source_lang, target_lang, model
+        )
+        if error:
+            # 已完成的片段已写入记忆库，重试时不必重新翻译
+            raise error
+        
+        result = ''.join(
+            translations.get(segment.key, segment.text) if segment.translatable else segment.text
+            for segment in segments
         )
         
         self.logger.info("AI翻译完成")
@@ -428,8 +1024,69 @@ Web访问日志：
             "result": result,
             "source_lang": source_lang,
             "target_lang": target_lang,
+            "segments": len(translatable),
+            "cached_segments": len(cached),
+            "translated_segments": len(translated),
             "analysis_type": "translation"
         }
+    
+    def _translate_segments(self, pending: Dict[str, str], source_lang: str,
+                            target_lang: str) -> Tuple[Dict[str, str], Optional[Exception]]:
+        """按token预算把待翻译片段分批，并行翻译，返回 ({片段哈希: 译文}, 首个错误)"""
+        batches: List[List[Tuple[str, str]]] = []
+        batch_tokens = 0
+        for key, segment in pending.items():
+            tokens = self.ai_service._estimate_tokens(segment)
+            if not batches or batch_tokens + tokens > TRANSLATION_BATCH_TOKENS \
+                    or len(batches[-1]) >= TRANSLATION_BATCH_SEGMENTS:
+                batches.append([])
+                batch_tokens = 0
+            batches[-1].append((key, segment))
+            batch_tokens += tokens
+        
+        translations: Dict[str, str] = {}
+        error = None
+        if not batches:
+            return translations, error
+        with ThreadPoolExecutor(max_workers=min(TRANSLATION_MAX_WORKERS, len(batches))) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._translate_batch, batch, source_lang, target_lang)
+                for batch in batches
+            ]
+            for future in futures:
+                try:
+                    translations.update(future.result())
+                except RequestCancelledError:
+                    raise
+                except Exception as e:
+                    error = error or e
+        return translations, error
+    
+    def _translate_batch(self, batch: List[Tuple[str, str]], source_lang: str, target_lang: str) -> Dict[str, str]:
+        """翻译一批片段：多个片段用编号标记合并为一次请求，解析失败时逐个翻译"""
+        if len(batch) > 1:
+            content = "\n\n".join(f"<<<{index}>>>\n{segment}" for index, (_, segment) in enumerate(batch, 1))
+            response = self.ai_service.chat_completion(
+                TRANSLATE_BATCH_TEMPLATE.render(content, context=f"源语言：{source_lang}\n目标语言：{target_lang}"),
+                temperature=0.1,
+                system=TRANSLATE_BATCH_TEMPLATE.system
+            )
+            parts = re.split(r'<<<(\d+)>>>', response)
+            numbered = {int(parts[i]): parts[i + 1].strip() for i in range(1, len(parts) - 1, 2)}
+            if all(numbered.get(index) for index in range(1, len(batch) + 1)):
+                return {key: numbered[index] for index, (key, _) in enumerate(batch, 1)}
+            self.logger.warning(f"批量翻译结果编号不完整，改为逐个翻译 {len(batch)} 个片段")
+        
+        translations = {}
+        for key, segment in batch:
+            # 使用支持分块的方法处理长文本
+            translations[key] = self.ai_service.chat_completion_with_chunking(
+                template=TRANSLATE_TEMPLATE,
+                content=segment,
+                temperature=0.1,
+                context=f"源语言：{source_lang}\n目标语言：{target_lang}"
+            ).strip()
+        return translations
 
 
 # 全局分析服务实例
@@ -0,0 +1,148 @@
+"""按内容寻址的上传存储
+
+同一份日志往往要先分析、再多轮追问、再换选项重新分析，前端每次都重新提交几MB的正文。
+这里按SHA-256保存上传内容：前端先计算摘要并询问服务端是否已有，只在没有时上传一次，
+之后各分析接口用 "<字段名>_blob": "<sha256>" 引用内容，不再内联提交正文。
+总大小超过上限时按最近使用时间淘汰。
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from ..config import config_manager
+from ..utils import LoggerMixin, ValidationError
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# 请求中引用上传内容的字段后缀
+BLOB_SUFFIX = '_blob'
+
+
+def is_digest(value: Any) -> bool:
+    return isinstance(value, str) and bool(_DIGEST_RE.match(value))
+
+
+class BlobStore(LoggerMixin):
+    """SHA-256寻址的磁盘存储，按最近使用时间淘汰"""
+
+    def __init__(self, root: str, max_total_bytes: int, max_blob_bytes: int):
+        self.root = root
+        self.max_total_bytes = max_total_bytes
+        self.max_blob_bytes = max_blob_bytes
+        self._lock = threading.Lock()
+        # 摘要 -> 大小，按最近使用排序
+        self._index: 'OrderedDict[str, int]' = OrderedDict()
+        self._total = 0
+        self._loaded = False
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _ensure_loaded(self) -> None:
+        """首次使用时扫描已有内容，按修改时间恢复使用顺序"""
+        if self._loaded:
+            return
+        entries = []
+        if os.path.isdir(self.root):
+            for prefix in os.listdir(self.root):
+                folder = os.path.join(self.root, prefix)
+                if not os.path.isdir(folder):
+                    continue
+                for name in os.listdir(folder):
+                    if is_digest(name):
+                        stat = os.stat(os.path.join(folder, name))
+                        entries.append((stat.st_mtime, name, stat.st_size))
+        for _, digest, size in sorted(entries):
+            self._index[digest] = size
+            self._total += size
+        self._loaded = True
+
+    def size(self, digest: str) -> Optional[int]:
+        """已保存内容的字节数，不存在时返回 None"""
+        if not is_digest(digest):
+            return None
+        with self._lock:
+            self._ensure_loaded()
+            return self._index.get(digest)
+
+    def put(self, data: bytes, expected_digest: Optional[str] = None) -> str:
+        """保存内容并返回摘要；expected_digest 与实际摘要不一致时抛出 ValidationError"""
+        if len(data) > self.max_blob_bytes:
+            raise ValidationError(f"上传内容超过上限 {self.max_blob_bytes // (1024 * 1024)}MB", "BLOB_TOO_LARGE")
+        digest = hashlib.sha256(data).hexdigest()
+        if expected_digest and expected_digest != digest:
+            raise ValidationError("上传内容与摘要不一致", "BLOB_HASH_MISMATCH",
+                                  {"expected": expected_digest, "actual": digest})
+        with self._lock:
+            self._ensure_loaded()
+            if digest in self._index:
+                self._index.move_to_end(digest)
+                return digest
+            path = self._path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再改名，并发读取不会看到写了一半的内容
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(data)
+            os.replace(tmp_path, path)
+            self._index[digest] = len(data)
+            self._total += len(data)
+            self._evict()
+        self.logger.info(f"保存上传内容: {digest[:12]}, 大小: {len(data)}")
+        return digest
+
+    def _evict(self) -> None:
+        while self._total > self.max_total_bytes and len(self._index) > 1:
+            digest, size = self._index.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+            self.logger.info(f"淘汰上传内容: {digest[:12]}")
+
+    def get_text(self, digest: str) -> Optional[str]:
+        """读取内容并按UTF-8解码，不存在时返回 None"""
+        if not is_digest(digest):
+            return None
+        with self._lock:
+            self._ensure_loaded()
+            if digest not in self._index:
+                return None
+            self._index.move_to_end(digest)
+        try:
+            with open(self._path(digest), 'rb') as handle:
+                data = handle.read()
+        except OSError:
+            return None
+        return data.decode('utf-8', errors='replace')
+
+    def referenced_bytes(self, data: Any) -> int:
+        """请求数据中引用的上传内容总字节数，用于准入控制估算token"""
+        if not isinstance(data, dict):
+            return 0
+        return sum(self.size(value) or 0 for key, value in data.items() if key.endswith(BLOB_SUFFIX))
+
+    def resolve(self, data: Dict[str, Any], *fields: str) -> None:
+        """把 "<字段名>_blob" 引用替换为内容；引用不存在时抛出 ValidationError（错误码 BLOB_NOT_FOUND，前端据此重新上传）"""
+        for name in fields:
+            digest = data.pop(name + BLOB_SUFFIX, None)
+            if digest is None or data.get(name):
+                continue
+            text = self.get_text(digest)
+            if text is None:
+                raise ValidationError("引用的上传内容不存在，请重新上传", "BLOB_NOT_FOUND",
+                                      {"field": name, "hash": digest})
+            data[name] = text
+
+
+# 全局上传内容存储实例
+blob_store = BlobStore(
+    root=config_manager.get_config_value('blobs', 'dir', 'data/blobs'),
+    max_total_bytes=int(config_manager.get_config_value('blobs', 'max_total_mb', '1024')) * 1024 * 1024,
+    max_blob_bytes=int(config_manager.get_config_value('blobs', 'max_blob_mb', '64')) * 1024 * 1024
+)
@@ -0,0 +1,324 @@
+"""历史分析结果的威胁指标索引
+
+流量、日志、WebShell 等分析完成后，从输入和结果中提取 IP、域名、URL、哈希、文件名和
+User-Agent 等指标，与分析记录一起保存到本地 SQLite：指标按 (类型, 值) 精确索引，
+分析结果文本进入 FTS5 trigram 全文索引（按三字符切分，中文无需分词）。新的分析结果会自动附上这些指标此前出现过的记录，
+整个过程不调用大模型。
+"""
+
+import ipaddress
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from ..config import config_manager
+from ..utils import LoggerMixin, get_request_id
+
+_IPV4_RE = re.compile(r'(?<![\d.])(?:\d{1,3}\.){3}\d{1,3}(?![\d.])')
+_URL_RE = re.compile(r'\bhttps?://[^\s"\'<>`]+', re.I)
+_DOMAIN_RE = re.compile(r'\b(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,24}\b', re.I)
+_HASH_RE = re.compile(r'\b(?:[a-f0-9]{64}|[a-f0-9]{40}|[a-f0-9]{32})\b', re.I)
+_FILE_RE = re.compile(
+    r'(?<![\w.-])[\w.-]{1,100}\.(?:php\d?|phtml|jspx?|aspx?|ashx|asmx|cgi|sh|py|pl|exe|dll|war|jar|'
+    r'zip|rar|7z|tar|gz|bat|ps1|vbs|hta)\b', re.I)
+_HEADER_UA_RE = re.compile(r'^User-Agent:[ \t]*(.+?)\s*$', re.I | re.M)
+# 组合日志格式末尾的 "Referer" "User-Agent"
+_LOG_UA_RE = re.compile(r'"[^"]*" "([^"]{8,512})"\s*$', re.M)
+
+# 认作域名的顶级域：两个字母的国家和地区顶级域，以及常见通用顶级域。
+# 代码中的 document.cookie、request.getParameter 之类属性访问因此不会被当成域名
+_GENERIC_TLDS = {
+    'com', 'net', 'org', 'info', 'biz', 'edu', 'gov', 'mil', 'int', 'xyz', 'top', 'site', 'online',
+    'club', 'vip', 'shop', 'store', 'tech', 'app', 'dev', 'cloud', 'live', 'pro', 'work', 'link',
+    'click', 'icu', 'cyou', 'buzz', 'fun', 'space', 'website', 'ltd', 'group', 'local', 'onion'
+}
+# 形似国家顶级域的常见文件后缀
+_FILE_SUFFIXES = {'js', 'py', 'sh', 'pl', 'gz', 'md', 'do', 'so', 'ps'}
+
+INDICATOR_TYPES = ('ip', 'domain', 'url', 'hash', 'file', 'user_agent')
+# 入库时转为小写的指标类型
+_LOWERCASE_TYPES = ('domain', 'hash')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    analysis_type TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    request_id TEXT,
+    flagged INTEGER,
+    summary TEXT
+);
+CREATE TABLE IF NOT EXISTS indicators (
+    id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    value TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    sightings INTEGER NOT NULL DEFAULT 0,
+    flagged_sightings INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (type, value)
+);
+CREATE INDEX IF NOT EXISTS idx_indicators_value ON indicators (value);
+CREATE TABLE IF NOT EXISTS sightings (
+    indicator_id INTEGER NOT NULL,
+    analysis_id INTEGER NOT NULL,
+    PRIMARY KEY (indicator_id, analysis_id)
+) WITHOUT ROWID;
+"""
+# 默认的 unicode61 分词把连续的中文当作一个词，中文结果几乎检索不到，改用 trigram（SQLite 3.34+）
+_FTS_SCHEMA = "CREATE VIRTUAL TABLE analyses_fts USING fts5 (summary, content='analyses', content_rowid='id'{tokenize})"
+# trigram 只能匹配不少于三个字符的词，更短的查询改用 LIKE
+_TRIGRAM_MIN_CHARS = 3
+
+
+def extract_indicators(*texts: str, limit: int = 500) -> List[Tuple[str, str]]:
+    """从文本中提取去重后的 (类型, 值)，按出现顺序最多 limit 个"""
+    found: Dict[Tuple[str, str], None] = {}
+
+    def add(kind: str, value: str) -> None:
+        if len(found) < limit:
+            found.setdefault((kind, value), None)
+
+    for text in texts:
+        if not text:
+            continue
+        for url in _URL_RE.findall(text):
+            add('url', url.rstrip('.,;:)]}'))
+        for candidate in _IPV4_RE.findall(text):
+            try:
+                address = ipaddress.ip_address(candidate)
+            except ValueError:
+                continue
+            if not (address.is_loopback or address.is_unspecified):
+                add('ip', candidate)
+        for domain in _DOMAIN_RE.findall(text):
+            domain = domain.lower()
+            tld = domain.rsplit('.', 1)[-1]
+            if (len(tld) == 2 and tld not in _FILE_SUFFIXES) or tld in _GENERIC_TLDS:
+                add('domain', domain)
+        for digest in _HASH_RE.findall(text):
+            add('hash', digest.lower())
+        for name in _FILE_RE.findall(text):
+            add('file', name)
+        for agent in _HEADER_UA_RE.findall(text) + _LOG_UA_RE.findall(text):
+            if agent != '-':
+                add('user_agent', agent)
+    return list(found)
+
+
+def _snippet(summary: str, query: str, context: int = 24) -> str:
+    """LIKE 检索结果的摘录：命中处前后各 context 个字符，命中部分用方括号标出"""
+    position = summary.lower().find(query.lower())
+    if position < 0:
+        return summary[:context * 2]
+    start, end = max(0, position - context), position + len(query)
+    return (('…' if start else '') + summary[start:position] + '[' + summary[position:end] + ']'
+            + summary[end:end + context] + ('…' if end + context < len(summary) else ''))
+
+
+class IOCIndex(LoggerMixin):
+    """指标的精确索引和分析结果的全文索引"""
+
+    def __init__(self, enabled: bool, db_file: str, max_indicators: int, max_prior: int, summary_chars: int):
+        self.enabled = enabled
+        self.db_file = db_file
+        self.max_indicators = max_indicators
+        self.max_prior = max_prior
+        self.summary_chars = summary_chars
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._initialized = False
+        # 当前 SQLite 不支持 trigram 时全部检索使用 LIKE
+        self._trigram = True
+
+    def _connection(self) -> sqlite3.Connection:
+        """每个线程一个连接；首次使用时建表"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.db_file) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.db_file, timeout=5)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with self._write_lock:
+                if not self._initialized:
+                    connection.executescript(_SCHEMA)
+                    self._init_fts(connection)
+                    self._initialized = True
+            self._local.connection = connection
+        return connection
+
+    def _init_fts(self, connection: sqlite3.Connection) -> None:
+        """创建 trigram 全文索引；旧版本使用默认分词建立的索引删除后按分析记录重建"""
+        row = connection.execute("SELECT sql FROM sqlite_master WHERE name = 'analyses_fts'").fetchone()
+        if row is not None and "trigram" in row[0]:
+            return
+        with connection:
+            if row is not None:
+                connection.execute("DROP TABLE analyses_fts")
+            try:
+                connection.execute(_FTS_SCHEMA.format(tokenize=", tokenize='trigram'"))
+            except sqlite3.OperationalError:
+                self.logger.warning(f"SQLite {sqlite3.sqlite_version} 不支持 trigram 分词，全文检索改用 LIKE")
+                self._trigram = False
+                connection.execute(_FTS_SCHEMA.format(tokenize=""))
+            connection.execute("INSERT INTO analyses_fts (analyses_fts) VALUES ('rebuild')")
+
+    def record(self, analysis_type: str, content: str, result_text: str,
+               flagged: Optional[bool] = None) -> List[Dict[str, Any]]:
+        """保存一次分析及其指标，返回其中此前出现过的指标及其历史记录
+
+        索引失败只记录警告并返回空列表，不影响分析结果本身。
+        """
+        if not self.enabled:
+            return []
+        indicators = extract_indicators(content, result_text, limit=self.max_indicators)
+        try:
+            connection = self._connection()
+            prior = self._prior_sightings(connection, indicators)
+            self._insert(connection, analysis_type, result_text, flagged, indicators)
+            return prior
+        except sqlite3.Error as e:
+            self.logger.warning(f"指标索引失败: {str(e)}")
+            return []
+
+    def _prior_sightings(self, connection: sqlite3.Connection,
+                         indicators: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        rows = []
+        for kind, value in indicators:
+            row = connection.execute(
+                "SELECT * FROM indicators WHERE type = ? AND value = ?", (kind, value)
+            ).fetchone()
+            if row is not None:
+                rows.append(row)
+        # 曾被判定为恶意的指标排在前面，只为返回的指标查询历史记录
+        rows.sort(key=lambda row: (-row["flagged_sightings"], -row["sightings"]))
+        return [self._describe(connection, row, 5) for row in rows[:self.max_prior]]
+
+    def _describe(self, connection: sqlite3.Connection, row: sqlite3.Row, history: int) -> Dict[str, Any]:
+        return {
+            "type": row["type"],
+            "value": row["value"],
+            "sightings": row["sightings"],
+            "flagged_sightings": row["flagged_sightings"],
+            "first_seen": row["first_seen"],
+            "last_seen": row["last_seen"],
+            "analyses": self._recent_analyses(connection, row["id"], history)
+        }
+
+    @staticmethod
+    def _recent_analyses(connection: sqlite3.Connection, indicator_id: int, limit: int) -> List[Dict[str, Any]]:
+        rows = connection.execute(
+            "SELECT a.id, a.analysis_type, a.created_at, a.flagged FROM sightings s "
+            "JOIN analyses a ON a.id = s.analysis_id WHERE s.indicator_id = ? "
+            "ORDER BY a.id DESC LIMIT ?", (indicator_id, limit)
+        ).fetchall()
+        return [
+            {
+                "analysis_id": row["id"],
+                "analysis_type": row["analysis_type"],
+                "created_at": row["created_at"],
+                "flagged": None if row["flagged"] is None else bool(row["flagged"])
+            }
+            for row in rows
+        ]
+
+    def _insert(self, connection: sqlite3.Connection, analysis_type: str, result_text: str,
+                flagged: Optional[bool], indicators: List[Tuple[str, str]]) -> None:
+        now = time.time()
+        summary = (result_text or '')[:self.summary_chars]
+        flagged_value = None if flagged is None else int(flagged)
+        with self._write_lock, connection:
+            analysis_id = connection.execute(
+                "INSERT INTO analyses (analysis_type, created_at, request_id, flagged, summary) VALUES (?, ?, ?, ?, ?)",
+                (analysis_type, now, get_request_id(), flagged_value, summary)
+            ).lastrowid
+            connection.execute("INSERT INTO analyses_fts (rowid, summary) VALUES (?, ?)", (analysis_id, summary))
+            for kind, value in indicators:
+                connection.execute(
+                    "INSERT INTO indicators (type, value, first_seen, last_seen, sightings, flagged_sightings) "
+                    "VALUES (?, ?, ?, ?, 1, ?) ON CONFLICT (type, value) DO UPDATE SET "
+                    "last_seen = excluded.last_seen, sightings = sightings + 1, "
+                    "flagged_sightings = flagged_sightings + excluded.flagged_sightings",
+                    (kind, value, now, now, 1 if flagged else 0)
+                )
+                connection.execute(
+                    "INSERT OR IGNORE INTO sightings (indicator_id, analysis_id) "
+                    "SELECT id, ? FROM indicators WHERE type = ? AND value = ?",
+                    (analysis_id, kind, value)
+                )
+
+    def lookup(self, value: str, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """按值精确查找指标（可限定类型），附最近的分析记录"""
+        if not self.enabled:
+            return []
+        connection = self._connection()
+        # 域名和哈希入库时已转为小写
+        if kind:
+            if kind in _LOWERCASE_TYPES:
+                value = value.lower()
+            rows = connection.execute("SELECT * FROM indicators WHERE type = ? AND value = ?", (kind, value)).fetchall()
+        else:
+            rows = connection.execute(
+                "SELECT * FROM indicators WHERE value = ? OR (type IN ('domain', 'hash') AND value = ?)",
+                (value, value.lower())
+            ).fetchall()
+        return [self._describe(connection, row, 20) for row in rows]
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """在历史分析结果中全文检索，query 按短语匹配（不区分大小写）
+
+        少于三个字符的查询无法使用 trigram 索引，按 LIKE 扫描分析记录，结果按时间倒序。
+        """
+        if not self.enabled:
+            return []
+        connection = self._connection()
+        if self._trigram and len(query) >= _TRIGRAM_MIN_CHARS:
+            phrase = '"' + query.replace('"', '""') + '"'
+            rows = connection.execute(
+                "SELECT a.id, a.analysis_type, a.created_at, a.flagged, "
+                "snippet(analyses_fts, 0, '[', ']', '…', 16) AS snippet "
+                "FROM analyses_fts JOIN analyses a ON a.id = analyses_fts.rowid "
+                "WHERE analyses_fts MATCH ? ORDER BY rank LIMIT ?", (phrase, limit)
+            ).fetchall()
+            snippets = [row["snippet"] for row in rows]
+        else:
+            pattern = '%' + re.sub(r'([\\%_])', r'\\\1', query) + '%'
+            rows = connection.execute(
+                "SELECT id, analysis_type, created_at, flagged, summary FROM analyses "
+                "WHERE summary LIKE ? ESCAPE '\\' ORDER BY id DESC LIMIT ?", (pattern, limit)
+            ).fetchall()
+            snippets = [_snippet(row["summary"], query) for row in rows]
+        return [
+            {
+                "analysis_id": row["id"],
+                "analysis_type": row["analysis_type"],
+                "created_at": row["created_at"],
+                "flagged": None if row["flagged"] is None else bool(row["flagged"]),
+                "snippet": snippet
+            }
+            for row, snippet in zip(rows, snippets)
+        ]
+
+    def get_stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        connection = self._connection()
+        counts = dict(connection.execute("SELECT type, COUNT(*) FROM indicators GROUP BY type").fetchall())
+        return {
+            "enabled": True,
+            "analyses": connection.execute("SELECT COUNT(*) FROM analyses").fetchone()[0],
+            "indicators": counts
+        }
+
+
+# 全局指标索引实例
+ioc_index = IOCIndex(
+    enabled=config_manager.get_config_value('ioc', 'enabled', 'true').lower() == 'true',
+    db_file=config_manager.get_config_value('ioc', 'db_file', 'data/ioc.db'),
+    max_indicators=int(config_manager.get_config_value('ioc', 'max_indicators', '500')),
+    max_prior=int(config_manager.get_config_value('ioc', 'max_prior', '20')),
+    summary_chars=int(config_manager.get_config_value('ioc', 'summary_chars', '4000'))
+)
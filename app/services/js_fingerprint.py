@@ -0,0 +1,411 @@
+"""第三方JavaScript库指纹识别
+
+从 app/data/js_libraries.json 加载库指纹（内容哈希、版权注释和代码特征），
+拆分 webpack / esbuild / rollup 等打包文件，识别其中的第三方库及版本并匹配已知漏洞，
+剩余的业务代码才交给大模型审计。
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from ..config import config_manager
+from ..utils import LoggerMixin
+from .js_lexer import tokenize, code_tokens, find_matching, split_top_level, statement_end
+
+DEFAULT_FINGERPRINT_DB = os.path.join(os.path.dirname(__file__), '..', 'data', 'js_libraries.json')
+
+VERSION_PLACEHOLDER = '§§version§§'
+VERSION_PATTERN = r'(?P<version>\d+(?:\.\d+){1,3}(?:[-.][0-9A-Za-z]+)*)'
+
+# esbuild / rollup 保留的模块路径注释，如 // node_modules/lodash/lodash.js
+_PATH_COMMENT_RE = re.compile(
+    r'^[ \t]*//[ \t]+((?:\.\./|\./)*(?:[\w@.-]+/)*[\w@.-]+\.(?:m?js|cjs|jsx|ts|tsx|vue))[ \t]*$',
+    re.M
+)
+_NODE_MODULES_RE = re.compile(r'node_modules/((?:@[\w.-]+/)?[\w.-]+)')
+_LICENSE_COMMENT_RE = re.compile(r'^/\*[!*]|@license|@preserve')
+_SOURCE_MAP_RE = re.compile(r'\s*//[#@] sourceMappingURL=\S*\s*$')
+
+
+@dataclass
+class LibraryMatch:
+    """识别出的第三方库"""
+    name: str
+    version: str = ''
+    method: str = ''
+    start: int = 0
+    end: int = 0
+    stripped: bool = False
+    vulnerabilities: List[dict] = field(default_factory=list)
+
+    @property
+    def label(self) -> str:
+        return f"{self.name} {self.version}".strip()
+
+    @property
+    def verified(self) -> bool:
+        """是否经内容哈希确认与官方发布文件一致"""
+        return self.method == 'hash'
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "method": self.method,
+            "verified": self.verified,
+            "length": self.end - self.start,
+            "stripped": self.stripped,
+            "vulnerabilities": self.vulnerabilities
+        }
+
+
+@dataclass
+class FingerprintResult:
+    """打包文件拆分与指纹识别结果"""
+    bundle_format: str
+    libraries: List[LibraryMatch]
+    first_party_code: str
+    total_length: int = 0
+    vendor_length: int = 0
+
+    @property
+    def vulnerable_libraries(self) -> List[LibraryMatch]:
+        return [lib for lib in self.libraries if lib.vulnerabilities]
+
+
+def parse_version(version: str) -> Tuple[int, ...]:
+    """将版本号转换为整数元组用于比较，忽略预发布后缀"""
+    numbers = []
+    for part in re.split(r'[.]', version.split('-')[0]):
+        match = re.match(r'\d+', part)
+        if not match:
+            break
+        numbers.append(int(match.group()))
+    return tuple(numbers)
+
+
+def normalize_for_hash(code: str) -> str:
+    """规范化代码文本，消除换行符、首尾空白和末尾 sourceMappingURL 注释的差异"""
+    return _SOURCE_MAP_RE.sub('', code.replace('\r\n', '\n')).strip()
+
+
+def content_hash(code: str) -> str:
+    """计算规范化代码的SHA-256"""
+    return hashlib.sha256(normalize_for_hash(code).encode('utf-8')).hexdigest()
+
+
+class JsLibraryFingerprinter(LoggerMixin):
+    """第三方JavaScript库指纹识别器"""
+
+    def __init__(self, paths: Optional[List[str]] = None, hash_db: Optional[str] = None,
+                 strip_unverified: bool = False):
+        self._paths = paths
+        self._hash_db = hash_db
+        # 仅凭版权注释、代码特征或模块路径识别的库默认保留代码继续审计，
+        # 防止被注入恶意代码的库文件借助伪造的版权注释绕过审计
+        self.strip_unverified = strip_unverified
+        self._libraries: Dict[str, dict] = {}
+        self._hashes: Dict[str, dict] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _fingerprint_paths(self) -> List[str]:
+        """获取指纹库文件列表，支持在配置中追加自定义指纹库"""
+        if self._paths is not None:
+            return self._paths
+        paths = [DEFAULT_FINGERPRINT_DB]
+        extra = config_manager.get_config_value('javascript', 'extra_fingerprints', '')
+        paths.extend(p.strip() for p in extra.split(',') if p.strip())
+        return paths
+
+    def _hash_db_path(self) -> str:
+        """用户哈希库路径，register_hash 登记的哈希保存在这里"""
+        if self._hash_db is not None:
+            return self._hash_db
+        return config_manager.get_config_value('javascript', 'hash_db', '').strip()
+
+    def load(self) -> None:
+        """加载并编译指纹库"""
+        with self._lock:
+            if self._loaded:
+                return
+            paths = self._fingerprint_paths()
+            hash_db = self._hash_db_path()
+            if hash_db and os.path.exists(hash_db):
+                paths = paths + [hash_db]
+            for path in paths:
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    self.logger.warning(f"加载JavaScript库指纹失败: {path}, {e}")
+                    continue
+                for entry in data.get('libraries', []):
+                    self._index_library(entry)
+                self._hashes.update(data.get('hashes', {}))
+            self._loaded = True
+            self.logger.info(f"JavaScript库指纹加载完成，共 {len(self._libraries)} 个库, {len(self._hashes)} 个内容哈希")
+
+    def _index_library(self, entry: dict) -> None:
+        """编译单个库的指纹规则，同名库的规则合并"""
+        name = entry['name']
+        library = self._libraries.setdefault(name, {"banners": [], "content": [], "vulnerabilities": []})
+        for kind in ('banners', 'content'):
+            for pattern in entry.get(kind, []):
+                try:
+                    library[kind].append(re.compile(pattern.replace(VERSION_PLACEHOLDER, VERSION_PATTERN)))
+                except re.error as e:
+                    self.logger.warning(f"忽略无效的库指纹规则: {name}, {pattern}, {e}")
+        library["vulnerabilities"].extend(entry.get('vulnerabilities', []))
+
+    def register_hash(self, code: str, name: str, version: str) -> str:
+        """登记已知库文件的内容哈希，配置了 hash_db 时同时写入用户哈希库"""
+        self.load()
+        digest = content_hash(code)
+        with self._lock:
+            self._hashes[digest] = {"name": name, "version": version}
+            path = self._hash_db_path()
+            if path:
+                data = {"hashes": {}}
+                if os.path.exists(path):
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                data.setdefault('hashes', {})[digest] = {"name": name, "version": version}
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+        return digest
+
+    def vulnerabilities_for(self, name: str, version: str) -> List[dict]:
+        """返回指定库版本命中的已知漏洞"""
+        self.load()
+        library = self._libraries.get(name)
+        parsed = parse_version(version) if version else ()
+        if not library or not parsed:
+            return []
+        matched = []
+        for vuln in library["vulnerabilities"]:
+            if 'atOrAbove' in vuln and parsed < parse_version(vuln['atOrAbove']):
+                continue
+            if 'below' in vuln and parsed >= parse_version(vuln['below']):
+                continue
+            matched.append(vuln)
+        return matched
+
+    def identify(self, code: str) -> Optional[Tuple[str, str, str]]:
+        """识别一段代码所属的库，返回(库名, 版本, 识别方式)"""
+        self.load()
+        known = self._hashes.get(content_hash(code))
+        if known:
+            return known['name'], known.get('version', ''), 'hash'
+
+        # 版权注释只出现在文件开头附近
+        head = code[:2000]
+        for kind, text in (('banner', head), ('content', code)):
+            key = 'banners' if kind == 'banner' else 'content'
+            for name, library in self._libraries.items():
+                for pattern in library[key]:
+                    match = pattern.search(text)
+                    if match:
+                        return name, match.group('version'), kind
+        return None
+
+    def fingerprint(self, code: str) -> FingerprintResult:
+        """拆分代码并识别其中的第三方库
+
+        只有内容哈希命中的库才会从审计代码中剔除；其他方式识别的库仅报告，
+        除非开启 strip_unverified。
+        """
+        self.load()
+        known = self._hashes.get(content_hash(code))
+        if known:
+            name, version = known['name'], known.get('version', '')
+            library = LibraryMatch(
+                name=name, version=version, method='hash', start=0, end=len(code), stripped=True,
+                vulnerabilities=self.vulnerabilities_for(name, version)
+            )
+            return FingerprintResult('plain', [library], self._strip(code, [library])[0], len(code), len(code))
+
+        tokens = tokenize(code)
+        significant = code_tokens(tokens)
+
+        bundle_format = 'plain'
+        segments = self._webpack_modules(code, significant)
+        if segments:
+            bundle_format = 'webpack'
+        else:
+            segments = self._path_comment_segments(code)
+            if segments:
+                bundle_format = 'esbuild/rollup'
+
+        libraries = []
+        for start, end, package in segments:
+            match = self._match_segment(code, start, end, package)
+            if match:
+                libraries.append(match)
+
+        # 未被模块拆分覆盖的区域再按版权注释拆分（rollup、直接拼接的库文件）
+        for start, end in self._banner_segments(tokens, significant, libraries):
+            match = self._match_segment(code, start, end, None)
+            if match:
+                libraries.append(match)
+        libraries.sort(key=lambda lib: lib.start)
+
+        # 无法确定边界但能识别出的库只报告，不剔除
+        if not libraries:
+            found = self.identify(code)
+            if found:
+                name, version, method = found
+                libraries.append(LibraryMatch(
+                    name=name, version=version, method=method, start=0, end=len(code),
+                    vulnerabilities=self.vulnerabilities_for(name, version)
+                ))
+
+        first_party, vendor_length = self._strip(code, libraries)
+        return FingerprintResult(
+            bundle_format=bundle_format,
+            libraries=libraries,
+            first_party_code=first_party,
+            total_length=len(code),
+            vendor_length=vendor_length
+        )
+
+    def _match_segment(self, code: str, start: int, end: int, package: Optional[str]) -> Optional[LibraryMatch]:
+        """识别单个片段，来自 node_modules 的片段即使未命中指纹也视为第三方代码"""
+        found = self.identify(code[start:end])
+        if found:
+            name, version, method = found
+        elif package:
+            name, version, method = package, '', 'path'
+        else:
+            return None
+        return LibraryMatch(
+            name=name, version=version, method=method, start=start, end=end,
+            stripped=(method == 'hash' or self.strip_unverified),
+            vulnerabilities=self.vulnerabilities_for(name, version)
+        )
+
+    @staticmethod
+    def _package_of(path: str) -> Optional[str]:
+        """从模块路径中提取npm包名"""
+        match = _NODE_MODULES_RE.search(path)
+        return match.group(1) if match else None
+
+    def _webpack_modules(self, code: str, tokens: list) -> List[Tuple[int, int, Optional[str]]]:
+        """拆分webpack模块表，返回[(起始, 结束, 包名), ...]"""
+        tables = []
+        has_require = '__webpack_require__' in code
+        for i, token in enumerate(tokens[:-2]):
+            nxt = tokens[i + 1]
+            if token.type == 'word' and token.value == '__webpack_modules__' and nxt.value == '=':
+                j = i + 2
+                while j < len(tokens) and tokens[j].value == '(':
+                    j += 1
+                if j < len(tokens) and tokens[j].value in ('{', '['):
+                    tables.append(j)
+            elif (token.type == 'word' and token.value == 'push' and nxt.value == '('
+                  and tokens[i + 2].value == '[' and re.search(r'webpack(Chunk|Jsonp)', code[max(0, token.start - 200):token.start])):
+                # (self.webpackChunkxxx = ...).push([[chunkIds], {modules}, runtime])
+                parts = split_top_level(tokens, i + 2)
+                if len(parts) >= 2 and tokens[parts[1][0]].value in ('{', '['):
+                    tables.append(parts[1][0])
+            elif has_require and token.value in (')', '}') and nxt.value == '(' and tokens[i + 2].value in ('{', '['):
+                # webpack 4: !function(modules){...}({...}) / ([...])
+                tables.append(i + 2)
+
+        segments = []
+        for open_index in tables:
+            modules = self._module_table(tokens, open_index)
+            if len(modules) >= 2:
+                segments.extend(modules)
+        return segments
+
+    @staticmethod
+    def _module_table(tokens: list, open_index: int) -> List[Tuple[int, int, Optional[str]]]:
+        """解析模块表中的每个模块，表项必须是函数才认为是模块表"""
+        modules = []
+        for part_start, part_end in split_top_level(tokens, open_index):
+            key = None
+            value_index = part_start
+            if part_end > part_start + 1 and tokens[part_start + 1].value == ':':
+                key = tokens[part_start].value.strip('\'"')
+                value_index = part_start + 2
+            if value_index > part_end or not _is_function(tokens, value_index, part_end):
+                return []
+            package = JsLibraryFingerprinter._package_of(key) if key else None
+            modules.append((tokens[value_index].start, tokens[part_end].end, package))
+        return modules
+
+    def _path_comment_segments(self, code: str) -> List[Tuple[int, int, Optional[str]]]:
+        """按esbuild/rollup的模块路径注释拆分"""
+        matches = list(_PATH_COMMENT_RE.finditer(code))
+        segments = []
+        for index, match in enumerate(matches):
+            end = matches[index + 1].start() if index + 1 < len(matches) else len(code)
+            segments.append((match.start(), end, self._package_of(match.group(1))))
+        return segments
+
+    @staticmethod
+    def _banner_segments(tokens: list, significant: list, libraries: List[LibraryMatch]) -> List[Tuple[int, int]]:
+        """版权注释及其后的顶层语句，跳过已被识别的区域"""
+        covered = [(lib.start, lib.end) for lib in libraries]
+        starts = [t.start for t in significant]
+        segments = []
+        last_end = -1
+        for token in tokens:
+            if token.type != 'comment' or token.start < last_end or not _LICENSE_COMMENT_RE.search(token.value):
+                continue
+            if any(start <= token.start < end for start, end in covered):
+                continue
+            index = bisect.bisect_left(starts, token.end)
+            if index >= len(significant):
+                continue
+            end_index = statement_end(significant, index)
+            last_end = significant[end_index].end
+            segments.append((token.start, last_end))
+        return segments
+
+    @staticmethod
+    def _strip(code: str, libraries: List[LibraryMatch]) -> Tuple[str, int]:
+        """移除已识别的库代码，原位置保留注释占位"""
+        parts = []
+        position = 0
+        vendor_length = 0
+        for lib in libraries:
+            if not lib.stripped or lib.start < position:
+                continue
+            parts.append(code[position:lib.start])
+            verified = '' if lib.verified else '，未经哈希验证'
+            parts.append(f"/* [已移除第三方库: {lib.label}{verified}] */")
+            if code[lib.end - 1:lib.end] == '\n':
+                parts.append('\n')
+            vendor_length += lib.end - lib.start
+            position = lib.end
+        parts.append(code[position:])
+        return ''.join(parts), vendor_length
+
+
+def _is_function(tokens: list, index: int, limit: int) -> bool:
+    """判断 tokens[index] 处是否为函数表达式（function 或箭头函数）"""
+    token = tokens[index]
+    if token.value == 'function':
+        return True
+    if token.value == '(':
+        close = find_matching(tokens, index)
+        return close < limit and tokens[close + 1].value == '=>'
+    return token.type == 'word' and index < limit and tokens[index + 1].value == '=>'
+
+
+# 全局JavaScript库指纹识别器实例
+js_library_fingerprinter = JsLibraryFingerprinter(
+    strip_unverified=config_manager.get_config_value('javascript', 'strip_unverified', 'false').lower() == 'true'
+)
+
+
+def fingerprint_js(code: str) -> FingerprintResult:
+    """CPU进程池任务，见 JsLibraryFingerprinter.fingerprint"""
+    return js_library_fingerprinter.fingerprint(code)
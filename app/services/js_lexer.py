@@ -0,0 +1,203 @@
+"""轻量级JavaScript词法分析器
+
+不依赖第三方解析库，能够正确跳过字符串、模板字符串、正则表达式和注释，
+用于打包文件拆分、代码美化和危险函数定位等本地分析。
+"""
+
+import re
+from collections import namedtuple
+from typing import List, Optional
+
+Token = namedtuple('Token', ['type', 'value', 'start', 'end', 'line'])
+
+_TOKEN_RE = re.compile(r'''
+    (?P<ws>[ \t\r\f\v\u00a0\ufeff\u2028\u2029]+)
+  | (?P<newline>\n)
+  | (?P<comment>//[^\n]*|/\*[\s\S]*?(?:\*/|\Z))
+  | (?P<string>"(?:[^"\\\n]|\\[\s\S])*"?|'(?:[^'\\\n]|\\[\s\S])*'?)
+  | (?P<number>0[xXoObB][0-9a-fA-F_]+n?|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][+-]?\d+)?n?)
+  | (?P<word>(?:[^\W\d]|\$)[\w$]*)
+  | (?P<punct>>>>=|\.\.\.|===|!==|\*\*=|<<=|>>=|>>>|\?\?=|&&=|\|\|=|=>|==|!=|<=|>=|&&|\|\||\?\?|\?\.
+             |\+\+|--|\+=|-=|\*=|%=|&=|\|=|\^=|\*\*|<<|>>|[{}()\[\];,<>+\-*%&|^!~?:=.@\#])
+''', re.X)
+
+_REGEX_RE = re.compile(r'/(?:[^/\\\[\n]|\\.|\[(?:[^\]\\\n]|\\.)*\])+/[a-zA-Z]*')
+_TEMPLATE_PART_RE = re.compile(r'(?:[^`\\$]|\\[\s\S]|\$(?!\{))*')
+
+# 其后出现 / 时表示正则表达式而非除号的关键字
+_REGEX_KEYWORDS = {
+    'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void',
+    'throw', 'instanceof', 'yield', 'await'
+}
+
+OPENING = {'(': ')', '[': ']', '{': '}'}
+CLOSING = {')': '(', ']': '[', '}': '{'}
+
+
+def _regex_allowed(prev: Optional[Token]) -> bool:
+    """根据前一个有效token判断 / 是否为正则表达式开始"""
+    if prev is None:
+        return True
+    if prev.type == 'punct':
+        return prev.value not in (')', ']', '}', '++', '--')
+    if prev.type == 'word':
+        return prev.value in _REGEX_KEYWORDS
+    return False
+
+
+def tokenize(code: str, keep_whitespace: bool = False) -> List[Token]:
+    """将JavaScript代码切分为token列表
+
+    注释和换行会保留（分别为 comment / newline 类型），空白默认丢弃。
+    无法识别的字符作为 punct 输出，保证任何输入都能完整切分。
+    """
+    tokens: List[Token] = []
+    prev: Optional[Token] = None
+    # 记录 { 与模板字符串 ${ 的嵌套关系
+    brace_stack: List[str] = []
+    pos = 0
+    line = 1
+    length = len(code)
+
+    def emit(kind: str, start: int, end: int) -> None:
+        nonlocal prev, line
+        token = Token(kind, code[start:end], start, end, line)
+        tokens.append(token)
+        if kind not in ('comment', 'newline', 'ws'):
+            prev = token
+        line += code.count('\n', start, end)
+
+    def scan_template(start: int, value_start: int) -> int:
+        """扫描模板字符串片段，返回片段结束位置；遇到 ${ 时压栈"""
+        match = _TEMPLATE_PART_RE.match(code, value_start)
+        end = match.end()
+        if end < length and code[end] == '`':
+            emit('template', start, end + 1)
+            return end + 1
+        if code.startswith('${', end):
+            emit('template', start, end + 2)
+            brace_stack.append('template')
+            return end + 2
+        emit('template', start, length)
+        return length
+
+    while pos < length:
+        char = code[pos]
+
+        if char == '`':
+            pos = scan_template(pos, pos + 1)
+            continue
+
+        if char == '}' and brace_stack and brace_stack[-1] == 'template':
+            brace_stack.pop()
+            pos = scan_template(pos, pos + 1)
+            continue
+
+        if char == '/' and pos + 1 < length and code[pos + 1] not in '/*' and _regex_allowed(prev):
+            match = _REGEX_RE.match(code, pos)
+            if match:
+                emit('regex', pos, match.end())
+                pos = match.end()
+                continue
+
+        match = _TOKEN_RE.match(code, pos)
+        if not match:
+            emit('punct', pos, pos + 1)
+            pos += 1
+            continue
+
+        kind = match.lastgroup
+        end = match.end()
+        if kind == 'ws':
+            if keep_whitespace:
+                emit('ws', pos, end)
+            pos = end
+            continue
+
+        if kind == 'punct':
+            value = match.group()
+            if value == '{':
+                brace_stack.append('brace')
+            elif value == '}' and brace_stack:
+                brace_stack.pop()
+        emit(kind, pos, end)
+        pos = end
+
+    return tokens
+
+
+def code_tokens(tokens: List[Token]) -> List[Token]:
+    """过滤掉注释和换行，只保留有效代码token"""
+    return [t for t in tokens if t.type not in ('comment', 'newline', 'ws')]
+
+
+def find_matching(tokens: List[Token], index: int) -> int:
+    """返回与 tokens[index] 处括号匹配的闭合括号下标，找不到时返回最后一个下标"""
+    opening = tokens[index].value
+    closing = OPENING[opening]
+    depth = 0
+    for i in range(index, len(tokens)):
+        token = tokens[i]
+        if token.type != 'punct':
+            continue
+        if token.value == opening:
+            depth += 1
+        elif token.value == closing:
+            depth -= 1
+            if depth == 0:
+                return i
+    return len(tokens) - 1
+
+
+def statement_end(tokens: List[Token], index: int) -> int:
+    """返回从 tokens[index] 开始的顶层语句的最后一个token下标
+
+    按括号深度跟踪，在深度为0的分号处或括号闭合后遇到新语句开头时结束，
+    适用于识别压缩库常见的 !function(){...}() 或 UMD 包装形式。
+    """
+    depth = 0
+    closed_block = False
+    i = index
+    while i < len(tokens):
+        token = tokens[i]
+        if token.type == 'punct':
+            if token.value in OPENING:
+                depth += 1
+            elif token.value in CLOSING:
+                depth -= 1
+                if depth <= 0:
+                    depth = 0
+                    closed_block = True
+            elif token.value == ';' and depth == 0 and i > index:
+                return i
+        if closed_block and depth == 0 and i + 1 < len(tokens):
+            nxt = tokens[i + 1]
+            # 闭合后紧跟调用、成员访问或运算符时语句仍在继续
+            continues = nxt.type == 'punct' and nxt.value not in ('{', '!', '~', '++', '--', '@', '#')
+            if not continues and nxt.line > token.line:
+                return i
+        i += 1
+    return len(tokens) - 1
+
+
+def split_top_level(tokens: List[Token], open_index: int, separator: str = ',') -> List[tuple]:
+    """拆分对象或数组字面量的顶层元素，返回 [(起始下标, 结束下标), ...]"""
+    close_index = find_matching(tokens, open_index)
+    parts = []
+    depth = 0
+    part_start = open_index + 1
+    for i in range(open_index + 1, close_index):
+        token = tokens[i]
+        if token.type != 'punct':
+            continue
+        if token.value in OPENING:
+            depth += 1
+        elif token.value in CLOSING:
+            depth -= 1
+        elif token.value == separator and depth == 0:
+            if i > part_start:
+                parts.append((part_start, i - 1))
+            part_start = i + 1
+    if close_index > part_start:
+        parts.append((part_start, close_index - 1))
+    return parts
@@ -0,0 +1,344 @@
+"""JavaScript危险点切片
+
+在本地美化压缩代码，定位 eval、innerHTML、document.write、postMessage 处理函数、
+location 读取和硬编码密钥等危险点，只截取危险点附近带行号的代码片段交给大模型审计。
+"""
+
+import re
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+from ..config import config_manager
+from ..utils import LoggerMixin
+from .js_lexer import Token, tokenize
+
+# 需要前后空格的运算符
+_SPACED_OPERATORS = {
+    '=', '==', '===', '!=', '!==', '+=', '-=', '*=', '/=', '%=', '&=', '|=', '^=', '**=',
+    '<<=', '>>=', '>>>=', '&&=', '||=', '??=', '=>', '&&', '||', '??', '?', '<', '>', '<=', '>=',
+    '+', '-', '*', '/', '%', '**', '&', '|', '^', '<<', '>>', '>>>'
+}
+_SPACED_KEYWORDS = {'if', 'for', 'while', 'switch', 'catch', 'with', 'else', 'try', 'finally', 'do', 'return'}
+_WORD_LIKE = ('word', 'number', 'string', 'template', 'regex')
+# } 之后不换行的token
+_CONTINUATIONS = {')', ']', ',', ';', '.', '?.', 'else', 'catch', 'finally', 'while'}
+
+# 危险函数调用：名称 -> 描述
+SINK_CALLS = {
+    'eval': "eval执行代码",
+    'Function': "Function构造函数执行代码",
+    'execScript': "execScript执行代码",
+    'setTimeout': "setTimeout执行字符串代码",
+    'setInterval': "setInterval执行字符串代码",
+    'insertAdjacentHTML': "insertAdjacentHTML插入HTML",
+    'write': "document.write写入HTML",
+    'writeln': "document.writeln写入HTML",
+    'createContextualFragment': "createContextualFragment解析HTML",
+    'parseFromString': "DOMParser解析HTML",
+    'postMessage': "postMessage发送消息",
+}
+# 危险属性赋值：属性名 -> 描述
+SINK_PROPERTIES = {
+    'innerHTML': "innerHTML赋值",
+    'outerHTML': "outerHTML赋值",
+    'srcdoc': "iframe srcdoc赋值",
+    'onmessage': "message事件处理函数",
+    'dangerouslySetInnerHTML': "React dangerouslySetInnerHTML",
+}
+# location 上可导致任意跳转或 javascript: 伪协议执行的成员
+REDIRECT_MEMBERS = {'href', 'replace', 'assign'}
+# 用户可控输入来源：对象 -> 属性
+SOURCES = {
+    'location': {'hash', 'search', 'href', 'pathname', 'host'},
+    'document': {'URL', 'documentURI', 'referrer', 'cookie', 'baseURI'},
+    'window': {'name'},
+    'localStorage': {'getItem'},
+    'sessionStorage': {'getItem'},
+}
+# jQuery 等库中解析HTML的方法
+HTML_METHODS = {'html', 'append', 'prepend', 'after', 'before', 'replaceWith', 'wrap'}
+
+_SECRET_NAME_RE = re.compile(r'(api[_-]?key|secret|token|passw(or)?d|pwd|access[_-]?key|private[_-]?key|auth|credential)', re.I)
+_SECRET_VALUE_PATTERNS = [
+    (re.compile(r'AKIA[0-9A-Z]{16}'), "AWS Access Key"),
+    (re.compile(r'AIza[0-9A-Za-z_\-]{35}'), "Google API Key"),
+    (re.compile(r'gh[pousr]_[A-Za-z0-9]{36}'), "GitHub Token"),
+    (re.compile(r'xox[baprs]-[0-9A-Za-z\-]{10,}'), "Slack Token"),
+    (re.compile(r'eyJ[A-Za-z0-9_\-]{10,}\.eyJ[A-Za-z0-9_\-]{10,}\.[A-Za-z0-9_\-]+'), "JWT"),
+    (re.compile(r'-----BEGIN (RSA |EC |DSA |OPENSSH )?PRIVATE KEY-----'), "私钥"),
+    (re.compile(r'sk-[A-Za-z0-9]{20,}'), "API Secret Key"),
+]
+
+
+@dataclass
+class SinkFinding:
+    """危险点定位结果"""
+    kind: str
+    description: str
+    line: int
+    original_line: int
+    original_column: int
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "description": self.description,
+            "line": self.line,
+            "original_line": self.original_line,
+            "original_column": self.original_column
+        }
+
+
+@dataclass
+class SliceResult:
+    """切片结果"""
+    beautified: bool
+    findings: List[SinkFinding] = field(default_factory=list)
+    slices: List[str] = field(default_factory=list)
+
+    @property
+    def content(self) -> str:
+        return "\n\n".join(self.slices)
+
+
+def is_minified(code: str) -> bool:
+    """根据行长度判断是否为压缩代码"""
+    lines = code.split('\n')
+    longest = max(len(line) for line in lines)
+    return longest > 1000 or len(code) / len(lines) > 200
+
+
+def beautify(code: str) -> Tuple[str, List[int]]:
+    """基于token的代码美化
+
+    返回美化后的代码和每个token所在的美化后行号（与 tokenize(code) 的结果一一对应）。
+    """
+    tokens = tokenize(code)
+    lines: List[str] = []
+    token_lines: List[int] = []
+    current: List[str] = []
+    indent = 0
+    paren_depth = 0
+    prev: Optional[Token] = None
+
+    def flush() -> None:
+        nonlocal current, prev
+        if current:
+            lines.append('    ' * indent + ''.join(current))
+            current = []
+        prev = None
+
+    for index, token in enumerate(tokens):
+        if token.type == 'newline':
+            token_lines.append(len(lines) + 1)
+            continue
+        value = token.value
+
+        if token.type == 'punct' and value == '}':
+            flush()
+            indent = max(0, indent - 1)
+
+        if prev is not None and _needs_space(prev, token):
+            current.append(' ')
+        current.append(value)
+        token_lines.append(len(lines) + 1)
+        prev = token
+
+        if token.type == 'comment':
+            if value.startswith('//') or '\n' in value:
+                flush()
+        elif token.type == 'punct':
+            if value in ('(', '['):
+                paren_depth += 1
+            elif value in (')', ']'):
+                paren_depth = max(0, paren_depth - 1)
+            elif value == '{':
+                flush()
+                indent += 1
+            elif value == ';' and paren_depth == 0:
+                flush()
+            elif value == '}':
+                nxt = _next_significant(tokens, index)
+                if nxt is None or nxt.value not in _CONTINUATIONS:
+                    flush()
+
+    flush()
+    return '\n'.join(lines), token_lines
+
+
+def _next_significant(tokens: List[Token], index: int) -> Optional[Token]:
+    for position in range(index + 1, len(tokens)):
+        if tokens[position].type not in ('newline', 'comment'):
+            return tokens[position]
+    return None
+
+
+def _needs_space(prev: Token, token: Token) -> bool:
+    """判断两个token之间是否需要空格"""
+    if prev.type in _WORD_LIKE and token.type in _WORD_LIKE:
+        return True
+    if prev.type == 'comment':
+        return True
+    if token.type == 'punct' and token.value in _SPACED_OPERATORS:
+        return True
+    if prev.type == 'punct' and (prev.value in _SPACED_OPERATORS or prev.value in (',', ';')):
+        return token.type != 'punct' or token.value in ('(', '[', '{', '!', '~', '-', '+')
+    if prev.type == 'punct' and prev.value in (')', ']') and token.value == '{':
+        return True
+    if prev.type == 'punct' and prev.value in ('}', ':') and token.type in _WORD_LIKE:
+        return True
+    if prev.type == 'word' and prev.value in _SPACED_KEYWORDS and token.value in ('(', '{'):
+        return True
+    return token.type == 'comment'
+
+
+class JsSinkSlicer(LoggerMixin):
+    """JavaScript危险点切片器"""
+
+    def __init__(self, context_lines: int = 6, max_slice_lines: int = 80, max_line_length: int = 400):
+        self.context_lines = context_lines
+        self.max_slice_lines = max_slice_lines
+        self.max_line_length = max_line_length
+
+    def slice(self, code: str, excluded: Optional[List[Tuple[int, int]]] = None) -> SliceResult:
+        """定位危险点并截取代码片段
+
+        excluded 为不参与定位的字符区间（如已剔除的第三方库），行号始终对应传入的代码。
+        """
+        tokens = tokenize(code)
+        beautified = is_minified(code)
+        if beautified:
+            text, token_lines = beautify(code)
+        else:
+            text, token_lines = code, [token.line for token in tokens]
+
+        findings = self.find_sinks(code, tokens, token_lines, excluded or [])
+        lines = text.split('\n')
+        slices = self._build_slices(lines, findings)
+        self.logger.info(
+            f"危险点切片完成，美化: {beautified}, 危险点: {len(findings)}, 片段: {len(slices)}",
+            extra={'high_volume': True}
+        )
+        return SliceResult(beautified=beautified, findings=findings, slices=slices)
+
+    def find_sinks(self, code: str, tokens: List[Token], token_lines: List[int],
+                   excluded: Optional[List[Tuple[int, int]]] = None) -> List[SinkFinding]:
+        """在token流中匹配危险函数、危险属性、输入来源和硬编码密钥"""
+        significant = [(i, t) for i, t in enumerate(tokens) if t.type not in ('comment', 'newline', 'ws')]
+        findings = []
+        ranges = sorted(excluded or [])
+        starts = [start for start, _ in ranges]
+
+        def add(kind: str, description: str, position: int) -> None:
+            token = tokens[position]
+            slot = bisect_right(starts, token.start) - 1
+            if slot >= 0 and token.start < ranges[slot][1]:
+                return
+            column = token.start - code.rfind('\n', 0, token.start)
+            findings.append(SinkFinding(kind, description, token_lines[position], token.line, column))
+
+        for k, (i, token) in enumerate(significant):
+            prev = significant[k - 1][1] if k > 0 else None
+            nxt = significant[k + 1][1] if k + 1 < len(significant) else None
+            nxt2 = significant[k + 2][1] if k + 2 < len(significant) else None
+            member = prev is not None and prev.value in ('.', '?.')
+
+            if token.type == 'word':
+                name = token.value
+                calling = nxt is not None and nxt.value == '('
+                if name in SINK_CALLS and calling:
+                    if name in ('setTimeout', 'setInterval'):
+                        if nxt2 is not None and nxt2.type in ('string', 'template'):
+                            add('sink', SINK_CALLS[name], i)
+                    elif name in ('write', 'writeln'):
+                        if member and k > 1 and significant[k - 2][1].value == 'document':
+                            add('sink', SINK_CALLS[name], i)
+                    elif name == 'postMessage':
+                        add('sink', SINK_CALLS[name], i)
+                    elif not member or name != 'Function':
+                        add('sink', SINK_CALLS[name], i)
+                elif name == 'Function' and prev is not None and prev.value == 'new':
+                    add('sink', SINK_CALLS[name], i)
+                elif name in SINK_PROPERTIES and member and nxt is not None and nxt.value in ('=', '+='):
+                    add('sink', SINK_PROPERTIES[name], i)
+                elif name == 'dangerouslySetInnerHTML':
+                    add('sink', SINK_PROPERTIES[name], i)
+                elif name in HTML_METHODS and member and calling and nxt2 is not None and nxt2.value != ')':
+                    add('sink', f"{name}()插入HTML", i)
+                elif name == 'addEventListener' and calling and nxt2 is not None and nxt2.type == 'string' \
+                        and nxt2.value.strip('\'"') == 'message':
+                    add('sink', "message事件监听（需检查origin校验）", i)
+                elif name in SOURCES and not member and nxt is not None and nxt.value in ('.', '?.') and nxt2 is not None \
+                        and nxt2.value in SOURCES[name]:
+                    add('source', f"读取 {name}.{nxt2.value}", i)
+                elif name == 'location' and nxt is not None and nxt.value == '=':
+                    add('sink', "location赋值（可能的任意跳转）", i)
+                elif name in REDIRECT_MEMBERS and member and k > 1 and significant[k - 2][1].value == 'location' \
+                        and nxt is not None and nxt.value in ('=', '('):
+                    add('sink', f"location.{name}跳转（可能的任意跳转）", i)
+
+            elif token.type in ('string', 'template'):
+                description = self._secret_description(token.value, prev, significant, k)
+                if description:
+                    add('secret', description, i)
+
+        return findings
+
+    @staticmethod
+    def _secret_description(value: str, prev: Optional[Token], significant: list, k: int) -> Optional[str]:
+        """识别硬编码密钥"""
+        for pattern, description in _SECRET_VALUE_PATTERNS:
+            if pattern.search(value):
+                return f"硬编码{description}"
+        literal = value[1:-1]
+        if len(literal) < 8 or ' ' in literal or prev is None or prev.value not in (':', '='):
+            return None
+        key = significant[k - 2][1] if k > 1 else None
+        if key is not None and key.type in ('word', 'string') and _SECRET_NAME_RE.search(key.value):
+            return f"硬编码凭据 ({key.value.strip(chr(39) + chr(34))})"
+        return None
+
+    def _build_slices(self, lines: List[str], findings: List[SinkFinding]) -> List[str]:
+        """按危险点所在行截取上下文，重叠的窗口合并为一个片段"""
+        windows: List[list] = []
+        for finding in sorted(findings, key=lambda f: f.line):
+            start = max(1, finding.line - self.context_lines)
+            end = min(len(lines), finding.line + self.context_lines)
+            last = windows[-1] if windows else None
+            if last and start <= last[1] + 1 and end - last[0] < self.max_slice_lines:
+                last[1] = max(last[1], end)
+                last[2].append(finding)
+            else:
+                windows.append([start, end, [finding]])
+
+        slices = []
+        for index, (start, end, items) in enumerate(windows, 1):
+            labels = []
+            for item in items:
+                label = f"L{item.line} {item.description}"
+                if label not in labels:
+                    labels.append(label)
+            header = f"// ---- 片段{index}: 第{start}-{end}行 | {'; '.join(labels)} ----"
+            body = [
+                f"{number:>6}| {self._clip(lines[number - 1])}"
+                for number in range(start, end + 1)
+            ]
+            slices.append('\n'.join([header] + body))
+        return slices
+
+    def _clip(self, line: str) -> str:
+        if len(line) <= self.max_line_length:
+            return line
+        return line[:self.max_line_length] + ' …'
+
+
+# 全局JavaScript危险点切片器实例
+js_sink_slicer = JsSinkSlicer(
+    context_lines=int(config_manager.get_config_value('javascript', 'slice_context_lines', '6')),
+    max_slice_lines=int(config_manager.get_config_value('javascript', 'slice_max_lines', '80'))
+)
+
+
+def slice_js(code: str, excluded: Optional[List[Tuple[int, int]]] = None) -> SliceResult:
+    """CPU进程池任务，见 JsSinkSlicer.slice"""
+    return js_sink_slicer.slice(code, excluded)
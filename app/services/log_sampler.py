@@ -0,0 +1,351 @@
+"""Web日志的预算内分层抽样
+
+日志远超单次提示的token预算时，分块分析要调用模型很多次再汇总，成本随日志大小线性增长。
+这里在本地对每一行和每个会话（来源IP）打异常分：单IP请求速率、URL熵、罕见路径、错误突发、
+罕见User-Agent和攻击特征命中；再按命中类别和状态码分层，抽取有代表性的子集，连同本地统计
+摘要和省略说明一起正好放进一次提示。无论日志多大，分析都只需一次模型调用。
+分项分析时同样的解析结果还用于给统计分析提供摘要、给攻击检测筛出可疑行。
+"""
+
+import math
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from .prompt_templates import estimate_tokens
+from ..config import config_manager
+from ..utils import LoggerMixin
+
+# 通用/组合日志格式：来源IP、时间（精确到分钟）、请求方法和路径、状态码、User-Agent
+_ACCESS_LOG_RE = re.compile(
+    r'^(\S+) \S+ \S+ \[([^\]:]+:\d{2}:\d{2})[^\]]*\] "(?:\S+ (\S+)[^"]*)?" (\d{3}) \S+'
+    r'(?: "[^"]*" "([^"]*)")?'
+)
+
+# 路径归一化：数字段和长十六进制段视为同一路径
+_PATH_ID_RE = re.compile(r'/(?:\d+|[0-9a-fA-F]{16,})(?=/|$)')
+
+# 攻击特征，命中的行单独分层并优先保留
+_SIGNATURES = [
+    ("SQL注入", r"union(?:\s|%20|\+|/\*.*?\*/)+(?:all(?:\s|%20|\+)+)?select|"
+              r"(?:'|%27)(?:\s|%20|\+)*(?:or|and)(?:\s|%20|\+)|sleep(?:\(|%28)\d|benchmark(?:\(|%28)|information_schema"),
+    ("XSS", r'<script|%3cscript|javascript:|on(?:error|load)(?:\s|%20)*(?:=|%3d)'),
+    ("路径遍历", r'\.\./|\.\.%2f|%2e%2e(?:/|%2f)|/etc/passwd|win\.ini'),
+    ("命令执行", r'(?:;|\||%7c|%3b|`|\$\(|%24%28)(?:\s|%20|\+)*(?:id|whoami|cat|wget|curl|nc|bash|sh)\b'),
+    ("文件包含", r'(?:php|file|data|expect|zip|phar)://|=https?(?::|%3a)(?://|%2f%2f)'),
+    ("扫描器", r'sqlmap|nikto|nmap|acunetix|dirbuster|gobuster|wpscan|masscan|nuclei|zgrab'),
+    ("敏感文件", r'/\.env\b|/\.git/|wp-config|\.(?:bak|sql|swp)\b|phpmyadmin'),
+]
+# 匹配前先把行转为小写，比逐个使用忽略大小写的模式快得多
+_SIGNATURE_PATTERNS = [(name, re.compile(pattern)) for name, pattern in _SIGNATURES]
+
+# 各信号在行评分中的权重
+_WEIGHTS = {"rate": 1.0, "entropy": 1.5, "rare_path": 2.0, "error_burst": 2.0, "rare_agent": 1.0, "signature": 3.0}
+
+# 摘要中列出的高频IP和异常会话数
+SUMMARY_TOP = int(config_manager.get_config_value('log_sampler', 'summary_top', '10'))
+# 每一层中按评分选取的比例，其余按时间均匀选取作为常态样本
+TOP_SCORE_SHARE = float(config_manager.get_config_value('log_sampler', 'top_score_share', '0.6'))
+# 可疑行占全部行的比例不超过该值时，攻击检测只分析可疑行
+FOCUS_MAX_SHARE = 0.8
+
+
+@dataclass
+class _Line:
+    index: int
+    text: str
+    ip: str = ''
+    minute: str = ''
+    path: str = ''
+    status: int = 0
+    agent: str = ''
+    signatures: List[str] = field(default_factory=list)
+    entropy: float = 0.0
+    score: float = 0.0
+    cost: int = 0
+
+    @property
+    def key(self):
+        return (self.ip, self.path, self.status) if self.ip else self.text
+
+    @property
+    def stratum(self) -> str:
+        if self.signatures:
+            return self.signatures[0]
+        if not self.ip:
+            return "未解析"
+        return f"{self.status // 100}xx"
+
+
+@dataclass
+class LogSample:
+    """抽样结果：放进提示的文本和抽样报告"""
+    text: str
+    report: Dict[str, Any]
+
+
+@dataclass
+class LogFocus:
+    """分项分析用的本地预处理结果：全部日志的统计摘要，以及只含可疑行的日志（筛选后没有明显缩减时为 None）"""
+    summary: str
+    suspicious: Optional[str]
+    suspicious_lines: int
+
+
+def _entropy(text: str) -> float:
+    """字符分布的香农熵（比特/字符）"""
+    if not text:
+        return 0.0
+    counts = Counter(text)
+    total = len(text)
+    return -sum(count / total * math.log2(count / total) for count in counts.values())
+
+
+def _normalize_path(target: str) -> str:
+    return _PATH_ID_RE.sub('/{id}', target.split('?', 1)[0])
+
+
+def _median(values: List[int]) -> float:
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+class LogSampler(LoggerMixin):
+    """本地异常评分和按token预算的分层抽样"""
+
+    def sample(self, content: str, budget_tokens: int) -> LogSample:
+        """抽取不超过 budget_tokens 的代表性子集；日志本身不超过预算时原样返回"""
+        total_tokens = estimate_tokens(content)
+        lines = self._parse(content)
+        if total_tokens <= budget_tokens or not lines:
+            return LogSample(content, {"sampled": False, "total_lines": len(lines), "total_tokens": total_tokens})
+
+        sessions = self._score(lines)
+        header = self._summary(lines, sessions)
+        selected = self._select(lines, budget_tokens - estimate_tokens(header))
+
+        # 省略说明随选中行变化，超出预算时去掉评分最低的选中行，直到整体不超过预算
+        while True:
+            text = self._render(header, lines, selected)
+            if estimate_tokens(text) <= budget_tokens or not selected:
+                break
+            selected.remove(min(selected, key=lambda item: (item.score, -item.index)))
+
+        report = self._report(lines, selected, sessions, total_tokens, estimate_tokens(text), budget_tokens)
+        self.logger.info(
+            f"日志抽样: {len(selected)}/{len(lines)} 行, token: {report['sampled_tokens']}/{total_tokens}, "
+            f"预算: {budget_tokens}"
+        )
+        return LogSample(text, report)
+
+    def focus(self, content: str) -> LogFocus:
+        """解析一次日志，得到统计摘要和可疑行（命中攻击特征、4xx/5xx或无法解析的行）"""
+        lines = self._parse(content)
+        sessions = self._score(lines)
+        suspicious = [line for line in lines if line.signatures or line.status >= 400 or not line.ip]
+        # 筛掉的行不足两成时，直接分析原日志
+        text = None
+        if suspicious and len(suspicious) <= len(lines) * FOCUS_MAX_SHARE:
+            text = "\n".join(line.text for line in suspicious)
+        return LogFocus(self._summary(lines, sessions), text, len(suspicious))
+
+    @staticmethod
+    def _parse(content: str) -> List[_Line]:
+        lines = []
+        for index, text in enumerate(content.splitlines(), 1):
+            if not text.strip():
+                continue
+            # 加上行号前缀和换行，逐行累加的估算不低于整段文本的估算
+            line = _Line(index, text, cost=estimate_tokens(text) + 3)
+            match = _ACCESS_LOG_RE.match(text)
+            if match:
+                line.ip, line.minute, target, status, agent = match.groups()
+                target = target or ''
+                line.path = _normalize_path(target)
+                line.status = int(status)
+                line.agent = agent or ''
+                line.entropy = _entropy(target)
+            lowered = text.lower()
+            line.signatures = [name for name, pattern in _SIGNATURE_PATTERNS if pattern.search(lowered)]
+            lines.append(line)
+        return lines
+
+    @staticmethod
+    def _score(lines: List[_Line]) -> Dict[str, Dict[str, Any]]:
+        """为每行打分，并返回按来源IP聚合的会话统计"""
+        parsed = [line for line in lines if line.ip]
+        total = max(1, len(parsed))
+        path_counts = Counter(line.path for line in parsed)
+        agent_counts = Counter(line.agent for line in parsed)
+        per_minute = Counter((line.ip, line.minute) for line in parsed)
+
+        sessions: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
+            "requests": 0, "errors": 0, "peak_per_minute": 0, "paths": set(), "signatures": Counter(), "score": 0.0
+        })
+        for (ip, _), count in per_minute.items():
+            session = sessions[ip]
+            session["peak_per_minute"] = max(session["peak_per_minute"], count)
+        for line in parsed:
+            session = sessions[line.ip]
+            session["requests"] += 1
+            session["errors"] += line.status >= 400
+            session["paths"].add(line.path)
+            session["signatures"].update(line.signatures)
+
+        typical_peak = _median([session["peak_per_minute"] for session in sessions.values()]) if sessions else 1
+        rare_agent = max(1, total // 1000)
+        entropy_baseline = _median([round(line.entropy, 2) for line in parsed]) if parsed else 0.0
+
+        for line in lines:
+            signals = {"signature": min(len(line.signatures), 2)}
+            if line.ip:
+                session = sessions[line.ip]
+                signals["rate"] = min(4.0, max(0.0, math.log2(session["peak_per_minute"] / max(typical_peak, 1))))
+                signals["entropy"] = max(0.0, line.entropy - max(entropy_baseline, 3.5))
+                signals["rare_path"] = math.log(total / path_counts[line.path]) / math.log(total) if total > 1 else 0.0
+                if line.status >= 400:
+                    error_ratio = session["errors"] / session["requests"]
+                    signals["error_burst"] = error_ratio * min(1.0, session["errors"] / 5)
+                signals["rare_agent"] = 1.0 if agent_counts[line.agent] <= rare_agent or not line.agent else 0.0
+            else:
+                # 无法解析的行（堆栈、非访问日志）只看特征和字符熵
+                signals["entropy"] = max(0.0, _entropy(line.text) - 5.0)
+            line.score = sum(_WEIGHTS[name] * value for name, value in signals.items())
+
+        for ip, session in sessions.items():
+            error_ratio = session["errors"] / session["requests"]
+            session["score"] = (
+                min(4.0, max(0.0, math.log2(session["peak_per_minute"] / max(typical_peak, 1))))
+                + 2 * error_ratio * min(1.0, session["errors"] / 5)
+                + _WEIGHTS["signature"] * min(len(session["signatures"]), 3)
+            )
+        return sessions
+
+    @staticmethod
+    def _summary(lines: List[_Line], sessions: Dict[str, Dict[str, Any]]) -> str:
+        """基于全部行的本地统计摘要"""
+        parsed = [line for line in lines if line.ip]
+        statuses = Counter(line.status for line in parsed)
+        signature_lines = Counter(name for line in lines for name in line.signatures)
+        busiest = sorted(sessions.items(), key=lambda item: -item[1]["requests"])[:SUMMARY_TOP]
+        suspicious = [item for item in sorted(sessions.items(), key=lambda item: -item[1]["score"])
+                      if item[1]["score"] > 0][:SUMMARY_TOP]
+
+        def describe(ip: str, session: Dict[str, Any]) -> str:
+            text = (f"{ip}（{session['requests']}次，峰值{session['peak_per_minute']}次/分钟，"
+                    f"错误率{session['errors'] * 100 // session['requests']}%，{len(session['paths'])}个路径")
+            if session["signatures"]:
+                text += "，命中: " + "、".join(name for name, _ in session["signatures"].most_common())
+            return text + "）"
+
+        parts = [
+            f"【本地统计（全部{len(lines)}行，{len(parsed)}行可解析，{len(sessions)}个来源IP）】",
+            "状态码分布: " + ("，".join(f"{status}: {count}" for status, count in sorted(statuses.items())) or "无"),
+            "特征命中: " + ("，".join(f"{name} {count}行" for name, count in signature_lines.most_common()) or "无"),
+            "请求最多的IP: " + ("；".join(describe(ip, session) for ip, session in busiest) or "无"),
+            "异常评分最高的会话: " + ("；".join(describe(ip, session) for ip, session in suspicious) or "无"),
+        ]
+        return "\n".join(parts)
+
+    @staticmethod
+    def _select(lines: List[_Line], budget: int) -> List[_Line]:
+        """按层分配预算：每层先取评分最高的不重复行，再按时间均匀取常态样本；剩余预算按全局评分补足"""
+        strata: Dict[str, List[_Line]] = defaultdict(list)
+        for line in lines:
+            strata[line.stratum].append(line)
+        # 层的份额与行数的平方根和层内最高分成正比，小而异常的层不会被大层淹没
+        weights = {
+            name: math.sqrt(len(members)) * (1 + max(line.score for line in members))
+            for name, members in strata.items()
+        }
+        weight_total = sum(weights.values())
+
+        selected: Dict[int, _Line] = {}
+        # 已选行的来源、路径和状态码；重复的行先让位给不同的行，预算仍有剩余时才补入
+        keys = set()
+        used = 0
+
+        def take(line: _Line, limit: float, distinct: bool = True) -> None:
+            nonlocal used
+            if line.index in selected or used + line.cost > limit or (distinct and line.key in keys):
+                return
+            selected[line.index] = line
+            keys.add(line.key)
+            used += line.cost
+
+        for name, members in strata.items():
+            allotment = budget * weights[name] / weight_total
+            share = used + allotment
+            top_limit = used + allotment * TOP_SCORE_SHARE
+            for line in sorted(members, key=lambda item: (-item.score, item.index)):
+                if used >= top_limit:
+                    break
+                take(line, top_limit)
+            remaining = [line for line in members if line.index not in selected]
+            if remaining:
+                count = max(1, int((share - used) / (sum(line.cost for line in remaining) / len(remaining))))
+                for line in remaining[::max(1, len(remaining) // count)]:
+                    take(line, share)
+            # 每层至少保留一行
+            if not any(line.index in selected for line in members):
+                take(max(members, key=lambda item: item.score), budget, distinct=False)
+
+        ranked = sorted(lines, key=lambda item: (-item.score, item.index))
+        for distinct in (True, False):
+            for line in ranked:
+                if used >= budget:
+                    break
+                take(line, budget, distinct)
+        return list(selected.values())
+
+    @staticmethod
+    def _render(header: str, lines: List[_Line], selected: List[_Line]) -> str:
+        chosen = {line.index for line in selected}
+        totals = Counter(line.stratum for line in lines)
+        kept = Counter(line.stratum for line in selected)
+        omitted = "，".join(
+            f"{name} {totals[name] - kept[name]}/{totals[name]}行" for name in sorted(totals) if totals[name] > kept[name]
+        )
+        body = "\n".join(f"#{line.index} {line.text}" for line in lines if line.index in chosen)
+        return (
+            f"{header}\n"
+            f"【抽样说明】以下是按异常评分分层抽取的{len(chosen)}/{len(lines)}行，行首为原始行号；"
+            f"省略: {omitted or '无'}\n\n{body}"
+        )
+
+    @staticmethod
+    def _report(lines: List[_Line], selected: List[_Line], sessions: Dict[str, Dict[str, Any]],
+                total_tokens: int, sampled_tokens: int, budget_tokens: int) -> Dict[str, Any]:
+        totals = Counter(line.stratum for line in lines)
+        kept = Counter(line.stratum for line in selected)
+        top_sessions = sorted(sessions.items(), key=lambda item: -item[1]["score"])[:SUMMARY_TOP]
+        return {
+            "sampled": True,
+            "total_lines": len(lines),
+            "sampled_lines": len(selected),
+            "omitted_lines": len(lines) - len(selected),
+            "total_tokens": total_tokens,
+            "sampled_tokens": sampled_tokens,
+            "budget_tokens": budget_tokens,
+            "strata": {name: {"total": totals[name], "sampled": kept[name]} for name in sorted(totals)},
+            "top_sessions": [
+                {"ip": ip, "score": round(session["score"], 2), "requests": session["requests"],
+                 "errors": session["errors"], "signatures": dict(session["signatures"])}
+                for ip, session in top_sessions if session["score"] > 0
+            ]
+        }
+
+
+# 全局日志抽样实例
+log_sampler = LogSampler()
+
+
+def sample_log(content: str, budget_tokens: int) -> LogSample:
+    """CPU进程池任务，见 LogSampler.sample"""
+    return log_sampler.sample(content, budget_tokens)
+
+
+def focus_log(content: str) -> LogFocus:
+    """CPU进程池任务，见 LogSampler.focus"""
+    return log_sampler.focus(content)
@@ -0,0 +1,406 @@
+"""Web日志持续跟踪
+
+跟踪一个或多个正在写入的日志文件，只分析新追加的行。按时间或大小划分窗口，每个窗口调用一次
+日志分析并产出一条发现；滚动统计（IP排行、状态码分布、错误率）按窗口增量维护，不重新扫描文件。
+每个文件的 inode 和已处理字节偏移持久化为检查点：日志轮转（改名或截断）后从新文件开头继续，
+服务重启后从检查点续读。
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+from .analysis_service import analysis_service
+from ..config import config_manager
+from ..utils import LoggerMixin, ValidationError, set_request_id, set_client_context, clear_request_context
+
+# 通用/组合日志格式：来源IP、请求方法和路径、状态码
+_ACCESS_LOG_RE = re.compile(r'^(\S+) \S+ \S+ \[[^\]]*\] "(?:(\S+) (\S+)[^"]*)?" (\d{3}) ')
+
+# 跟踪任务以该视图函数名参与模型调用调度，归入批量通道
+TAIL_ENDPOINT = 'analyze_web_logs'
+
+# 轮询间隔（秒）、滚动统计覆盖的窗口数、每个任务保留的发现条数
+TAIL_POLL_INTERVAL = float(config_manager.get_config_value('tail', 'poll_interval', '2'))
+TAIL_ROLLING_WINDOWS = int(config_manager.get_config_value('tail', 'rolling_windows', '24'))
+TAIL_MAX_FINDINGS = int(config_manager.get_config_value('tail', 'max_findings', '100'))
+
+
+class CheckpointStore:
+    """按文件路径保存 inode 和偏移的检查点文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._data is None:
+            try:
+                with open(self.path, encoding='utf-8') as handle:
+                    self._data = json.load(handle)
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._load().get(path)
+
+    def save(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        with self._lock:
+            data = self._load()
+            data.update(entries)
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as handle:
+                json.dump(data, handle, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+class LogFollower:
+    """跟踪单个日志文件，处理改名轮转和截断"""
+
+    def __init__(self, path: str, checkpoint: Optional[Dict[str, Any]], from_start: bool):
+        self.path = path
+        self.inode: Optional[int] = None
+        self.offset = 0
+        self._handle = None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        if checkpoint and checkpoint.get('inode') == stat.st_ino and checkpoint.get('offset', 0) <= stat.st_size:
+            start = checkpoint['offset']
+        elif checkpoint or from_start:
+            # 检查点之后文件已轮转，新文件的内容都未处理过
+            start = 0
+        else:
+            # 首次跟踪只处理之后追加的内容
+            start = stat.st_size
+        self._open(start)
+
+    def _open(self, offset: int) -> bool:
+        try:
+            handle = open(self.path, 'rb')
+        except OSError:
+            return False
+        self.close()
+        self._handle = handle
+        self.inode = os.fstat(handle.fileno()).st_ino
+        self.offset = offset
+        return True
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def read_lines(self, max_bytes: int) -> List[str]:
+        """读取新追加的完整行，最多约 max_bytes 字节；行不完整时留待下次读取"""
+        if self._handle is None and not self._open(0):
+            return []
+        self._handle.seek(self.offset)
+        data = self._handle.read(max(1, max_bytes))
+        end = data.rfind(b'\n') + 1
+        if end == 0 and len(data) >= max_bytes:
+            # 单行超过读取上限，整行读完
+            end = len(data) + len(self._handle.readline())
+            self._handle.seek(self.offset)
+            data = self._handle.read(end)
+        if end:
+            self.offset += end
+            return data[:end].decode('utf-8', errors='replace').splitlines()
+        return self._check_rotation(data)
+
+    def _check_rotation(self, tail: bytes) -> List[str]:
+        """已读到旧文件末尾时检查是否轮转或截断"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # 轮转进行中，新文件尚未创建
+            return []
+        if stat.st_ino != self.inode:
+            # 改名轮转：旧文件已读完，末尾不完整的行一并交出，然后切换到新文件
+            lines = [tail.decode('utf-8', errors='replace')] if tail.strip() else []
+            self._open(0)
+            return lines
+        if stat.st_size < self.offset:
+            # copytruncate 方式的轮转
+            self.offset = 0
+        return []
+
+    def checkpoint(self) -> Dict[str, Any]:
+        return {"inode": self.inode, "offset": self.offset, "updated_at": time.time()}
+
+
+@dataclass
+class WindowStats:
+    """单个窗口的计数"""
+    lines: int = 0
+    parsed: int = 0
+    client_errors: int = 0
+    server_errors: int = 0
+    ips: Counter = field(default_factory=Counter)
+    paths: Counter = field(default_factory=Counter)
+    statuses: Counter = field(default_factory=Counter)
+
+    def add(self, line: str) -> None:
+        self.lines += 1
+        match = _ACCESS_LOG_RE.match(line)
+        if not match:
+            return
+        ip, _, path, status = match.groups()
+        self.parsed += 1
+        self.ips[ip] += 1
+        if path:
+            self.paths[path.split('?', 1)[0]] += 1
+        self.statuses[status] += 1
+        if status.startswith('4'):
+            self.client_errors += 1
+        elif status.startswith('5'):
+            self.server_errors += 1
+
+    def summary(self, top: int = 10) -> Dict[str, Any]:
+        return {
+            "lines": self.lines,
+            "parsed": self.parsed,
+            "error_rate": round((self.client_errors + self.server_errors) / self.parsed, 4) if self.parsed else 0.0,
+            "server_error_rate": round(self.server_errors / self.parsed, 4) if self.parsed else 0.0,
+            "top_ips": self.ips.most_common(top),
+            "top_paths": self.paths.most_common(top),
+            "statuses": dict(self.statuses)
+        }
+
+
+class RollingAggregates:
+    """最近若干窗口的滚动统计，窗口移出时减去其计数"""
+
+    def __init__(self, windows: int):
+        self._windows: Deque[WindowStats] = deque()
+        self._max_windows = max(1, windows)
+        self.total = WindowStats()
+
+    def push(self, stats: WindowStats) -> None:
+        self._windows.append(stats)
+        self._apply(stats, 1)
+        if len(self._windows) > self._max_windows:
+            self._apply(self._windows.popleft(), -1)
+
+    def _apply(self, stats: WindowStats, sign: int) -> None:
+        total = self.total
+        total.lines += sign * stats.lines
+        total.parsed += sign * stats.parsed
+        total.client_errors += sign * stats.client_errors
+        total.server_errors += sign * stats.server_errors
+        for name in ('ips', 'paths', 'statuses'):
+            counter = getattr(total, name)
+            if sign > 0:
+                counter.update(getattr(stats, name))
+            else:
+                counter.subtract(getattr(stats, name))
+                # 去掉计数归零的键，避免长期运行时无限增长
+                for key in [key for key, count in counter.items() if count <= 0]:
+                    del counter[key]
+
+    def summary(self) -> Dict[str, Any]:
+        return {"windows": len(self._windows), **self.total.summary()}
+
+
+class TailJob(LoggerMixin):
+    """一个跟踪任务：轮询文件、划分窗口、分析并保存检查点"""
+
+    def __init__(self, paths: List[str], analysis_options: List[str], window_seconds: float,
+                 window_max_bytes: int, analyze: bool, from_start: bool, checkpoints: CheckpointStore):
+        self.id = uuid.uuid4().hex[:12]
+        self.paths = paths
+        self.analysis_options = analysis_options
+        self.window_seconds = window_seconds
+        self.window_max_bytes = window_max_bytes
+        self.analyze = analyze
+        self.checkpoints = checkpoints
+        self.followers = [LogFollower(path, checkpoints.get(path), from_start) for path in paths]
+        self.aggregates = RollingAggregates(TAIL_ROLLING_WINDOWS)
+        self.findings: Deque[Dict[str, Any]] = deque(maxlen=TAIL_MAX_FINDINGS)
+        self.window_count = 0
+        self.status = "running"
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"tail-{self.id}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.status == "running":
+            # 正在分析的窗口完成后线程才会退出
+            self.status = "stopping"
+
+    @property
+    def alive(self) -> bool:
+        return self._thread.is_alive()
+
+    @property
+    def stop_requested(self) -> bool:
+        return self._stop.is_set()
+
+    def _run(self) -> None:
+        # 后台线程没有请求上下文，按跟踪任务标识参与调度
+        set_client_context(f"tail:{self.id}", TAIL_ENDPOINT)
+        lines: List[str] = []
+        size = 0
+        window_start: Optional[float] = None
+        try:
+            while True:
+                stopping = self._stop.wait(TAIL_POLL_INTERVAL)
+                for follower in self.followers:
+                    if size >= self.window_max_bytes:
+                        break
+                    new_lines = follower.read_lines(self.window_max_bytes - size)
+                    lines.extend(new_lines)
+                    size += sum(len(line) + 1 for line in new_lines)
+                if lines and window_start is None:
+                    window_start = time.time()
+                if lines and (stopping or size >= self.window_max_bytes
+                              or time.time() - window_start >= self.window_seconds):
+                    self._close_window(lines, window_start)
+                    lines, size, window_start = [], 0, None
+                if stopping:
+                    break
+            self.status = "stopped"
+        except Exception as e:
+            self.logger.error(f"日志跟踪任务失败: {self.id}, {str(e)}")
+            self.status, self.error = "failed", str(e)
+        finally:
+            for follower in self.followers:
+                follower.close()
+            clear_request_context()
+
+    def _close_window(self, lines: List[str], window_start: float) -> None:
+        self.window_count += 1
+        set_request_id(f"tail-{self.id}-{self.window_count}")
+        stats = WindowStats()
+        for line in lines:
+            stats.add(line)
+        finding: Dict[str, Any] = {
+            "window": self.window_count,
+            "start": window_start,
+            "end": time.time(),
+            "stats": stats.summary()
+        }
+        if self.analyze:
+            try:
+                finding["result"] = analysis_service.analyze_web_logs("\n".join(lines), self.analysis_options)["result"]
+            except Exception as e:
+                # 分析失败不影响统计和偏移推进，避免同一窗口反复失败阻塞后续日志
+                self.logger.error(f"日志窗口分析失败: {self.id}#{self.window_count}, {str(e)}")
+                finding["error"] = str(e)
+        with self._lock:
+            self.aggregates.push(stats)
+            self.findings.append(finding)
+        self.checkpoints.save({follower.path: follower.checkpoint() for follower in self.followers})
+        self.logger.info(f"日志窗口完成: {self.id}#{self.window_count}, 行数: {len(lines)}")
+
+    def describe(self, since: int = 0) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "error": self.error,
+                "paths": self.paths,
+                "analysis_options": self.analysis_options,
+                "window_seconds": self.window_seconds,
+                "window_max_bytes": self.window_max_bytes,
+                "windows": self.window_count,
+                "started_at": self.started_at,
+                "offsets": {follower.path: follower.offset for follower in self.followers},
+                "aggregates": self.aggregates.summary(),
+                "findings": [finding for finding in self.findings if finding["window"] > since]
+            }
+
+
+class TailManager(LoggerMixin):
+    """管理跟踪任务，只允许跟踪配置目录下的文件"""
+
+    def __init__(self, allowed_dirs: List[str], max_jobs: int, checkpoints: CheckpointStore):
+        self.allowed_dirs = [os.path.realpath(path) for path in allowed_dirs]
+        self.max_jobs = max_jobs
+        self.checkpoints = checkpoints
+        self._jobs: Dict[str, TailJob] = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, path: str) -> str:
+        real = os.path.realpath(path)
+        if not any(real == folder or real.startswith(folder + os.sep) for folder in self.allowed_dirs):
+            raise ValidationError(f"不允许跟踪该路径: {path}", "TAIL_PATH_FORBIDDEN",
+                                  {"allowed_dirs": self.allowed_dirs})
+        if not os.path.isfile(real):
+            raise ValidationError(f"日志文件不存在: {path}", "TAIL_FILE_NOT_FOUND")
+        return real
+
+    def start(self, paths: List[str], analysis_options: List[str], window_seconds: float,
+              window_max_bytes: int, analyze: bool = True, from_start: bool = False) -> Dict[str, Any]:
+        resolved = list(dict.fromkeys(self._resolve(path) for path in paths))
+        with self._lock:
+            self._prune()
+            # 已请求停止但线程仍在运行的任务同样占用文件，避免两个任务读取并保存同一文件的偏移
+            running = [job for job in self._jobs.values() if job.alive]
+            if len(running) >= self.max_jobs:
+                raise ValidationError(f"同时运行的跟踪任务不能超过{self.max_jobs}个", "TAIL_LIMIT")
+            busy = {path for job in running for path in job.paths} & set(resolved)
+            if busy:
+                raise ValidationError(f"文件已在跟踪中: {', '.join(sorted(busy))}", "TAIL_PATH_BUSY")
+            job = TailJob(resolved, analysis_options, window_seconds, window_max_bytes,
+                          analyze, from_start, self.checkpoints)
+            self._jobs[job.id] = job
+        job.start()
+        self.logger.info(f"开始跟踪日志: {job.id}, 文件: {resolved}")
+        return job.describe()
+
+    def get(self, job_id: str) -> TailJob:
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise ValidationError(f"跟踪任务不存在: {job_id}", "TAIL_JOB_NOT_FOUND")
+        return job
+
+    def stop(self, job_id: str) -> Dict[str, Any]:
+        job = self.get(job_id)
+        job.stop()
+        job._thread.join(timeout=TAIL_POLL_INTERVAL * 2)
+        with self._lock:
+            self._prune()
+        self.logger.info(f"停止跟踪日志: {job_id}, 状态: {job.status}")
+        return job.describe()
+
+    def _prune(self) -> None:
+        """移除已请求停止且线程已退出的任务；仍在分析最后一个窗口的任务保留为 stopping"""
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.stop_requested and not job.alive]:
+            del self._jobs[job_id]
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._prune()
+            jobs = list(self._jobs.values())
+        return [
+            {key: value for key, value in job.describe().items() if key != "findings"}
+            for job in jobs
+        ]
+
+
+# 全局日志跟踪实例
+tail_manager = TailManager(
+    allowed_dirs=[
+        path.strip() for path in
+        config_manager.get_config_value('tail', 'allowed_dirs', '/var/log').split(',') if path.strip()
+    ],
+    max_jobs=int(config_manager.get_config_value('tail', 'max_jobs', '4')),
+    checkpoints=CheckpointStore(config_manager.get_config_value('tail', 'checkpoint_file', 'data/tail_checkpoints.json'))
+)
@@ -0,0 +1,162 @@
+"""小请求微批处理
+
+流量分析、字符串解码等接口的单条输入通常很短，每次请求却都要付出完整的模型往返和提示词开销。
+开启后，短时间窗口内并发到达的同类小请求会被合并为一个带编号条目的提示词，一次调用后按条目
+拆分结果交还给各自的调用方；某个条目的结果无法解析时，该条目退回单独调用。
+"""
+
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+from .ai_service import ai_service
+from .prompt_templates import PromptTemplate
+from ..config import config_manager
+from ..utils import LoggerMixin, raise_if_cancelled, check_deadline
+from ..utils.exceptions import DeadlineExceededError, RequestCancelledError
+
+# 跟随者等待合并结果时检查自身取消和截止时间的间隔（秒）
+WAIT_POLL_SECONDS = 0.2
+
+_ITEM_HEADER_RE = re.compile(r'^[ \t#*]*【条目\s*(\d+)】[ \t*]*', re.M)
+
+
+@dataclass(frozen=True)
+class BatchKind:
+    """一类可合并的请求
+
+    template 的系统消息包含分析要求、输出格式和条目编号规则，required_marker 是单条结果中
+    必须出现的标记，用于判断拆分出的结果是否完整。
+    """
+    name: str
+    item_label: str
+    template: PromptTemplate
+    required_marker: str
+
+
+@dataclass
+class _BatchItem:
+    content: str
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Optional[str] = None
+    error: Optional[BaseException] = None
+
+
+@dataclass
+class _Batch:
+    items: List[_BatchItem] = field(default_factory=list)
+    full: threading.Event = field(default_factory=threading.Event)
+
+
+class MicroBatcher(LoggerMixin):
+    """按请求类型合并并发小请求
+
+    每个窗口内第一个到达的请求作为领头者，等待窗口结束或凑满条目数后发起合并调用，
+    其余请求等待领头者分发结果，不需要额外的后台线程。合并调用在领头者的请求上下文中进行，
+    领头者被取消或超过截止时间时只有它自己失败，其余条目退回各自单独调用。
+    """
+
+    def __init__(self, enabled: bool, window_ms: int, max_items: int, max_item_tokens: int):
+        self.enabled = enabled
+        self.window = window_ms / 1000
+        self.max_items = max(1, max_items)
+        self.max_item_tokens = max_item_tokens
+        self.ai_service = ai_service
+        self._lock = threading.Lock()
+        self._open: Dict[str, _Batch] = {}
+
+    def accepts(self, content: str) -> bool:
+        return (self.enabled and self.max_items > 1
+                and self.ai_service._estimate_tokens(content) <= self.max_item_tokens)
+
+    def submit(self, kind: BatchKind, content: str, fallback: Callable[[], str]) -> str:
+        """提交一条请求，返回该条目的分析结果；不适合合并或解析失败时调用 fallback"""
+        if not self.accepts(content):
+            return fallback()
+
+        item = _BatchItem(content)
+        with self._lock:
+            batch = self._open.get(kind.name)
+            leader = batch is None
+            if leader:
+                batch = self._open[kind.name] = _Batch()
+            batch.items.append(item)
+            if len(batch.items) >= self.max_items:
+                # 已凑满，后续请求进入新批次
+                del self._open[kind.name]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(kind.name) is batch:
+                    del self._open[kind.name]
+            self._dispatch(kind, batch.items, item)
+        else:
+            # 等待期间自身被取消或超过截止时间时不再等待，领头者之后写入的结果被忽略
+            while not item.done.wait(WAIT_POLL_SECONDS):
+                raise_if_cancelled()
+                check_deadline()
+
+        if item.error is not None:
+            raise item.error
+        if item.result is None:
+            return fallback()
+        return item.result
+
+    def _dispatch(self, kind: BatchKind, items: List[_BatchItem], leader: _BatchItem) -> None:
+        try:
+            if len(items) == 1:
+                # 窗口内没有其他请求，直接单独调用
+                return
+            self.logger.info(f"微批合并调用: {kind.name}, 条目数: {len(items)}", extra={'high_volume': True})
+            response = self.ai_service.chat_completion(
+                self._build_prompt(kind, items), temperature=0.3, system=kind.template.system
+            )
+            answers = self._split_response(response, len(items))
+            failed = 0
+            for index, item in enumerate(items, 1):
+                answer = answers.get(index)
+                if answer and kind.required_marker in answer:
+                    item.result = answer
+                else:
+                    failed += 1
+            if failed:
+                self.logger.warning(f"微批结果中 {failed}/{len(items)} 个条目无法解析，改为单独调用")
+        except (RequestCancelledError, DeadlineExceededError) as e:
+            # 取消和截止时间属于领头者的请求，其余条目结果留空，退回单独调用
+            leader.error = e
+        except BaseException as e:
+            for item in items:
+                item.error = e
+        finally:
+            for item in items:
+                item.done.set()
+
+    @staticmethod
+    def _build_prompt(kind: BatchKind, items: List[_BatchItem]) -> str:
+        blocks = "\n\n".join(
+            f"<<<条目{index}>>>\n{item.content}\n<<<条目{index}结束>>>"
+            for index, item in enumerate(items, 1)
+        )
+        return kind.template.render(blocks, context=f"共有{len(items)}条{kind.item_label}：")
+
+    @staticmethod
+    def _split_response(response: str, count: int) -> Dict[int, str]:
+        answers: Dict[int, str] = {}
+        matches = list(_ITEM_HEADER_RE.finditer(response))
+        for position, match in enumerate(matches):
+            index = int(match.group(1))
+            end = matches[position + 1].start() if position + 1 < len(matches) else len(response)
+            if 1 <= index <= count and index not in answers:
+                answers[index] = response[match.end():end].strip()
+        return answers
+
+
+# 全局微批处理实例
+micro_batcher = MicroBatcher(
+    enabled=config_manager.get_config_value('batching', 'enabled', 'false').lower() == 'true',
+    window_ms=int(config_manager.get_config_value('batching', 'window_ms', '30')),
+    max_items=int(config_manager.get_config_value('batching', 'max_items', '8')),
+    max_item_tokens=int(config_manager.get_config_value('batching', 'max_item_tokens', '500'))
+)
@@ -0,0 +1,176 @@
+"""多主机进程稀有度分析
+
+统计整个主机群中每个映像名、命令行模式和运行用户出现的主机数，
+找出只在极少数主机上出现的离群进程，只有这些离群进程需要交给大模型研判。
+"""
+
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Set
+from ..config import config_manager
+from ..utils import LoggerMixin
+from .process_parser import process_parser, ProcessRecord
+from .process_knowledge import process_knowledge_base
+
+# 命令行模式归一化规则，去掉每台主机都不同的可变部分
+_PATTERN_RULES = [
+    (re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.I), '<uuid>'),
+    (re.compile(r'\b\d{1,3}(\.\d{1,3}){3}(:\d+)?\b'), '<ip>'),
+    (re.compile(r'\b[0-9a-f]{8,}\b', re.I), '<hex>'),
+    (re.compile(r'\d+'), '<n>'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def command_pattern(command: str, max_length: int = 200) -> str:
+    """将命令行归一化为模式"""
+    pattern = command.strip().lower()
+    for regex, replacement in _PATTERN_RULES:
+        pattern = regex.sub(replacement, pattern)
+    return pattern[:max_length]
+
+
+@dataclass
+class FleetStatistics:
+    """主机群进程统计"""
+    host_count: int = 0
+    host_formats: Dict[str, str] = field(default_factory=dict)
+    unparsed_hosts: List[str] = field(default_factory=list)
+    unparsed_dumps: Dict[str, str] = field(default_factory=dict)
+    process_count: int = 0
+    image_hosts: Dict[str, Set[str]] = field(default_factory=lambda: defaultdict(set))
+    pattern_hosts: Dict[tuple, Set[str]] = field(default_factory=lambda: defaultdict(set))
+    user_hosts: Dict[tuple, Set[str]] = field(default_factory=lambda: defaultdict(set))
+    pattern_samples: Dict[tuple, str] = field(default_factory=dict)
+    samples: Dict[str, List[ProcessRecord]] = field(default_factory=lambda: defaultdict(list))
+    rule_hits: Dict[str, dict] = field(default_factory=dict)
+
+
+class FleetProcessAnalyzer(LoggerMixin):
+    """多主机进程稀有度分析器"""
+
+    def __init__(self, rare_ratio: float = 0.01, min_rare_hosts: int = 2, max_hosts_listed: int = 10):
+        self.rare_ratio = rare_ratio
+        self.min_rare_hosts = min_rare_hosts
+        self.max_hosts_listed = max_hosts_listed
+
+    def rarity_threshold(self, host_count: int) -> int:
+        """计算稀有阈值：出现主机数不超过该值即视为稀有"""
+        threshold = max(self.min_rare_hosts, int(host_count * self.rare_ratio))
+        return max(1, min(threshold, host_count // 2))
+
+    def build_statistics(self, host_dumps: Dict[str, str]) -> FleetStatistics:
+        """解析所有主机的进程列表并统计出现频率
+
+        host_count 只统计成功解析的主机，无法解析的原始数据保存在 unparsed_dumps 中单独研判。
+        """
+        stats = FleetStatistics()
+
+        for host, dump in host_dumps.items():
+            process_format, records = process_parser.parse(dump)
+            if not records:
+                stats.unparsed_hosts.append(host)
+                stats.unparsed_dumps[host] = dump
+                continue
+            stats.host_count += 1
+            stats.host_formats[host] = process_format
+            stats.process_count += len(records)
+
+            for item in process_knowledge_base.classify(records):
+                record = item.record
+                image = self._image_key(record)
+                stats.image_hosts[image].add(host)
+                if record.command:
+                    pattern_key = (image, command_pattern(record.command))
+                    stats.pattern_hosts[pattern_key].add(host)
+                    stats.pattern_samples.setdefault(pattern_key, record.command[:300])
+                if record.user:
+                    stats.user_hosts[(image, record.user.lower())].add(host)
+                samples = stats.samples[image]
+                if len(samples) < 3 and all(s.command != record.command for s in samples):
+                    samples.append(record)
+
+                # 本地规则命中的进程无论多常见都需要研判
+                if item.category == 'suspicious':
+                    hit = stats.rule_hits.setdefault(image, {"hosts": set(), "reasons": [], "commands": []})
+                    hit["hosts"].add(host)
+                    for reason in item.reasons:
+                        if reason not in hit["reasons"]:
+                            hit["reasons"].append(reason)
+                    if record.command and len(hit["commands"]) < 3 and record.command not in hit["commands"]:
+                        hit["commands"].append(record.command[:300])
+
+        return stats
+
+    @staticmethod
+    def _image_key(record: ProcessRecord) -> str:
+        """映像名统计键，内核线程按模式归并（如 [kworker/<n>:<n>-events]）"""
+        key = record.key
+        if key.startswith('['):
+            return command_pattern(key)
+        return key
+
+    def find_outliers(self, stats: FleetStatistics) -> List[Dict]:
+        """找出稀有的映像、命令行模式和运行用户"""
+        threshold = self.rarity_threshold(stats.host_count)
+        outliers = []
+        rare_images = set()
+
+        for image, hosts in stats.image_hosts.items():
+            if len(hosts) <= threshold:
+                rare_images.add(image)
+                outliers.append(self._outlier('image', image, hosts, stats))
+
+        for (image, pattern), hosts in stats.pattern_hosts.items():
+            if image in rare_images or len(hosts) > threshold:
+                continue
+            outlier = self._outlier('command', image, hosts, stats)
+            outlier["command_pattern"] = pattern
+            outlier["commands"] = [stats.pattern_samples[(image, pattern)]]
+            outliers.append(outlier)
+
+        for (image, user), hosts in stats.user_hosts.items():
+            if image in rare_images or len(hosts) > threshold:
+                continue
+            outlier = self._outlier('user', image, hosts, stats)
+            outlier["user"] = user
+            outliers.append(outlier)
+
+        for image, hit in stats.rule_hits.items():
+            if image in rare_images:
+                # 合并到已有的稀有映像记录
+                for outlier in outliers:
+                    if outlier["kind"] == 'image' and outlier["image"] == image:
+                        outlier["reasons"] = hit["reasons"]
+                continue
+            outlier = self._outlier('rule', image, hit["hosts"], stats)
+            outlier["reasons"] = hit["reasons"]
+            outlier["commands"] = hit["commands"]
+            outliers.append(outlier)
+
+        outliers.sort(key=lambda item: (item["host_count"], item["image"]))
+        return outliers
+
+    def _outlier(self, kind: str, image: str, hosts: Set[str], stats: FleetStatistics) -> Dict:
+        """构造离群记录"""
+        samples = stats.samples.get(image, [])
+        info = process_knowledge_base.lookup(image)
+        return {
+            "kind": kind,
+            "image": image,
+            "host_count": len(hosts),
+            "fleet_size": stats.host_count,
+            "hosts": sorted(hosts)[:self.max_hosts_listed],
+            "category": info.category if info else 'unknown',
+            "product": info.product if info else '',
+            "commands": [s.command[:300] for s in samples if s.command],
+            "reasons": []
+        }
+
+
+# 全局多主机进程分析器实例
+fleet_process_analyzer = FleetProcessAnalyzer(
+    rare_ratio=float(config_manager.get_config_value('process', 'fleet_rare_ratio', '0.01')),
+    min_rare_hosts=int(config_manager.get_config_value('process', 'fleet_min_rare_hosts', '2'))
+)
@@ -0,0 +1,292 @@
+"""已知进程知识库
+
+从 app/data/known_processes.json 加载进程名索引，对解析后的进程记录进行本地分类，
+只有未知或可疑的进程才需要交给大模型研判。
+"""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from ..config import config_manager
+from ..utils import LoggerMixin
+from .process_parser import ProcessRecord
+
+DEFAULT_KNOWLEDGE_BASE = os.path.join(os.path.dirname(__file__), '..', 'data', 'known_processes.json')
+
+# 同名进程出现在多个类别中时的优先级
+CATEGORY_PRIORITY = {'suspicious': 5, 'dual_use': 4, 'security': 3, 'software': 2, 'system': 1}
+
+# 需要交给大模型研判的类别；dual_use 为 LOLBins、代理隧道等可被滥用的合法程序，
+# 仅凭进程名无法判断是否被滥用（tasklist 默认输出也没有命令行），因此始终研判
+REVIEW_CATEGORIES = ('unknown', 'suspicious', 'dual_use')
+
+# 只应存在单个实例、且应由SYSTEM运行的Windows关键进程
+SINGLETON_SYSTEM_PROCESSES = {'lsass.exe', 'services.exe', 'wininit.exe', 'lsaiso.exe'}
+SYSTEM_ACCOUNT_PROCESSES = {'lsass.exe', 'services.exe', 'wininit.exe', 'smss.exe', 'csrss.exe', 'winlogon.exe'}
+SYSTEM_ACCOUNTS = ('system', 'nt authority', 'n/a')
+
+# 可执行文件路径中的可疑特征
+SUSPICIOUS_EXECUTABLE_PATTERNS = [
+    (re.compile(r'^/(tmp|var/tmp|dev/shm)/'), "从临时目录运行"),
+    (re.compile(r'/\.[^/]+/'), "从隐藏目录运行"),
+    (re.compile(r'(appdata|\\temp\\|\\users\\public\\|programdata)\\[^\\]+\.exe', re.I), "从用户可写目录运行"),
+]
+
+# 命令行中的可疑特征
+SUSPICIOUS_COMMAND_PATTERNS = [
+    (re.compile(r'\(deleted\)'), "可执行文件已被删除"),
+    (re.compile(r'/dev/(tcp|udp)/'), "疑似反弹shell"),
+    (re.compile(r'\bbash\s+-i\b|\bsh\s+-i\b'), "交互式shell"),
+    (re.compile(r'\b(nc|ncat|netcat)\b.*\s-[a-z]*e\s', re.I), "netcat执行命令"),
+    (re.compile(r'(curl|wget)\s.*\|\s*(ba)?sh', re.I), "下载并执行脚本"),
+    (re.compile(r'base64\s+(-d|--decode)', re.I), "解码执行内容"),
+    (re.compile(r'python[23]?\s+-c\s+.*socket', re.I), "Python网络连接脚本"),
+    (re.compile(r'perl\s+-e\s+.*socket', re.I), "Perl网络连接脚本"),
+    (re.compile(r'stratum\+(tcp|ssl)://|--donate-level|cryptonight|randomx', re.I), "挖矿特征"),
+    (re.compile(r'-(e|enc|encodedcommand)\s+[A-Za-z0-9+/=]{20,}', re.I), "PowerShell编码命令"),
+    (re.compile(r'-w(indowstyle)?\s+hidden', re.I), "隐藏窗口运行"),
+]
+
+
+@dataclass
+class ProcessInfo:
+    """知识库条目"""
+    name: str
+    category: str
+    vendor: str = ''
+    product: str = ''
+    platform: str = ''
+
+
+@dataclass
+class ProcessClassification:
+    """单个进程的分类结果"""
+    record: ProcessRecord
+    category: str
+    info: Optional[ProcessInfo] = None
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def needs_review(self) -> bool:
+        """是否需要交给大模型研判"""
+        return self.category in REVIEW_CATEGORIES
+
+
+class ProcessKnowledgeBase(LoggerMixin):
+    """已知进程知识库"""
+
+    def __init__(self, paths: Optional[List[str]] = None):
+        self._paths = paths
+        self._exact: Dict[str, ProcessInfo] = {}
+        self._prefixes: List[Tuple[str, ProcessInfo, bool]] = []
+        self._system_names: List[str] = []
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _knowledge_base_paths(self) -> List[str]:
+        """获取知识库文件列表，支持在配置中追加自定义知识库"""
+        if self._paths is not None:
+            return self._paths
+        paths = [DEFAULT_KNOWLEDGE_BASE]
+        extra = config_manager.get_config_value('process', 'extra_knowledge_base', '')
+        paths.extend(p.strip() for p in extra.split(',') if p.strip())
+        return paths
+
+    def load(self) -> None:
+        """加载并索引知识库"""
+        with self._lock:
+            if self._loaded:
+                return
+            for path in self._knowledge_base_paths():
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    self.logger.warning(f"加载进程知识库失败: {path}, {e}")
+                    continue
+                for entry in data.get('entries', []):
+                    self._index_entry(entry)
+
+            self._prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+            self._system_names = sorted(
+                name for name, info in self._exact.items()
+                if info.category == 'system' and name.endswith('.exe')
+            )
+            self._loaded = True
+            self.logger.info(f"进程知识库加载完成，共 {len(self._exact)} 个进程名, {len(self._prefixes)} 个前缀规则")
+
+    def _index_entry(self, entry: dict) -> None:
+        """将一个知识库条目写入索引"""
+        category = entry.get('category', 'software')
+        kernel_thread = bool(entry.get('kernel_threads', False))
+        for name in entry.get('names', []):
+            info = ProcessInfo(
+                name=name,
+                category=category,
+                vendor=entry.get('vendor', ''),
+                product=entry.get('product', ''),
+                platform=entry.get('platform', '')
+            )
+            key = name.strip().lower()
+            existing = self._exact.get(key)
+            if existing is None or CATEGORY_PRIORITY.get(category, 0) > CATEGORY_PRIORITY.get(existing.category, 0):
+                self._exact[key] = info
+        for prefix in entry.get('prefixes', []):
+            info = ProcessInfo(
+                name=f"{prefix}*",
+                category=category,
+                vendor=entry.get('vendor', ''),
+                product=entry.get('product', ''),
+                platform=entry.get('platform', '')
+            )
+            self._prefixes.append((prefix.lower(), info, kernel_thread))
+
+    def __len__(self) -> int:
+        self.load()
+        return len(self._exact)
+
+    def lookup(self, name: str) -> Optional[ProcessInfo]:
+        """查询进程名，先精确匹配，再前缀匹配"""
+        self.load()
+        key = name.strip().lower()
+        info = self._exact.get(key)
+        if info:
+            return info
+
+        bracketed = key.startswith('[') and key.endswith(']')
+        bare = key[1:-1] if bracketed else key
+        if bracketed and bare in self._exact:
+            return self._exact[bare]
+        for prefix, prefix_info, kernel_only in self._prefixes:
+            # 内核线程前缀只匹配带方括号的名称，防止恶意程序伪装成kworker等
+            if kernel_only and not bracketed:
+                continue
+            if bare.startswith(prefix):
+                return prefix_info
+        return None
+
+    def lookalike_of(self, name: str) -> Optional[str]:
+        """检测是否为系统进程的仿冒名称（编辑距离为1）"""
+        self.load()
+        key = name.lower()
+        if not key.endswith('.exe') or key in self._exact:
+            return None
+        for system_name in self._system_names:
+            # 过短的名称误报率高，不参与仿冒检测
+            if len(system_name) < 8:
+                continue
+            if abs(len(system_name) - len(key)) <= 1 and _within_one_edit(key, system_name):
+                return system_name
+        return None
+
+    def classify(self, records: List[ProcessRecord]) -> List[ProcessClassification]:
+        """对进程列表进行本地分类"""
+        self.load()
+        instance_counts: Dict[str, int] = {}
+        for record in records:
+            instance_counts[record.key] = instance_counts.get(record.key, 0) + 1
+
+        results = []
+        for record in records:
+            key = record.key
+            info = self.lookup(key)
+            reasons = []
+
+            if info and info.category == 'suspicious':
+                reasons.append(f"命中已知攻击工具/恶意程序名称: {info.name}")
+
+            lookalike = None if info else self.lookalike_of(key)
+            if lookalike:
+                reasons.append(f"疑似仿冒系统进程 {lookalike}")
+
+            if key in SINGLETON_SYSTEM_PROCESSES and instance_counts[key] > 1:
+                reasons.append(f"{key} 存在 {instance_counts[key]} 个实例，正常情况下只应有1个")
+
+            user = record.user.strip().lower()
+            if key in SYSTEM_ACCOUNT_PROCESSES and user and not user.startswith(SYSTEM_ACCOUNTS):
+                reasons.append(f"{key} 以非系统账户 {record.user} 运行")
+
+            if record.command:
+                executable = record.command.split()[0]
+                for pattern, description in SUSPICIOUS_EXECUTABLE_PATTERNS:
+                    if pattern.search(executable):
+                        reasons.append(description)
+                for pattern, description in SUSPICIOUS_COMMAND_PATTERNS:
+                    if pattern.search(record.command):
+                        reasons.append(description)
+
+            if info and info.category == 'dual_use' and not reasons:
+                reasons.append("可被滥用的合法程序" + ("" if record.command else "，缺少命令行无法本地判断"))
+                category = 'dual_use'
+            elif reasons:
+                category = 'suspicious'
+            elif info:
+                category = info.category
+            else:
+                category = 'unknown'
+
+            results.append(ProcessClassification(record=record, category=category, info=info, reasons=reasons))
+
+        return results
+
+    @staticmethod
+    def group_for_review(classifications: List[ProcessClassification]) -> 'OrderedDict[str, dict]':
+        """将待研判进程按映像名去重汇总"""
+        groups: 'OrderedDict[str, dict]' = OrderedDict()
+        for item in classifications:
+            if not item.needs_review:
+                continue
+            group = groups.setdefault(item.record.key, {
+                "image": item.record.image,
+                "category": item.category,
+                "count": 0,
+                "pids": [],
+                "users": [],
+                "commands": [],
+                "reasons": []
+            })
+            group["count"] += 1
+            if item.category == 'suspicious':
+                group["category"] = 'suspicious'
+            if len(group["pids"]) < 5 and item.record.pid:
+                group["pids"].append(item.record.pid)
+            if item.record.user and item.record.user not in group["users"]:
+                group["users"].append(item.record.user)
+            if item.record.command and len(group["commands"]) < 3 and item.record.command not in group["commands"]:
+                group["commands"].append(item.record.command[:300])
+            for reason in item.reasons:
+                if reason not in group["reasons"]:
+                    group["reasons"].append(reason)
+        return groups
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """判断两个字符串的编辑距离是否不超过1"""
+    if a == b:
+        return True
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) - len(a) > 1:
+        return False
+    i = j = 0
+    edited = False
+    while i < len(a) and j < len(b):
+        if a[i] != b[j]:
+            if edited:
+                return False
+            edited = True
+            if len(a) == len(b):
+                i += 1
+            j += 1
+        else:
+            i += 1
+            j += 1
+    return True
+
+
+# 全局进程知识库实例
+process_knowledge_base = ProcessKnowledgeBase()
@@ -0,0 +1,189 @@
+"""进程列表解析模块
+
+支持 tasklist、tasklist /v、tasklist /fo csv、ps aux、ps -ef 等常见输出格式。
+"""
+
+import csv
+import io
+import os
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+
+@dataclass
+class ProcessRecord:
+    """进程记录数据类"""
+    image: str
+    pid: str = ''
+    ppid: str = ''
+    user: str = ''
+    command: str = ''
+    memory: str = ''
+    session: str = ''
+    status: str = ''
+    window_title: str = ''
+    raw: str = field(default='', repr=False)
+
+    @property
+    def key(self) -> str:
+        """用于去重和知识库查询的规范化映像名"""
+        return normalize_image_name(self.image)
+
+
+def normalize_image_name(name: str) -> str:
+    """规范化映像名称"""
+    name = name.strip().lower()
+    # 内核线程保留方括号，如 [kworker/0:1]
+    if name.startswith('[') and name.endswith(']'):
+        return name
+    # nginx: master process -> nginx
+    name = name.rstrip(':')
+    # 去掉路径部分
+    if '/' in name or '\\' in name:
+        name = re.split(r'[\\/]', name)[-1]
+    return name
+
+
+class ProcessTableParser:
+    """进程列表解析器"""
+
+    FORMAT_TASKLIST = 'tasklist'
+    FORMAT_TASKLIST_VERBOSE = 'tasklist /v'
+    FORMAT_TASKLIST_SVC = 'tasklist /svc'
+    FORMAT_TASKLIST_CSV = 'tasklist /fo csv'
+    FORMAT_PS_AUX = 'ps aux'
+    FORMAT_PS_EF = 'ps -ef'
+
+    # tasklist /v 各列依次为：映像名称 PID 会话名 会话# 内存使用 状态 用户名 CPU时间 窗口标题
+    _VERBOSE_FIELDS = ['image', 'pid', 'session', None, 'memory', 'status', 'user', None, 'window_title']
+    _DEFAULT_FIELDS = ['image', 'pid', 'session', None, 'memory']
+    _SVC_FIELDS = ['image', 'pid', 'command']
+
+    def parse(self, text: str) -> Tuple[Optional[str], List[ProcessRecord]]:
+        """解析进程列表，返回(格式, 进程记录列表)；无法识别时格式为None"""
+        lines = [line.rstrip('\r') for line in text.strip('\n').split('\n')]
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return None, []
+
+        for index, line in enumerate(lines[:10]):
+            stripped = line.strip()
+            upper = stripped.upper()
+
+            if re.match(r'^=+(\s+=+)+$', stripped):
+                return self._parse_tasklist(lines, index)
+
+            if stripped.startswith('"') and index == 0:
+                result = self._parse_tasklist_csv(lines)
+                if result[1]:
+                    return result
+
+            tokens = upper.split()
+            if tokens[:2] == ['USER', 'PID'] and 'COMMAND' in tokens:
+                return self.FORMAT_PS_AUX, self._parse_ps(lines[index + 1:], tokens, 'COMMAND')
+
+            if tokens[:3] == ['UID', 'PID', 'PPID'] and ('CMD' in tokens or 'COMMAND' in tokens):
+                command_col = 'CMD' if 'CMD' in tokens else 'COMMAND'
+                return self.FORMAT_PS_EF, self._parse_ps(lines[index + 1:], tokens, command_col)
+
+        return None, []
+
+    def _parse_tasklist(self, lines: List[str], sep_index: int) -> Tuple[str, List[ProcessRecord]]:
+        """按照分隔行(=====)确定列宽解析tasklist输出"""
+        separator = lines[sep_index]
+        starts = [m.start() for m in re.finditer(r'=+', separator)]
+
+        if len(starts) >= 9:
+            fmt, fields = self.FORMAT_TASKLIST_VERBOSE, self._VERBOSE_FIELDS
+        elif len(starts) == 3:
+            fmt, fields = self.FORMAT_TASKLIST_SVC, self._SVC_FIELDS
+        else:
+            fmt, fields = self.FORMAT_TASKLIST, self._DEFAULT_FIELDS
+
+        records = []
+        for line in lines[sep_index + 1:]:
+            values = []
+            for i, start in enumerate(starts):
+                end = starts[i + 1] if i + 1 < len(starts) else None
+                values.append(line[start:end].strip())
+
+            # tasklist /svc 的服务列可能换行，续行没有映像名和PID
+            if fmt == self.FORMAT_TASKLIST_SVC and records and not values[0] and not values[1]:
+                records[-1].command = f"{records[-1].command},{values[2]}".strip(',')
+                continue
+
+            if not values[0] or not values[1].isdigit():
+                continue
+
+            record = ProcessRecord(image=values[0], raw=line)
+            for name, value in zip(fields, values):
+                if name:
+                    setattr(record, name, value)
+            records.append(record)
+
+        return fmt, records
+
+    def _parse_tasklist_csv(self, lines: List[str]) -> Tuple[Optional[str], List[ProcessRecord]]:
+        """解析 tasklist /fo csv 输出"""
+        rows = list(csv.reader(io.StringIO('\n'.join(lines))))
+        if not rows:
+            return None, []
+
+        # 第一行为表头（/nh 参数时没有表头）
+        if len(rows[0]) > 1 and not rows[0][1].strip().isdigit():
+            rows = rows[1:]
+
+        fields = self._VERBOSE_FIELDS if rows and len(rows[0]) >= 9 else self._DEFAULT_FIELDS
+        records = []
+        for row in rows:
+            if len(row) < 2 or not row[1].strip().isdigit():
+                continue
+            record = ProcessRecord(image=row[0].strip(), raw=','.join(row))
+            for name, value in zip(fields, row):
+                if name:
+                    setattr(record, name, value.strip())
+            records.append(record)
+
+        return self.FORMAT_TASKLIST_CSV, records
+
+    def _parse_ps(self, lines: List[str], header: List[str], command_col: str) -> List[ProcessRecord]:
+        """解析 ps aux / ps -ef 输出，命令列包含空格，作为最后一列整体保留"""
+        command_index = header.index(command_col)
+        pid_index = header.index('PID')
+        ppid_index = header.index('PPID') if 'PPID' in header else None
+        user_index = 0
+        rss_index = header.index('RSS') if 'RSS' in header else None
+
+        records = []
+        for line in lines:
+            parts = line.split(None, command_index)
+            if len(parts) <= command_index or not parts[pid_index].isdigit():
+                continue
+
+            command = parts[command_index].strip()
+            records.append(ProcessRecord(
+                image=self._image_from_command(command),
+                pid=parts[pid_index],
+                ppid=parts[ppid_index] if ppid_index is not None else '',
+                user=parts[user_index],
+                command=command,
+                memory=parts[rss_index] if rss_index is not None else '',
+                raw=line
+            ))
+
+        return records
+
+    @staticmethod
+    def _image_from_command(command: str) -> str:
+        """从命令行中提取可执行文件名"""
+        # 内核线程，如 [kworker/0:1-events]
+        if command.startswith('['):
+            return command
+        first = command.split()[0] if command.split() else command
+        first = first.rstrip(':')
+        return os.path.basename(first) or first
+
+
+# 全局进程列表解析器实例
+process_parser = ProcessTableParser()
@@ -0,0 +1,287 @@
+"""提示词模板注册表
+
+所有分析类型的固定说明（角色、分析要求、输出格式）放在系统消息中，逐字节保持不变；
+文件名、分析选项、分块序号等可变信息和待分析内容放在用户消息里，待分析内容始终在最后。
+这样同类请求共享完全相同的前缀，可以命中DeepSeek的上下文缓存和Ollama的KV缓存复用。
+模板在导入时注册并预先计算token数，分块时无需重复估算。
+"""
+
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Dict, List
+from .structured_output import TRAFFIC_SCHEMA, WEBSHELL_SCHEMA
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的token数量（更保守的估算）"""
+    # 中文字符按1.5个字符=1个token计算，其他字符按3个字符=1个token计算
+    chinese_chars = len([c for c in text if '\u4e00' <= c <= '\u9fff'])
+    other_chars = len(text) - chinese_chars
+    return int(chinese_chars / 1.5 + other_chars / 3)
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """预编译的提示词模板
+
+    system 为固定的系统消息；content_label 为用户消息中正文前的固定标签。
+    system_tokens/label_tokens 在注册时计算，prefix_hash 用于观察缓存前缀是否稳定。
+    """
+    name: str
+    system: str
+    content_label: str
+    system_tokens: int
+    label_tokens: int
+    prefix_hash: str
+
+    @property
+    def overhead_tokens(self) -> int:
+        return self.system_tokens + self.label_tokens
+
+    def render(self, content: str, context: str = "") -> str:
+        """生成用户消息：可变上下文在前，待分析内容在最后"""
+        parts = [context.strip()] if context and context.strip() else []
+        parts.append(f"{self.content_label}\n{content}" if self.content_label else content)
+        return "\n\n".join(parts)
+
+
+class PromptRegistry:
+    """提示词模板注册表"""
+
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, system: str, content_label: str = "") -> PromptTemplate:
+        template = PromptTemplate(
+            name=name,
+            system=system,
+            content_label=content_label,
+            system_tokens=estimate_tokens(system),
+            label_tokens=estimate_tokens(content_label),
+            prefix_hash=hashlib.sha256(system.encode('utf-8')).hexdigest()[:12]
+        )
+        with self._lock:
+            if name in self._templates:
+                raise ValueError(f"提示词模板重复注册: {name}")
+            self._templates[name] = template
+        return template
+
+    def get(self, name: str) -> PromptTemplate:
+        return self._templates[name]
+
+    def describe(self) -> List[Dict]:
+        return [
+            {"name": t.name, "system_tokens": t.system_tokens, "prefix_hash": t.prefix_hash}
+            for t in self._templates.values()
+        ]
+
+
+# 全局提示词模板注册表实例
+prompt_registry = PromptRegistry()
+
+TRAFFIC_TASK = """请进行网络安全分析。请严格按照以下步骤执行：
+1. 分析以下HTTP请求的各个组成部分
+2. 识别是否存在SQL注入、XSS、CSRF、反序列化、文件上传、路径遍历、OWASPTop10、等常见攻击特征
+3. 检查User-Agent等头部信息是否可疑
+4. 如果数据包中有一些编码后的内容，一定要解码后再进行分析
+5. 最终结论：是否为攻击流量（是/否）"""
+
+TRAFFIC_INSTRUCTION = TRAFFIC_TASK + """
+
+请用中文按以下格式响应：
+【分析结果】是/否
+【依据】简明扼要列出技术依据"""
+
+DECODE_INSTRUCTION = """请完整分析并解码用户给出的字符串，要求：
+1. 识别所有可能的编码方式（包括嵌套编码）
+2. 通过自己重新编码，确认自己解码正确
+3. 展示完整的解码过程
+4. 输出最终解码结果
+
+请用中文按以下格式响应：
+【编码分析】列出检测到的编码类型及层级
+【解码过程】逐步展示解码步骤
+【最终结果】解码后的明文内容"""
+
+WEBSHELL_TASK = """请对以下文件进行WebShell检测分析，要求：
+1. 识别是否为WebShell
+2. 分析WebShell类型和功能
+3. 识别危险函数和恶意代码
+4. 评估威胁等级
+5. 提供处置建议"""
+
+PROCESS_OUTPUT_FORMAT = """按优先级列出需要关注的进程
+【可疑进程】
+【杀软进程】
+【第三方软件进程】
+给出具体操作建议：
+• 安全进程的可终止性评估"""
+
+TRAFFIC_TEMPLATE = prompt_registry.register("traffic", TRAFFIC_INSTRUCTION, "HTTP请求数据：")
+
+DECODE_TEMPLATE = prompt_registry.register("decode", DECODE_INSTRUCTION, "原始字符串：")
+
+JS_AUDIT_TEMPLATE = prompt_registry.register("js_audit", """请对以下JavaScript代码进行完整的安全审计，要求：
+1. 识别XSS、CSRF、不安全的DOM操作、敏感信息泄露、eval使用等安全问题
+2. 检查第三方库的安全性和版本漏洞（经哈希验证的第三方库已在本地移除并以注释占位，无需重复分析）
+3. 分析代码逻辑漏洞
+4. 提供修复建议
+
+请用中文按以下格式响应：
+【高危漏洞】列出高危安全问题及位置
+【中低危问题】列出中低风险问题
+【修复建议】提供具体修复方案""", "JavaScript代码：")
+
+JS_SINK_TEMPLATE = prompt_registry.register("js_sink_audit", """以下是从JavaScript代码中本地定位到的危险点片段（每行开头为行号，片段标题列出了危险点），请进行安全审计，要求：
+1. 结合上下文判断每个危险点是否可被利用：输入是否用户可控、是否经过过滤或编码、postMessage是否校验origin
+2. 判断硬编码的密钥、令牌是否为真实凭据
+3. 引用具体行号说明问题，未展示的代码不要臆测
+4. 提供修复建议
+
+请用中文按以下格式响应：
+【高危漏洞】列出高危安全问题及行号
+【中低危问题】列出中低风险问题及行号
+【误报排除】列出经判断不构成风险的危险点
+【修复建议】提供具体修复方案""", "危险点片段：")
+
+PROCESS_REVIEW_TEMPLATE = prompt_registry.register("process_review", """你是一个Windows/Linux进程分析工程师。以下进程无法被本地知识库识别、命中了本地可疑规则，
+或属于可被滥用的合法程序（category为dual_use，如LOLBins、代理隧道工具），
+已按映像名去重（count为实例数，reasons为本地规则命中原因）。要求：
+1. 判断每个进程的用途，识别可能的恶意进程
+2. 识别其中的杀毒软件、EDR和其他第三方软件进程
+3. 对命中本地可疑规则的进程给出研判意见
+
+""" + PROCESS_OUTPUT_FORMAT, "待研判进程：")
+
+PROCESS_FLEET_TEMPLATE = prompt_registry.register("process_fleet", """你是一个主机安全分析工程师。用户给出的是从多台主机的进程列表中统计出的离群项，
+只在极少数主机上出现（出现主机数不超过稀有阈值）或命中了本地可疑规则。
+kind 含义：image=稀有映像，command=常见映像的稀有命令行，user=常见映像的稀有运行用户，rule=本地规则命中。
+以 [unparsed] 开头的部分是格式无法解析的主机的原始进程列表，需要逐个进程研判。
+要求：
+1. 逐项判断离群原因是否可能是入侵、挖矿、远控、横向移动或违规软件
+2. 区分正常的个别差异（如个别主机安装的运维工具）与真正的威胁
+3. 给出需要优先排查的主机
+
+请用中文按以下格式响应：
+【高危离群项】
+【可疑离群项】
+【正常差异】
+【排查建议】""", "离群项：")
+
+PROCESS_RAW_TEMPLATE = prompt_registry.register("process_raw", """你是一个Windows/Linux进程分析工程师，要求：
+1. 用户将输出tasklist或者ps aux的结果
+2. 帮助用户分析输出你所有认识的进程信息
+3. 识别可能的恶意进程
+4. 识别杀毒软件进程
+5. 识别其他软件进程
+
+""" + PROCESS_OUTPUT_FORMAT, "tasklist或者ps aux的结果：")
+
+REGEX_TEMPLATE = prompt_registry.register("regex", """请根据用户给出的源文本和需要匹配的目标生成正则表达式，要求：
+1. 生成能够准确匹配目标文本的正则表达式
+2. 考虑边界情况和特殊字符
+3. 提供多种匹配方案（严格匹配、宽松匹配等）
+4. 解释正则表达式的含义
+5. 提供测试用例
+
+请用中文按以下格式响应：
+【推荐正则】最佳匹配方案
+【备选方案】其他可选的正则表达式
+【表达式解释】详细说明正则含义
+【测试用例】提供测试示例""", "源文本：")
+
+WEBSHELL_TEMPLATE = prompt_registry.register("webshell", WEBSHELL_TASK + """
+
+请用中文按以下格式响应：
+【检测结果】是否为WebShell（是/否）
+【威胁等级】高危/中危/低危/无威胁
+【恶意特征】列出发现的恶意代码特征
+【功能分析】分析WebShell的主要功能
+【处置建议】提供具体的安全处置方案""", "文件内容：")
+
+WEBLOG_TEMPLATE = prompt_registry.register("weblog", """请对用户给出的Web访问日志进行安全分析，只执行用户消息中列出的分析任务。
+
+请用中文按以下格式响应：
+【攻击检测】列出发现的攻击行为和威胁
+【异常分析】识别异常访问模式和可疑活动
+【统计分析】提供访问统计和趋势分析
+【安全建议】提供具体的安全加固建议""", "Web访问日志：")
+
+# Web日志分项分析：每个分析选项单独调用，结果由服务层加上小节标题后合并
+WEBLOG_SECTION_TEMPLATES = {
+    "攻击检测": prompt_registry.register("weblog_attack", """请检查用户给出的Web访问日志中的攻击行为，包括SQL注入、XSS、路径遍历、文件包含、命令执行、扫描器探测和敏感文件访问。
+日志可能只包含预先筛选出的可疑行（命中攻击特征或返回4xx/5xx的请求）。
+
+请用中文回答，直接输出分析内容，不要输出小节标题：
+1. 逐类列出发现的攻击：攻击类型、来源IP、目标路径、典型请求和时间
+2. 根据状态码和响应大小判断攻击是否可能成功
+3. 给出针对性的处置和加固建议
+未发现攻击时明确说明。""", "Web访问日志："),
+    "异常分析": prompt_registry.register("weblog_anomaly", """请识别用户给出的Web访问日志中的异常访问模式和可疑活动，包括高频访问、异常时段、可疑IP、异常User-Agent、大量错误响应和异常的路径遍历顺序。
+
+请用中文回答，直接输出分析内容，不要输出小节标题：
+1. 列出异常的来源IP或会话及其依据
+2. 说明异常的可能原因（爬虫、暴力破解、扫描、业务异常等）
+3. 给出需要进一步核实的事项
+未发现异常时明确说明。""", "Web访问日志："),
+    "统计分析": prompt_registry.register("weblog_statistics", """请对用户给出的Web访问日志进行访问统计和趋势分析，包括访问量、来源IP分布、热门页面、状态码分布和时间分布。
+用户消息中如有基于全部日志的本地统计，统计数字请以本地统计为准，不要自行重新计数。
+
+请用中文回答，直接输出分析内容，不要输出小节标题。""", "Web访问日志："),
+    "性能分析": prompt_registry.register("weblog_performance", """请从性能角度分析用户给出的Web访问日志，包括响应时间（如日志中有记录）、响应大小、慢请求和大请求、错误率以及可能的性能瓶颈。
+
+请用中文回答，直接输出分析内容，不要输出小节标题；日志中没有相关字段时说明无法评估的部分。""", "Web访问日志："),
+}
+
+WEBLOG_CHAT_TEMPLATE = prompt_registry.register("weblog_chat", """你是一个专业的网络安全分析师，正在协助用户分析Web访问日志。
+请基于用户给出的日志内容和之前的分析结果，详细回答用户的问题。回答要求：
+1. 准确引用日志中的具体信息
+2. 结合安全专业知识进行解释
+3. 提供实用的安全建议
+4. 使用中文回答
+5. 如果问题涉及具体的攻击行为，请详细说明攻击手法和防护措施
+6. 如果无法从日志中找到相关信息，请明确说明""", "原始日志内容：")
+
+TRANSLATE_TEMPLATE = prompt_registry.register("translate", """请将用户给出的文本翻译成指定语言，要求：
+1. 保持原文的语义和语调
+2. 确保翻译的准确性和流畅性
+3. 如果是技术文档，保持专业术语的准确性
+4. 如果包含代码或特殊格式，请保持不变
+
+请直接提供翻译结果，不需要额外说明。""", "原文：")
+
+TRANSLATE_BATCH_TEMPLATE = prompt_registry.register("translate_batch", """请将用户给出的编号片段翻译成指定语言，要求：
+1. 保持原文的语义和语调
+2. 确保翻译的准确性和流畅性
+3. 如果是技术文档，保持专业术语的准确性
+4. 行内代码、命令、URL和变量名保持不变
+5. 每个片段的译文以对应的编号标记（如 <<<1>>>）单独一行开头，按原顺序输出全部片段，不要合并、遗漏或添加说明""", "待翻译片段：")
+
+CHUNK_SUMMARY_TEMPLATE = prompt_registry.register("chunk_summary", """请对用户给出的分块分析结果进行总结和汇总，提供一个综合性的分析总结，包括：
+1. 主要发现和威胁
+2. 整体安全状况评估
+3. 关键建议和处置方案""", "分块分析结果：")
+
+BATCH_RULES = """用户消息中包含多条相互独立的条目，每条以 <<<条目N>>> 开头、<<<条目N结束>>> 结尾。
+请逐条单独分析，条目之间互不参考。每条结果必须单独一行以【条目编号】开头（例如【条目1】），
+按编号顺序输出全部条目，每条都严格使用上述格式，不要输出其他内容。"""
+
+TRAFFIC_BATCH_TEMPLATE = prompt_registry.register("traffic_batch", f"{TRAFFIC_INSTRUCTION}\n\n{BATCH_RULES}")
+
+DECODE_BATCH_TEMPLATE = prompt_registry.register("decode_batch", f"{DECODE_INSTRUCTION}\n\n{BATCH_RULES}")
+
+# 结构化输出：每种输出模式一个固定的系统消息
+STRUCTURED_TEMPLATES = {
+    (schema.name, verdict_only): prompt_registry.register(
+        f"{schema.name}_{'verdict' if verdict_only else 'structured'}",
+        f"{task}\n\n{schema.instruction(verdict_only)}",
+        label
+    )
+    for schema, task, label in (
+        (TRAFFIC_SCHEMA, TRAFFIC_TASK, "HTTP请求数据："),
+        (WEBSHELL_SCHEMA, WEBSHELL_TASK, "文件内容："),
+    )
+    for verdict_only in (False, True)
+}
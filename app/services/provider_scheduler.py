@@ -0,0 +1,197 @@
+"""模型调用的加权公平调度
+
+所有模型调用共享有限的并发槽位。调用按接口分为交互通道（解码、正则生成等短请求）和批量通道
+（日志分析、翻译、抓包等大任务），通道之间按权重分配空出的槽位；同一通道内按客户端轮转，
+每个客户端每轮只放行一个调用，大任务的分块调用因此与其他用户的请求交替执行，不会独占槽位。
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+from ..config import config_manager
+from ..utils import LoggerMixin, get_client_id, get_endpoint, raise_if_cancelled, check_deadline
+
+INTERACTIVE_LANE = 'interactive'
+BULK_LANE = 'bulk'
+
+# 请求上下文之外的调用（如连接测试、预热）使用的客户端标识
+LOCAL_CLIENT = 'local'
+
+# 排队等待时检查请求是否已取消或超时的间隔（秒）
+CANCEL_POLL_SECONDS = 0.2
+
+
+@dataclass
+class _Waiter:
+    client: str
+    granted: threading.Event = field(default_factory=threading.Event)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class _Lane:
+    """一个通道：按客户端分组的等待队列和步进调度的通行值"""
+    name: str
+    weight: int
+    clients: 'OrderedDict[str, Deque[_Waiter]]' = field(default_factory=OrderedDict)
+    pass_value: float = 0.0
+    dispatched: int = 0
+    wait_total: float = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self.clients.values())
+
+
+class ProviderScheduler(LoggerMixin):
+    """按通道加权、通道内按客户端轮转的模型调用调度器"""
+
+    def __init__(self, enabled: bool, slots: int, interactive_weight: int, bulk_weight: int,
+                 interactive_endpoints: List[str]):
+        self.enabled = enabled
+        self.configured_slots = max(1, slots)
+        self.slots = self.configured_slots
+        self.interactive_endpoints = set(interactive_endpoints)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._lanes: Dict[str, _Lane] = {
+            INTERACTIVE_LANE: _Lane(INTERACTIVE_LANE, max(1, interactive_weight)),
+            BULK_LANE: _Lane(BULK_LANE, max(1, bulk_weight))
+        }
+
+    def set_capacity(self, capacity: Optional[int]) -> None:
+        """按后端的并行能力收紧槽位数（如Ollama的并行槽位），None 表示恢复配置值"""
+        with self._lock:
+            self.slots = min(self.configured_slots, capacity) if capacity else self.configured_slots
+            # 槽位增加时立即放行等待中的调用
+            while self._active < self.slots:
+                picked = self._next_waiter()
+                if picked is None:
+                    break
+                self._active += 1
+                self._charge(*picked)
+                picked[1].granted.set()
+
+    def classify(self, endpoint: Optional[str]) -> str:
+        """接口所属通道；请求上下文之外的调用按交互处理"""
+        if endpoint is None or endpoint in self.interactive_endpoints:
+            return INTERACTIVE_LANE
+        return BULK_LANE
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """占用一个模型调用槽位，通道和客户端取自当前请求上下文"""
+        if not self.enabled:
+            yield
+            return
+        lane = self._lanes[self.classify(get_endpoint())]
+        waiter = _Waiter(get_client_id() or LOCAL_CLIENT)
+        with self._lock:
+            if self._active < self.slots and not any(item.clients for item in self._lanes.values()):
+                self._active += 1
+                self._charge(lane, waiter)
+                waiter.granted.set()
+            else:
+                if not lane.clients:
+                    # 通道从空闲转为活跃时不保留空闲期间积累的份额
+                    lane.pass_value = max(lane.pass_value, self._min_active_pass())
+                lane.clients.setdefault(waiter.client, deque()).append(waiter)
+        try:
+            # 排队期间请求被取消或超过截止时间时退出等待
+            while not waiter.granted.wait(CANCEL_POLL_SECONDS):
+                raise_if_cancelled()
+                check_deadline()
+        except BaseException:
+            self._abandon(lane, waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _charge(self, lane: _Lane, waiter: _Waiter) -> None:
+        lane.pass_value += 1 / lane.weight
+        lane.dispatched += 1
+        lane.wait_total += time.monotonic() - waiter.enqueued_at
+
+    def _min_active_pass(self) -> float:
+        active = [lane.pass_value for lane in self._lanes.values() if lane.clients]
+        return min(active) if active else 0.0
+
+    def _next_waiter(self) -> Optional[Tuple[_Lane, _Waiter]]:
+        """通行值最小的活跃通道中，轮到的客户端的最早调用"""
+        active = [lane for lane in self._lanes.values() if lane.clients]
+        if not active:
+            return None
+        lane = min(active, key=lambda item: item.pass_value)
+        client, queue = next(iter(lane.clients.items()))
+        waiter = queue.popleft()
+        del lane.clients[client]
+        if queue:
+            # 还有调用的客户端排到本通道末尾
+            lane.clients[client] = queue
+        return lane, waiter
+
+    def _release(self) -> None:
+        with self._lock:
+            # 容量被收紧后，超出的槽位释放时不再转交
+            picked = self._next_waiter() if self._active <= self.slots else None
+            if picked is None:
+                self._active -= 1
+                return
+            lane, waiter = picked
+            self._charge(lane, waiter)
+            waiter.granted.set()
+
+    def _abandon(self, lane: _Lane, waiter: _Waiter) -> None:
+        """等待被中断时移出队列；若槽位已转交给它则继续转交"""
+        with self._lock:
+            queue = lane.clients.get(waiter.client)
+            if queue is not None and waiter in queue:
+                queue.remove(waiter)
+                if not queue:
+                    del lane.clients[waiter.client]
+                return
+        if waiter.granted.is_set():
+            self._release()
+
+    def get_stats(self) -> Dict:
+        """槽位占用和各通道排队情况"""
+        with self._lock:
+            lanes = {
+                lane.name: {
+                    "weight": lane.weight,
+                    "waiting": lane.waiting,
+                    "waiting_clients": len(lane.clients),
+                    "dispatched": lane.dispatched,
+                    "avg_wait_ms": round(lane.wait_total / lane.dispatched * 1000, 1) if lane.dispatched else 0
+                }
+                for lane in self._lanes.values()
+            }
+            return {"enabled": self.enabled, "slots": self.slots, "active": self._active, "lanes": lanes}
+
+
+def client_identity(api_key: Optional[str], remote_addr: Optional[str]) -> str:
+    """客户端标识：优先使用API密钥请求头（只保留摘要），否则使用来源地址"""
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+    return remote_addr or LOCAL_CLIENT
+
+
+# 全局模型调用调度实例
+provider_scheduler = ProviderScheduler(
+    enabled=config_manager.get_config_value('scheduler', 'enabled', 'true').lower() == 'true',
+    slots=int(config_manager.get_config_value('scheduler', 'provider_slots', '4')),
+    interactive_weight=int(config_manager.get_config_value('scheduler', 'interactive_weight', '4')),
+    bulk_weight=int(config_manager.get_config_value('scheduler', 'bulk_weight', '1')),
+    interactive_endpoints=[
+        name.strip() for name in config_manager.get_config_value(
+            'scheduler', 'interactive_endpoints',
+            'decode, generate_regex, analyze_traffic, chat_weblog, test_config'
+        ).split(',') if name.strip()
+    ]
+)
@@ -0,0 +1,276 @@
+"""基于示例的正则本地合成
+
+根据源文本和目标示例直接构造候选正则：先尝试常见格式（IP、UUID、哈希、邮箱等），
+再按字符类别逐级泛化目标示例，必要时加入目标左右两侧的固定上下文。候选在本地验证，
+能精确匹配目标且不误匹配源文本其他内容时直接返回，无需调用大模型。
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+from ..config import config_manager
+from ..utils import LoggerMixin
+from .regex_verifier import RegexCandidate, parse_targets, regex_verifier
+
+_IPV4_OCTET = r'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'
+
+# 常见格式：名称 -> 正则（不含边界）
+KNOWN_FORMATS: List[Tuple[str, str]] = [
+    ("IPv4地址", rf'{_IPV4_OCTET}(?:\.{_IPV4_OCTET}){{3}}'),
+    ("UUID", r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'),
+    ("MAC地址", r'[0-9A-Fa-f]{2}(?:[:-][0-9A-Fa-f]{2}){5}'),
+    ("SHA256哈希", r'[0-9a-fA-F]{64}'),
+    ("SHA1哈希", r'[0-9a-fA-F]{40}'),
+    ("MD5哈希", r'[0-9a-fA-F]{32}'),
+    ("JWT", r'eyJ[\w-]+\.[\w-]+\.[\w-]+'),
+    ("日期时间", r'\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}'),
+    ("日期", r'\d{4}[-/]\d{2}[-/]\d{2}'),
+    ("时间", r'\d{2}:\d{2}:\d{2}'),
+    ("邮箱地址", r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+'),
+    ("URL", r'https?://[^\s"\'<>]+'),
+    ("域名", r'(?:[A-Za-z0-9-]+\.)+[A-Za-z]{2,}'),
+]
+
+# 泛化级别：名称 -> 字符分类函数，返回类别标识，None 表示按字面量处理
+_LEVELS: List[Tuple[str, Callable[[str], Optional[str]]]] = [
+    ("字符类别", lambda c: 'd' if c.isdigit() else 'l' if 'a' <= c <= 'z' else 'u' if 'A' <= c <= 'Z'
+        else 's' if c.isspace() else None),
+    ("字母/数字", lambda c: 'd' if c.isdigit() else 'a' if c.isascii() and c.isalpha()
+        else 's' if c.isspace() else None),
+    ("字母数字", lambda c: 'w' if c.isascii() and c.isalnum() else 's' if c.isspace() else None),
+    ("标识符", lambda c: 't' if (c.isascii() and c.isalnum()) or c in '_-' else 's' if c.isspace() else None),
+]
+_CLASS_REGEX = {'d': r'\d', 'l': '[a-z]', 'u': '[A-Z]', 'a': '[A-Za-z]', 'w': '[A-Za-z0-9]', 't': r'[\w-]', 's': r'\s'}
+_CLASS_NAMES = {'d': "数字", 'l': "小写字母", 'u': "大写字母", 'a': "字母", 'w': "字母或数字",
+                't': "字母、数字、下划线或连字符", 's': "空白", 'h': "十六进制字符"}
+# 上下文最长保留的字符数
+_CONTEXT_LIMIT = 20
+# 上下文在这些分隔符处截断
+_CONTEXT_LEFT_RE = re.compile(r'[^\s&?;,/|()\[\]{}"\']*\s?$')
+_CONTEXT_RIGHT_RE = re.compile(r'\s?[^\s&?;,/|()\[\]{}"\']*')
+
+
+@dataclass
+class SynthesisResult:
+    """合成结果"""
+    pattern: str
+    strategy: str
+    explanation: List[str] = field(default_factory=list)
+    candidate: Optional[RegexCandidate] = None
+    alternatives: List[str] = field(default_factory=list)
+    tried: int = 0
+
+
+def _runs(text: str, classify: Callable[[str], Optional[str]]) -> List[Tuple[str, int]]:
+    """按字符类别切分连续片段，字面量以 ('=字符', 长度) 表示"""
+    runs: List[Tuple[str, int]] = []
+    for char in text:
+        kind = classify(char) or f"={char}"
+        if runs and runs[-1][0] == kind:
+            runs[-1] = (kind, runs[-1][1] + 1)
+        else:
+            runs.append((kind, 1))
+    return runs
+
+
+def _literal(text: str) -> str:
+    """转义字面量，正则外无特殊含义的字符保持原样以便阅读"""
+    escaped = re.escape(text)
+    for char in ' -&~#':
+        escaped = escaped.replace('\\' + char, char)
+    return escaped
+
+
+def _is_hex(texts: List[str]) -> bool:
+    return all(re.fullmatch(r'[0-9a-fA-F]+', text) for text in texts)
+
+
+def _quantifier(low: int, high: int, mode: str, kind: str = '') -> str:
+    if mode == 'loose':
+        # 数字、十六进制等串长度通常可变，单个字母多为固定的大小写位置
+        return '' if high == 1 and kind in ('l', 'u', 'a', 's') else '+'
+    if low == high:
+        return '' if low == 1 else f'{{{low}}}'
+    return f'{{{low},{high}}}'
+
+
+def _common_suffix(texts: List[str]) -> str:
+    suffix = texts[0]
+    for text in texts[1:]:
+        while suffix and not text.endswith(suffix):
+            suffix = suffix[1:]
+    return suffix
+
+
+def _common_prefix(texts: List[str]) -> str:
+    prefix = texts[0]
+    for text in texts[1:]:
+        while prefix and not text.startswith(prefix):
+            prefix = prefix[:-1]
+    return prefix
+
+
+class RegexSynthesizer(LoggerMixin):
+    """示例驱动的正则合成器"""
+
+    def __init__(self, enabled: bool = True, max_source_length: int = 200000):
+        self.enabled = enabled
+        self.max_source_length = max_source_length
+
+    def synthesize(self, source_text: str, target_text: str) -> Optional[SynthesisResult]:
+        """合成能精确匹配目标的正则，无法合成时返回 None"""
+        targets = parse_targets(target_text)
+        if not self.enabled or not targets or len(source_text) > self.max_source_length:
+            return None
+
+        tried = 0
+        passed: List[Tuple[str, str, List[str], RegexCandidate]] = []
+        for pattern, strategy, explanation in self._candidates(source_text, targets):
+            tried += 1
+            candidate = regex_verifier.check(pattern, source_text, targets)
+            if candidate.passed:
+                passed.append((pattern, strategy, explanation, candidate))
+                if len(passed) >= 3:
+                    break
+
+        if not passed:
+            self.logger.info(f"正则本地合成失败，尝试候选: {tried}")
+            return None
+        pattern, strategy, explanation, candidate = passed[0]
+        self.logger.info(f"正则本地合成成功: {pattern}，策略: {strategy}，尝试候选: {tried}")
+        return SynthesisResult(
+            pattern=pattern, strategy=strategy, explanation=explanation, candidate=candidate,
+            alternatives=[item[0] for item in passed[1:]], tried=tried
+        )
+
+    def _candidates(self, source_text: str, targets: List[str]):
+        """按从通用到具体的顺序生成候选正则"""
+        seen = set()
+        contexts = self._contexts(source_text, targets)
+        known: List[Tuple[str, str, List[str]]] = []
+        generalized: List[Tuple[tuple, str, str, List[str]]] = []
+
+        for name, body in KNOWN_FORMATS:
+            if all(re.fullmatch(body, target) for target in targets):
+                known.append((body, f"常见格式: {name}", [f"{body}：匹配{name}"]))
+        for rank, (level, classify) in enumerate(_LEVELS):
+            for mode_rank, mode in enumerate(('loose', 'range')):
+                built = self._generalize(targets, classify, mode)
+                if built:
+                    body, explanation = built
+                    # 优先长度可变的正则；片段过碎的排在最后，其余片段越少越通用，同等情况下优先更细的字符类别
+                    parts = len(explanation)
+                    generalized.append(((parts > 6, mode_rank, parts, rank), body, f"按{level}泛化", explanation))
+        bodies = known + [item[1:] for item in sorted(generalized, key=lambda item: item[0])]
+
+        # 先尝试只加单词边界的候选，都不能精确匹配时再加上下文断言
+        for with_context in (False, True):
+            for body, strategy, explanation in bodies:
+                for pattern, extra in self._with_boundaries(body, targets, contexts, with_context):
+                    if pattern not in seen:
+                        seen.add(pattern)
+                        yield pattern, strategy, explanation + extra
+
+    @staticmethod
+    def _generalize(targets: List[str], classify: Callable[[str], Optional[str]],
+                    mode: str) -> Optional[Tuple[str, List[str]]]:
+        """所有目标的类别序列一致时，按位置合并长度范围生成正则"""
+        sequences = [_runs(target, classify) for target in targets]
+        kinds = [kind for kind, _ in sequences[0]]
+        if any([kind for kind, _ in sequence] != kinds for sequence in sequences[1:]):
+            return None
+        # 全是字面量时没有泛化意义
+        if all(kind.startswith('=') for kind in kinds):
+            return None
+
+        parts = []
+        explanation = []
+        for index, kind in enumerate(kinds):
+            lengths = [sequence[index][1] for sequence in sequences]
+            low, high = min(lengths), max(lengths)
+            if kind.startswith('='):
+                char = kind[1:]
+                parts.append(_literal(char) + _quantifier(low, high, 'range'))
+                explanation.append(f"{parts[-1]}：字面量 {char!r}")
+                continue
+            regex = _CLASS_REGEX[kind]
+            name = _CLASS_NAMES[kind]
+            if kind in ('w', 't'):
+                texts = []
+                for target, sequence in zip(targets, sequences):
+                    offset = sum(length for _, length in sequence[:index])
+                    texts.append(target[offset:offset + sequence[index][1]])
+                if all(text.isdigit() for text in texts):
+                    regex, name, kind = r'\d', _CLASS_NAMES['d'], 'd'
+                elif _is_hex(texts):
+                    regex = '[0-9a-f]' if all(t == t.lower() for t in texts) else \
+                        '[0-9A-F]' if all(t == t.upper() for t in texts) else '[0-9a-fA-F]'
+                    name = _CLASS_NAMES['h']
+            quantifier = _quantifier(low, high, mode, kind)
+            parts.append(regex + quantifier)
+            count = "1个或多个" if quantifier == '+' else f"{low}个" if low == high else f"{low}到{high}个"
+            explanation.append(f"{parts[-1]}：{count}{name}")
+        return ''.join(parts), explanation
+
+    @staticmethod
+    def _contexts(source_text: str, targets: List[str]) -> Dict[str, str]:
+        """提取所有目标出现位置共同的左右固定上下文"""
+        lefts, rights = [], []
+        for target in targets:
+            for match in re.finditer(re.escape(target), source_text):
+                line_start = source_text.rfind('\n', 0, match.start()) + 1
+                line_end = source_text.find('\n', match.end())
+                line_end = len(source_text) if line_end < 0 else line_end
+                lefts.append(source_text[max(line_start, match.start() - _CONTEXT_LIMIT):match.start()])
+                rights.append(source_text[match.end():min(line_end, match.end() + _CONTEXT_LIMIT)])
+        if not lefts:
+            return {}
+        left = _common_suffix(lefts)
+        right = _common_prefix(rights)
+        # 上下文只保留到最近的分隔符（可带一个空白），避免把不相关的内容固定下来
+        left = _CONTEXT_LEFT_RE.search(left).group() if left.strip() else ''
+        right = _CONTEXT_RIGHT_RE.match(right).group() if right.strip() else ''
+        return {'left': left, 'right': right}
+
+    @staticmethod
+    def _with_boundaries(body: str, targets: List[str], contexts: Dict[str, str], with_context: bool):
+        """为正则主体加上单词边界或上下文断言"""
+        if not with_context:
+            word_start = all(re.match(r'\w', target) for target in targets)
+            word_end = all(re.search(r'\w$', target) for target in targets)
+            boundary = r'\b'
+            bounded = (boundary if word_start else '') + body + (boundary if word_end else '')
+            yield bounded, []
+            if bounded != body:
+                yield body, []
+            return
+        left, right = contexts.get('left', ''), contexts.get('right', '')
+        if left:
+            yield f"(?<={_literal(left)}){body}", [f"(?<={_literal(left)})：要求前面紧跟 {left!r}"]
+        if right:
+            yield f"{body}(?={_literal(right)})", [f"(?={_literal(right)})：要求后面紧跟 {right!r}"]
+        if left and right:
+            yield f"(?<={_literal(left)}){body}(?={_literal(right)})", [
+                f"(?<={_literal(left)})：要求前面紧跟 {left!r}",
+                f"(?={_literal(right)})：要求后面紧跟 {right!r}"
+            ]
+
+    @staticmethod
+    def format_result(result: SynthesisResult, targets: List[str]) -> str:
+        """按大模型回答的格式生成报告"""
+        lines = ["【推荐正则】", result.pattern, "【备选方案】"]
+        lines.extend(result.alternatives or ["无"])
+        lines.append("【表达式解释】")
+        lines.append(f"本地合成（{result.strategy}）：")
+        lines.extend(f"• {item}" for item in result.explanation)
+        lines.append("【测试用例】")
+        lines.extend(f"• {target} → 匹配" for target in targets)
+        extra = "；源文本中无其他误匹配" if result.candidate and not result.candidate.extra_matches else ""
+        lines.append(f"已在本地验证：全部 {len(targets)} 个目标被完整匹配{extra}，无ReDoS风险。")
+        return "\n".join(lines)
+
+
+# 全局正则合成器实例
+regex_synthesizer = RegexSynthesizer(
+    enabled=config_manager.get_config_value('regex', 'local_synthesis', 'true').lower() == 'true'
+)
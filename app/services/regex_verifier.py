@@ -0,0 +1,562 @@
+"""正则表达式本地验证
+
+从大模型的回答中提取候选正则，在隔离的子进程中编译并用源文本、目标文本做匹配/误匹配测试，
+结合静态ReDoS分析和对抗输入计时，按正确性和匹配速度对候选排序。
+"""
+
+import json
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+from ..config import config_manager
+from ..utils import LoggerMixin
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+_POSSESSIVE_REPEAT = getattr(sre_constants, 'POSSESSIVE_REPEAT', None)
+_ATOMIC_GROUP = getattr(sre_constants, 'ATOMIC_GROUP', None)
+# 用于近似计算字符集合的探测字母表
+_PROBE = [chr(code) for code in range(32, 127)] + ['\t', '\n']
+_CATEGORY_TESTS = {
+    sre_constants.CATEGORY_DIGIT: lambda c: c.isdigit(),
+    sre_constants.CATEGORY_NOT_DIGIT: lambda c: not c.isdigit(),
+    sre_constants.CATEGORY_SPACE: lambda c: c.isspace(),
+    sre_constants.CATEGORY_NOT_SPACE: lambda c: not c.isspace(),
+    sre_constants.CATEGORY_WORD: lambda c: c.isalnum() or c == '_',
+    sre_constants.CATEGORY_NOT_WORD: lambda c: not (c.isalnum() or c == '_'),
+}
+# 对抗输入末尾用于迫使匹配失败、触发回溯的字符
+_FAIL_SUFFIXES = ('\x00', '!', '\n')
+
+# 回答中的代码块与行内代码
+_CODE_BLOCK_RE = re.compile(r'```[\w+-]*\n(.*?)```', re.S)
+_INLINE_CODE_RE = re.compile(r'`([^`\n]{2,})`')
+_QUOTED_RE = re.compile(r'''(?:r|R)?(["'])((?:\\.|(?!\1).)+)\1''')
+_SLASH_RE = re.compile(r'^/(.+)/[gimsuy]*$')
+_CANDIDATE_SECTIONS = ('【推荐正则】', '【备选方案】')
+
+# 子进程内执行的验证脚本，只依赖标准库；候选正则可能灾难性回溯，必须能被整体杀掉
+_WORKER_SCRIPT = r'''
+import json, re, sys, time
+job = json.loads(sys.stdin.read())
+def emit(**kw):
+    sys.stdout.write(json.dumps(kw) + "\n")
+    sys.stdout.flush()
+try:
+    rx = re.compile(job["pattern"])
+except Exception as exc:
+    emit(stage="compile", error=str(exc))
+    sys.exit(0)
+def values(text):
+    out = []
+    for m in rx.finditer(text):
+        out.append([m.group(0)] + [g for g in m.groups() if g is not None])
+        if len(out) >= 500:
+            break
+    return out
+emit(stage="match", source=values(job["source"]), targets=[values(t) for t in job["targets"]])
+runs = 0
+start = time.perf_counter()
+while runs < 20 and (runs == 0 or time.perf_counter() - start < 0.2):
+    rx.findall(job["normal"])
+    runs += 1
+emit(stage="speed", ms=(time.perf_counter() - start) * 1000 / runs)
+for text in job["adversarial"]:
+    start = time.perf_counter()
+    rx.search(text)
+    emit(stage="adversarial", ms=(time.perf_counter() - start) * 1000)
+'''
+
+
+@dataclass
+class RedosReport:
+    """静态ReDoS分析结果"""
+    risk: str = 'none'
+    reasons: List[str] = field(default_factory=list)
+    inputs: List[str] = field(default_factory=list)
+
+
+@dataclass
+class RegexCandidate:
+    """候选正则及验证结果"""
+    pattern: str
+    error: str = ''
+    matched_targets: List[str] = field(default_factory=list)
+    missed_targets: List[str] = field(default_factory=list)
+    extra_matches: List[str] = field(default_factory=list)
+    redos_risk: str = 'none'
+    redos_reasons: List[str] = field(default_factory=list)
+    match_ms: Optional[float] = None
+    adversarial_ms: Optional[float] = None
+    timed_out: bool = False
+
+    @property
+    def correct(self) -> bool:
+        return not self.error and not self.missed_targets and not self.extra_matches
+
+    @property
+    def safe(self) -> bool:
+        return not self.error and not self.timed_out and self.redos_risk != 'exponential'
+
+    @property
+    def passed(self) -> bool:
+        return self.correct and self.safe
+
+    def failure_reasons(self) -> List[str]:
+        """列出未通过验证的原因"""
+        if self.error:
+            return [f"编译失败: {self.error}"]
+        reasons = []
+        if self.missed_targets:
+            reasons.append(f"未匹配目标: {', '.join(self.missed_targets[:5])}")
+        if self.extra_matches:
+            reasons.append(f"误匹配非目标内容: {', '.join(self.extra_matches[:5])}")
+        if self.timed_out:
+            reasons.append("对抗输入下匹配超时（灾难性回溯）")
+        elif self.redos_risk != 'none':
+            reasons.append(f"ReDoS风险({self.redos_risk}): {'; '.join(self.redos_reasons)}")
+        return reasons
+
+    def to_dict(self) -> dict:
+        return {
+            "pattern": self.pattern,
+            "passed": self.passed,
+            "correct": self.correct,
+            "safe": self.safe,
+            "error": self.error,
+            "matched_targets": self.matched_targets,
+            "missed_targets": self.missed_targets,
+            "extra_matches": self.extra_matches[:20],
+            "redos_risk": self.redos_risk,
+            "redos_reasons": self.redos_reasons,
+            "match_ms": self.match_ms,
+            "adversarial_ms": self.adversarial_ms,
+            "timed_out": self.timed_out
+        }
+
+
+@dataclass
+class VerificationReport:
+    """一组候选正则的验证结果，已按正确性和速度排序"""
+    candidates: List[RegexCandidate] = field(default_factory=list)
+
+    @property
+    def best(self) -> Optional[RegexCandidate]:
+        return self.candidates[0] if self.candidates and not self.candidates[0].error else None
+
+    @property
+    def passed(self) -> bool:
+        return bool(self.candidates) and self.candidates[0].passed
+
+
+def parse_targets(target_text: str) -> List[str]:
+    """目标文本每行一个匹配目标"""
+    targets = []
+    for line in target_text.splitlines():
+        line = line.strip()
+        if line and line not in targets:
+            targets.append(line)
+    return targets
+
+
+def extract_candidates(response: str, limit: int = 8) -> List[str]:
+    """从回答的【推荐正则】【备选方案】部分提取候选正则"""
+    sections = []
+    for marker in _CANDIDATE_SECTIONS:
+        index = response.find(marker)
+        if index < 0:
+            continue
+        end = response.find('【', index + len(marker))
+        sections.append(response[index + len(marker):end if end > 0 else len(response)])
+    text = '\n'.join(sections) if sections else response
+
+    candidates: List[str] = []
+
+    def add(pattern: str) -> None:
+        pattern = pattern.strip()
+        slash = _SLASH_RE.match(pattern)
+        if slash:
+            pattern = slash.group(1)
+        if len(pattern) >= 2 and pattern not in candidates:
+            candidates.append(pattern)
+
+    for block in _CODE_BLOCK_RE.findall(text):
+        for line in block.splitlines():
+            line = line.strip()
+            if not line or line.startswith(('#', '//')):
+                continue
+            # 代码中的正则取引号内的字符串
+            if re.search(r'\bre\.\w+\(|RegExp\(|=\s*r?["\']|\bpattern\b', line):
+                for _, quoted in _QUOTED_RE.findall(line):
+                    add(quoted)
+            else:
+                add(line)
+    for inline in _INLINE_CODE_RE.findall(_CODE_BLOCK_RE.sub('', text)):
+        add(inline)
+    return candidates[:limit]
+
+
+def _char_matches(op, av, char: str) -> bool:
+    """判断单字符节点能否匹配给定字符"""
+    if op == sre_constants.LITERAL:
+        return ord(char) == av
+    if op == sre_constants.NOT_LITERAL:
+        return ord(char) != av
+    if op == sre_constants.ANY:
+        return char != '\n'
+    if op == sre_constants.IN:
+        negate = False
+        hit = False
+        for item_op, item_av in av:
+            if item_op == sre_constants.NEGATE:
+                negate = True
+            elif item_op == sre_constants.LITERAL:
+                hit = hit or ord(char) == item_av
+            elif item_op == sre_constants.RANGE:
+                hit = hit or item_av[0] <= ord(char) <= item_av[1]
+            elif item_op == sre_constants.CATEGORY:
+                test = _CATEGORY_TESTS.get(item_av)
+                hit = hit or bool(test and test(char))
+        return hit != negate
+    return False
+
+
+def _children(op, av) -> List[list]:
+    """返回节点包含的子序列"""
+    if op in _REPEATS or op == _POSSESSIVE_REPEAT:
+        return [av[2]]
+    if op == sre_constants.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_constants.BRANCH:
+        return list(av[1])
+    if op == _ATOMIC_GROUP:
+        return [av]
+    return []
+
+
+def _all_chars(seq) -> Set[str]:
+    """序列中任意位置可能出现的字符（基于探测字母表）"""
+    chars: Set[str] = set()
+    for op, av in seq:
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+            chars.update(c for c in _PROBE if _char_matches(op, av, c))
+        else:
+            for child in _children(op, av):
+                chars |= _all_chars(child)
+    return chars
+
+
+def _nullable(op, av) -> bool:
+    """节点能否匹配空串"""
+    if op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return True
+    if op in _REPEATS or op == _POSSESSIVE_REPEAT:
+        return av[0] == 0 or all(_nullable(*item) for item in av[2])
+    if op == sre_constants.BRANCH:
+        return any(all(_nullable(*item) for item in branch) for branch in av[1])
+    if op in (sre_constants.SUBPATTERN, _ATOMIC_GROUP):
+        return all(_nullable(*item) for item in _children(op, av)[0])
+    return False
+
+
+def _first_chars(seq, last: bool = False) -> Set[str]:
+    """序列可能的首字符，last 为真时返回可能的末字符"""
+    chars: Set[str] = set()
+    for op, av in (reversed(list(seq)) if last else seq):
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+            chars.update(c for c in _PROBE if _char_matches(op, av, c))
+        else:
+            for child in _children(op, av):
+                chars |= _first_chars(child, last)
+        if not _nullable(op, av):
+            break
+    return chars
+
+
+def _flatten(seq) -> list:
+    """展开分组，分组与其内容按顺序拼接等价"""
+    items = []
+    for op, av in seq:
+        if op == sre_constants.SUBPATTERN:
+            items.extend(_flatten(av[-1]))
+        else:
+            items.append((op, av))
+    return items
+
+
+def _pick(chars: Set[str]) -> str:
+    """从字符集合中挑选代表字符，优先字母数字"""
+    return min(chars, key=lambda c: (not c.isalnum(), c))
+
+
+def _sample(seq) -> str:
+    """生成能匹配序列的最短示例字符串"""
+    parts = []
+    for op, av in seq:
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+            parts.append(next((c for c in _PROBE if _char_matches(op, av, c)), ''))
+        elif op in _REPEATS or op == _POSSESSIVE_REPEAT:
+            parts.append(_sample(av[2]) * min(av[0], 16))
+        elif op == sre_constants.BRANCH:
+            parts.append(_sample(av[1][0]))
+        elif op in (sre_constants.SUBPATTERN, _ATOMIC_GROUP):
+            parts.append(_sample(_children(op, av)[0]))
+    return ''.join(parts)
+
+
+def analyze_redos(pattern: str, pump_length: int = 2048) -> RedosReport:
+    """静态分析嵌套量词、量词内重叠分支和相邻重叠量词，并生成对抗输入"""
+    report = RedosReport()
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return report
+    risky: List[Tuple[str, str]] = []
+    plain: List[Tuple[str, str]] = []
+
+    def escalate(risk: str, reason: str) -> None:
+        if risk == 'exponential' or report.risk == 'none':
+            report.risk = risk
+        if reason not in report.reasons:
+            report.reasons.append(reason)
+
+    def walk(seq, prefix: str) -> None:
+        items = list(seq)
+        for index, (op, av) in enumerate(items):
+            here = prefix + _sample(items[:index])
+            if op in _REPEATS and av[1] > 1:
+                body = av[2]
+                chars = _all_chars(body)
+                if chars:
+                    plain.append((here, _pick(chars)))
+                # 量词体内的重复项，其后可接的字符与自身重叠时回溯路径呈指数增长；
+                # 外层次数较小的有界量词（如 {3}）回溯规模有限，不检查
+                large = av[1] == sre_constants.MAXREPEAT or av[1] > 16
+                body_items = _flatten(body) if large else []
+                for inner_index, (inner_op, inner_av) in enumerate(body_items):
+                    if inner_op in _REPEATS and inner_av[1] > 1:
+                        rest = body_items[inner_index + 1:]
+                        follow = _first_chars(rest)
+                        if all(_nullable(*item) for item in rest):
+                            follow |= _first_chars(body_items)
+                        overlap = _all_chars(inner_av[2]) & follow
+                        if overlap:
+                            escalate('exponential', "嵌套量词且内外重复可匹配相同字符")
+                            risky.append((here, _pick(overlap)))
+                    if inner_op == sre_constants.BRANCH:
+                        firsts = [_first_chars(branch) for branch in inner_av[1]]
+                        for i in range(len(firsts)):
+                            for j in range(i + 1, len(firsts)):
+                                if firsts[i] & firsts[j]:
+                                    escalate('exponential', "量词内的分支可匹配相同前缀")
+                                    risky.append((here, _pick(firsts[i] & firsts[j])))
+                # 相邻的无界量词在衔接处可匹配相同字符时回溯呈多项式增长
+                if av[1] == sre_constants.MAXREPEAT:
+                    for next_op, next_av in items[index + 1:]:
+                        if next_op in _REPEATS and next_av[1] == sre_constants.MAXREPEAT:
+                            overlap = _first_chars(body, last=True) & _all_chars(next_av[2])
+                            if overlap:
+                                escalate('polynomial', "相邻无界量词可匹配相同字符")
+                                risky.append((here, _pick(overlap)))
+                            break
+                        if not _nullable(next_op, next_av):
+                            break
+                walk(body, here)
+            else:
+                for child in _children(op, av):
+                    walk(child, here)
+
+    walk(parsed, '')
+    # 风险项优先，限制对抗输入数量
+    for prefix, pump in risky + plain:
+        for suffix in _FAIL_SUFFIXES:
+            text = prefix + pump * pump_length + suffix
+            if text not in report.inputs:
+                report.inputs.append(text)
+    report.inputs = report.inputs[:6]
+    return report
+
+
+class RegexVerifier(LoggerMixin):
+    """候选正则验证器"""
+
+    def __init__(self, timeout: float = 3.0, pump_length: int = 2048, slow_ms: float = 100.0,
+                 max_candidates: int = 8, max_retries: int = 1):
+        self.timeout = timeout
+        self.pump_length = pump_length
+        self.slow_ms = slow_ms
+        self.max_candidates = max_candidates
+        self.max_retries = max_retries
+
+    def verify_response(self, response: str, source_text: str, target_text: str,
+                        previous: Optional[VerificationReport] = None) -> VerificationReport:
+        """提取回答中的候选正则并验证，previous 中已验证的候选一并参与排序"""
+        patterns = extract_candidates(response, self.max_candidates)
+        checked: Dict[str, RegexCandidate] = {}
+        if previous:
+            checked.update((candidate.pattern, candidate) for candidate in previous.candidates)
+        pending = [pattern for pattern in patterns if pattern not in checked]
+        targets = parse_targets(target_text)
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(4, len(pending))) as executor:
+                for candidate in executor.map(lambda p: self.verify(p, source_text, targets), pending):
+                    checked[candidate.pattern] = candidate
+
+        report = VerificationReport(sorted(checked.values(), key=self._rank))
+        self.logger.info(
+            f"正则验证完成，候选: {len(report.candidates)}, 新验证: {len(pending)}, "
+            f"通过: {sum(1 for c in report.candidates if c.passed)}"
+        )
+        return report
+
+    def check(self, pattern: str, source_text: str, targets: List[str]) -> RegexCandidate:
+        """在当前进程内验证本地生成的正则
+
+        只用于结构上不含嵌套量词的可信正则，静态分析发现风险时直接判为不安全。
+        """
+        candidate = RegexCandidate(pattern=pattern)
+        redos = analyze_redos(pattern, self.pump_length)
+        candidate.redos_risk = redos.risk
+        candidate.redos_reasons = redos.reasons
+        if redos.risk != 'none':
+            return candidate
+        try:
+            compiled = re.compile(pattern)
+        except re.error as e:
+            candidate.error = str(e)
+            return candidate
+
+        def values(text: str) -> List[List[str]]:
+            return [
+                [match.group(0)] + [group for group in match.groups() if group is not None]
+                for match in compiled.finditer(text)
+            ]
+
+        self._score(candidate, source_text, targets, {
+            'source': values(source_text),
+            'targets': [values(target) for target in targets]
+        })
+        return candidate
+
+    def verify(self, pattern: str, source_text: str, targets: List[str]) -> RegexCandidate:
+        """在子进程中验证单个候选，超时即视为灾难性回溯"""
+        candidate = RegexCandidate(pattern=pattern)
+        redos = analyze_redos(pattern, self.pump_length)
+        candidate.redos_risk = redos.risk
+        candidate.redos_reasons = redos.reasons
+
+        normal = source_text * max(1, 65536 // max(1, len(source_text)))
+        job = json.dumps({
+            "pattern": pattern,
+            "source": source_text,
+            "targets": targets,
+            "normal": normal[:65536],
+            "adversarial": redos.inputs
+        })
+        try:
+            completed = subprocess.run(
+                [sys.executable, '-I', '-c', _WORKER_SCRIPT],
+                input=job, capture_output=True, text=True, timeout=self.timeout
+            )
+            output = completed.stdout
+        except subprocess.TimeoutExpired as e:
+            candidate.timed_out = True
+            output = e.stdout.decode('utf-8', 'replace') if isinstance(e.stdout, bytes) else (e.stdout or '')
+
+        adversarial = []
+        for line in output.splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event['stage'] == 'compile':
+                candidate.error = event['error']
+            elif event['stage'] == 'match':
+                self._score(candidate, source_text, targets, event)
+            elif event['stage'] == 'speed':
+                candidate.match_ms = round(event['ms'], 3)
+            elif event['stage'] == 'adversarial':
+                adversarial.append(event['ms'])
+        if adversarial:
+            candidate.adversarial_ms = round(max(adversarial), 3)
+            if candidate.adversarial_ms > self.slow_ms and candidate.redos_risk == 'none':
+                candidate.redos_risk = 'polynomial'
+                candidate.redos_reasons.append(f"对抗输入耗时 {candidate.adversarial_ms}ms")
+        if candidate.timed_out and not candidate.matched_targets and not candidate.missed_targets:
+            candidate.missed_targets = list(targets)
+        return candidate
+
+    @staticmethod
+    def _score(candidate: RegexCandidate, source_text: str, targets: List[str], event: dict) -> None:
+        """目标应被完整匹配（整体或任一分组），源文本中的其他匹配视为误匹配"""
+        found = {value for values in event['source'] for value in values}
+        for target, matches in zip(targets, event['targets']):
+            if target in source_text:
+                ok = target in found
+            else:
+                ok = any(target in values for values in matches)
+            (candidate.matched_targets if ok else candidate.missed_targets).append(target)
+        for values in event['source']:
+            extra = values[0]
+            if extra and not set(values) & set(targets) and extra not in candidate.extra_matches:
+                candidate.extra_matches.append(extra)
+
+    @staticmethod
+    def _rank(candidate: RegexCandidate) -> tuple:
+        """排序：可编译 > 通过全部测试 > 目标命中数 > 误匹配少 > 无ReDoS风险 > 匹配速度"""
+        risk = {'none': 0, 'polynomial': 1, 'exponential': 2}.get(candidate.redos_risk, 2)
+        return (
+            bool(candidate.error),
+            not candidate.passed,
+            -len(candidate.matched_targets),
+            len(candidate.extra_matches),
+            candidate.timed_out,
+            risk,
+            candidate.match_ms if candidate.match_ms is not None else float('inf')
+        )
+
+    @staticmethod
+    def format_report(report: VerificationReport) -> str:
+        """生成本地验证报告"""
+        lines = ["【本地验证】"]
+        if not report.candidates:
+            lines.append("• 未能从回答中提取到候选正则")
+            return "\n".join(lines)
+        for index, candidate in enumerate(report.candidates, 1):
+            status = "通过" if candidate.passed else "未通过"
+            speed = f"，匹配耗时 {candidate.match_ms}ms/64KB" if candidate.match_ms is not None else ""
+            lines.append(f"{index}. {candidate.pattern}  [{status}{speed}]")
+            for reason in candidate.failure_reasons():
+                lines.append(f"   - {reason}")
+        best = report.best
+        if report.passed:
+            lines.append(f"【最终推荐】{best.pattern}")
+        else:
+            lines.append("【最终推荐】没有候选通过全部测试，请人工确认后再使用")
+        return "\n".join(lines)
+
+    @staticmethod
+    def describe_failures(report: VerificationReport) -> str:
+        """供重新生成时告知模型的失败详情"""
+        lines = []
+        for candidate in report.candidates:
+            lines.append(f"- {candidate.pattern}: {'; '.join(candidate.failure_reasons()) or '通过'}")
+        return "\n".join(lines) or "- 回答中没有可提取的正则（请放在【推荐正则】下的代码块中）"
+
+
+# 全局正则验证器实例
+regex_verifier = RegexVerifier(
+    timeout=float(config_manager.get_config_value('regex', 'verify_timeout', '3')),
+    pump_length=int(config_manager.get_config_value('regex', 'adversarial_length', '2048')),
+    slow_ms=float(config_manager.get_config_value('regex', 'slow_threshold_ms', '100')),
+    max_candidates=int(config_manager.get_config_value('regex', 'max_candidates', '8')),
+    max_retries=int(config_manager.get_config_value('regex', 'max_retries', '1'))
+)
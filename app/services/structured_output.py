@@ -0,0 +1,231 @@
+"""结构化输出
+
+各分析类型按JSON Schema要求模型输出JSON，并限制回复长度和停止序列，解析为带类型的字段，
+不再依赖在自由文本中搜索 "【分析结果】是" 之类的子串。仅判定模式只要求判定字段，
+回复只有十几个token，适合批量分析。
+"""
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from ..config import config_manager
+
+_FENCE_RE = re.compile(r'```(?:json)?\s*(.*?)(?:```|$)', re.S | re.I)
+_TRUE_VALUES = ('true', '是', 'yes', '1')
+_FALSE_VALUES = ('false', '否', 'no', '0')
+
+OUTPUT_MODES = ('text', 'structured', 'verdict')
+
+
+@dataclass(frozen=True)
+class SchemaField:
+    """输出字段
+
+    type 为 boolean / string / array（字符串数组）；enum 按严重程度从高到低排列，
+    合并分块结果时取最严重的取值；verdict 为真的字段在仅判定模式下也要求输出。
+    """
+    name: str
+    type: str
+    label: str
+    description: str
+    enum: Tuple[str, ...] = ()
+    verdict: bool = False
+
+
+@dataclass(frozen=True)
+class OutputSchema:
+    """一种分析类型的结构化输出格式"""
+    name: str
+    fields: Tuple[SchemaField, ...]
+
+    def select(self, verdict_only: bool) -> List[SchemaField]:
+        return [item for item in self.fields if item.verdict or not verdict_only]
+
+    def json_schema(self, verdict_only: bool = False) -> Dict[str, Any]:
+        properties = {}
+        for item in self.select(verdict_only):
+            if item.type == 'array':
+                spec: Dict[str, Any] = {"type": "array", "items": {"type": "string"}}
+            else:
+                spec = {"type": item.type}
+            if item.enum:
+                spec["enum"] = list(item.enum)
+            spec["description"] = item.description
+            properties[item.name] = spec
+        return {
+            "type": "object",
+            "properties": properties,
+            "required": list(properties),
+            "additionalProperties": False
+        }
+
+    def instruction(self, verdict_only: bool = False) -> str:
+        """追加在分析要求之后的输出格式说明"""
+        lines = []
+        for item in self.select(verdict_only):
+            kind = {'boolean': '布尔值', 'string': '字符串', 'array': '字符串数组'}[item.type]
+            choices = f"，取值只能是: {' / '.join(item.enum)}" if item.enum else ""
+            lines.append(f'- "{item.name}" ({kind}{choices}): {item.description}')
+        brevity = ("只输出判定字段，不要解释。" if verdict_only
+                   else "数组每项不超过一句话，字符串字段不超过三句话。")
+        return ("只输出一个JSON对象，不要输出Markdown代码块或任何其他文字。JSON字段如下：\n"
+                + "\n".join(lines) + f"\n{brevity}")
+
+    def parse(self, text: str, verdict_only: bool = False) -> Dict[str, Any]:
+        """解析模型回复，校验并转换字段类型；判定字段缺失或取值非法时抛出 ValueError"""
+        data = extract_json(text)
+        result: Dict[str, Any] = {}
+        for item in self.select(verdict_only):
+            value = data.get(item.name)
+            if value is None:
+                if item.verdict:
+                    raise ValueError(f"缺少字段 {item.name}")
+                value = [] if item.type == 'array' else ''
+            result[item.name] = self._coerce(item, value)
+        return result
+
+    @staticmethod
+    def _coerce(item: SchemaField, value: Any) -> Any:
+        if item.type == 'boolean':
+            if isinstance(value, bool):
+                return value
+            text = str(value).strip().lower()
+            if text in _TRUE_VALUES:
+                return True
+            if text in _FALSE_VALUES:
+                return False
+            raise ValueError(f"字段 {item.name} 不是布尔值: {value}")
+        if item.type == 'array':
+            if isinstance(value, str):
+                value = [value] if value.strip() else []
+            if not isinstance(value, list):
+                raise ValueError(f"字段 {item.name} 不是数组")
+            return [str(entry).strip() for entry in value if str(entry).strip()]
+        value = str(value).strip()
+        if item.enum and value not in item.enum:
+            matched = [choice for choice in item.enum if choice in value]
+            if not matched:
+                raise ValueError(f"字段 {item.name} 取值非法: {value}")
+            value = matched[0]
+        return value
+
+    def merge(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """合并分块结果：布尔取或，枚举取最严重，数组去重合并"""
+        if len(results) == 1:
+            return results[0]
+        merged: Dict[str, Any] = {}
+        for name in results[0]:
+            item = next(field for field in self.fields if field.name == name)
+            values = [result[name] for result in results]
+            if item.type == 'boolean':
+                merged[name] = any(values)
+            elif item.type == 'array':
+                merged[name] = list(dict.fromkeys(entry for value in values for entry in value))
+            elif item.enum:
+                ranked = [value for value in values if value in item.enum]
+                merged[name] = min(ranked, key=item.enum.index) if ranked else ''
+            else:
+                merged[name] = "\n".join(dict.fromkeys(value for value in values if value))
+        return merged
+
+    def render(self, data: Dict[str, Any]) -> str:
+        """按原有【标签】文本格式展示结构化结果，前端和历史判定逻辑无需改动"""
+        lines = []
+        for item in self.fields:
+            if item.name not in data:
+                continue
+            value = data[item.name]
+            if item.type == 'boolean':
+                value = '是' if value else '否'
+            elif item.type == 'array':
+                value = "".join(f"\n- {entry}" for entry in value) if value else '无'
+            lines.append(f"【{item.label}】{value}")
+        return "\n".join(lines)
+
+
+def extract_json(text: str) -> Dict[str, Any]:
+    """从回复中取出第一个JSON对象，容忍代码块包裹以及因停止序列或长度上限被截断的结尾"""
+    fenced = _FENCE_RE.search(text)
+    if fenced and '{' in fenced.group(1):
+        text = fenced.group(1)
+    start = text.find('{')
+    if start < 0:
+        raise ValueError("回复中没有JSON对象")
+    decoder = json.JSONDecoder()
+    for candidate in (text[start:], _close_json(text[start:])):
+        try:
+            value, _ = decoder.raw_decode(candidate)
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value
+    raise ValueError("回复不是有效的JSON对象")
+
+
+def _close_json(text: str) -> str:
+    """补全被截断的JSON：闭合字符串、数组和对象"""
+    stack = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+        elif char in '}]' and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = re.sub(r'[,:\s]+$', '', text)
+    return text + ''.join(reversed(stack))
+
+
+@dataclass(frozen=True)
+class OutputBudget:
+    """回复长度预算和停止序列"""
+    max_tokens: int
+    stop: Optional[List[str]]
+
+
+def output_budget(verdict_only: bool) -> OutputBudget:
+    if verdict_only:
+        # 判定字段在一个扁平对象内，遇到右花括号即可停止；被去掉的括号由解析时补全
+        return OutputBudget(
+            max_tokens=int(config_manager.get_config_value('structured', 'verdict_max_tokens', '64')),
+            stop=["}"]
+        )
+    return OutputBudget(
+        max_tokens=int(config_manager.get_config_value('structured', 'max_tokens', '800')),
+        stop=["\n}"]
+    )
+
+
+TRAFFIC_SCHEMA = OutputSchema(
+    name="traffic",
+    fields=(
+        SchemaField("is_attack", "boolean", "分析结果", "是否为攻击流量", verdict=True),
+        SchemaField("attack_types", "array", "攻击类型",
+                    "识别出的攻击类型，如SQL注入、XSS、路径遍历，正常流量为空数组"),
+        SchemaField("confidence", "string", "置信度", "判定的置信度", enum=("高", "中", "低")),
+        SchemaField("evidence", "array", "依据", "简明扼要的技术依据，包括解码后的可疑内容"),
+    )
+)
+
+WEBSHELL_SCHEMA = OutputSchema(
+    name="webshell",
+    fields=(
+        SchemaField("is_webshell", "boolean", "检测结果", "是否为WebShell", verdict=True),
+        SchemaField("threat_level", "string", "威胁等级", "威胁等级",
+                    enum=("高危", "中危", "低危", "无威胁"), verdict=True),
+        SchemaField("features", "array", "恶意特征", "发现的恶意代码特征和危险函数"),
+        SchemaField("functions", "string", "功能分析", "WebShell的类型和主要功能"),
+        SchemaField("recommendations", "array", "处置建议", "具体的安全处置方案"),
+    )
+)
@@ -0,0 +1,620 @@
+"""流量抓包解析
+
+支持HAR文件以及离线PCAP/PCAPNG抓包。PCAP按数据包流式读取，纯Python解析
+以太网/Linux SLL/Raw IP、IPv4/IPv6和TCP，按TCP流重组后切分出HTTP/1.x请求，
+再对近似重复的请求去重，供批量流量分析使用。
+"""
+
+import json
+import re
+import socket
+import struct
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+from ..utils import LoggerMixin
+from ..utils.exceptions import ValidationError
+
+# 抓包文件格式识别
+_PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': '<', b'\xa1\xb2\xc3\xd4': '>',
+    b'\x4d\x3c\xb2\xa1': '<', b'\xa1\xb2\x3c\x4d': '>',
+}
+_PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+
+# 链路层类型
+_LINKTYPE_NULL = 0
+_LINKTYPE_ETHERNET = 1
+_LINKTYPE_RAW = (12, 14, 101)
+_LINKTYPE_LINUX_SLL = 113
+_LINKTYPE_IPV4 = 228
+_LINKTYPE_IPV6 = 229
+_LINKTYPE_LINUX_SLL2 = 276
+
+_ETHERTYPE_IPV4 = 0x0800
+_ETHERTYPE_IPV6 = 0x86DD
+_ETHERTYPE_VLAN = (0x8100, 0x88A8, 0x9100)
+_IPV6_EXTENSION_HEADERS = (0, 43, 60)
+
+_TCP_FIN = 0x01
+_TCP_SYN = 0x02
+_TCP_RST = 0x04
+
+_HTTP_METHODS = (b'GET', b'POST', b'PUT', b'DELETE', b'HEAD', b'OPTIONS', b'PATCH',
+                 b'CONNECT', b'TRACE', b'PROPFIND', b'PROPPATCH', b'MKCOL', b'COPY',
+                 b'MOVE', b'LOCK', b'UNLOCK')
+_REQUEST_LINE_RE = re.compile(rb'(?:%s) [^\s]+ HTTP/1\.[01]\r?\n' % b'|'.join(_HTTP_METHODS))
+
+# 单个TCP流缓存的上限，超出后丢弃该流剩余数据
+_MAX_STREAM_BUFFER = 8 * 1024 * 1024
+# 单个TCP流允许缓存的乱序报文数，超出后视为丢包并跳过缺口
+_MAX_PENDING_SEGMENTS = 256
+# 送去分析的请求体最大字节数
+_MAX_BODY_BYTES = 16 * 1024
+
+
+@dataclass
+class CapturedRequest:
+    """从抓包中还原出的一个HTTP请求"""
+    index: int
+    method: str
+    uri: str
+    host: str
+    raw: str
+    timestamp: Optional[float] = None
+    client: str = ""
+    server: str = ""
+
+    def to_dict(self) -> Dict:
+        return {
+            "index": self.index,
+            "method": self.method,
+            "uri": self.uri,
+            "host": self.host,
+            "timestamp": self.timestamp,
+            "client": self.client,
+            "server": self.server
+        }
+
+
+@dataclass
+class RequestGroup:
+    """近似重复的一组请求，只分析第一个"""
+    signature: str
+    sample: CapturedRequest
+    indexes: List[int] = field(default_factory=list)
+
+    @property
+    def count(self) -> int:
+        return len(self.indexes)
+
+
+@dataclass
+class CaptureStats:
+    """解析统计"""
+    format: str = ""
+    packets: int = 0
+    tcp_segments: int = 0
+    streams: int = 0
+    skipped_packets: int = 0
+    gaps: int = 0
+
+
+class _TcpStream:
+    """单方向TCP字节流：按序号重组，处理重传、乱序和序号回绕"""
+
+    __slots__ = ('next_seq', 'pending', 'buffer', 'is_http', 'timestamp', 'gaps')
+
+    def __init__(self):
+        self.next_seq: Optional[int] = None
+        self.pending: Dict[int, bytes] = {}
+        self.buffer = bytearray()
+        self.is_http: Optional[bool] = None
+        self.timestamp: Optional[float] = None
+        self.gaps = 0
+
+    def add(self, seq: int, data: bytes) -> None:
+        if self.next_seq is None:
+            self.next_seq = seq
+        offset = (seq - self.next_seq) & 0xFFFFFFFF
+        if offset >= 0x80000000:
+            # 与已接收数据重叠的重传报文，只保留新增部分
+            overlap = (self.next_seq - seq) & 0xFFFFFFFF
+            if overlap >= len(data):
+                return
+            data = data[overlap:]
+            seq = self.next_seq
+            offset = 0
+        if offset:
+            if seq not in self.pending or len(self.pending[seq]) < len(data):
+                self.pending[seq] = data
+            if len(self.pending) > _MAX_PENDING_SEGMENTS:
+                self._skip_gap()
+            return
+        self._append(data)
+        self._drain()
+
+    def _append(self, data: bytes) -> None:
+        self.buffer += data
+        self.next_seq = (self.next_seq + len(data)) & 0xFFFFFFFF
+
+    def _drain(self) -> None:
+        while self.pending:
+            progressed = False
+            for seq in list(self.pending):
+                offset = (seq - self.next_seq) & 0xFFFFFFFF
+                if offset and offset < 0x80000000:
+                    continue
+                data = self.pending.pop(seq)
+                overlap = (self.next_seq - seq) & 0xFFFFFFFF
+                if overlap < len(data):
+                    self._append(data[overlap:])
+                progressed = True
+            if not progressed:
+                break
+
+    def _skip_gap(self) -> None:
+        """丢包导致的缺口：从最近的乱序报文继续重组"""
+        nearest = min(self.pending, key=lambda seq: (seq - self.next_seq) & 0xFFFFFFFF)
+        self.gaps += 1
+        self.next_seq = nearest
+        self._drain()
+
+    def flush(self) -> None:
+        while self.pending:
+            self._skip_gap()
+
+
+def _detect_format(head: bytes) -> str:
+    if head[:4] in _PCAP_MAGICS:
+        return 'pcap'
+    if head[:4] == _PCAPNG_MAGIC:
+        return 'pcapng'
+    if head.lstrip(b'\xef\xbb\xbf \t\r\n')[:1] in (b'{', b''):
+        return 'har'
+    raise ValidationError("无法识别的抓包格式，仅支持HAR、PCAP和PCAPNG文件")
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError
+    return data
+
+
+def _iter_pcap(stream: BinaryIO) -> Iterator[Tuple[int, float, bytes]]:
+    """逐包读取PCAP，产出 (链路层类型, 时间戳, 数据)"""
+    header = _read_exact(stream, 24)
+    endian = _PCAP_MAGICS[header[:4]]
+    nanosecond = header[:4] in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d')
+    linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0FFFFFFF
+    divisor = 1e9 if nanosecond else 1e6
+    record = struct.Struct(endian + 'IIII')
+    while True:
+        try:
+            ts_sec, ts_frac, captured, _ = record.unpack(_read_exact(stream, 16))
+            data = _read_exact(stream, captured)
+        except EOFError:
+            return
+        yield linktype, ts_sec + ts_frac / divisor, data
+
+
+def _iter_pcapng(stream: BinaryIO) -> Iterator[Tuple[int, float, bytes]]:
+    """逐块读取PCAPNG，支持多个Section和多个接口"""
+    endian = '<'
+    interfaces: List[Tuple[int, float]] = []
+    while True:
+        try:
+            head = _read_exact(stream, 8)
+        except EOFError:
+            return
+        if head[:4] == _PCAPNG_MAGIC:
+            try:
+                magic = _read_exact(stream, 4)
+            except EOFError:
+                return
+            endian = '<' if magic == b'\x4d\x3c\x2b\x1a' else '>'
+            block_length = struct.unpack(endian + 'I', head[4:8])[0]
+            body = magic
+            remaining = block_length - 12
+            interfaces = []
+        else:
+            block_type, block_length = struct.unpack(endian + 'II', head)
+            body = b''
+            remaining = block_length - 8
+        if block_length < 12 or block_length % 4:
+            raise ValidationError("PCAPNG文件已损坏：块长度无效")
+        try:
+            body += _read_exact(stream, remaining)
+        except EOFError:
+            return
+        body = body[:-4]
+        if head[:4] == _PCAPNG_MAGIC:
+            continue
+        if block_type == 1:
+            # Interface Description Block：链路层类型和时间戳精度
+            linktype = struct.unpack(endian + 'H', body[:2])[0]
+            interfaces.append((linktype, _pcapng_resolution(body[8:], endian)))
+        elif block_type in (2, 6):
+            # Packet Block（已废弃）/ Enhanced Packet Block
+            if block_type == 6:
+                interface, ts_high, ts_low, captured = struct.unpack(endian + 'IIII', body[:16])
+            else:
+                interface, _, ts_high, ts_low, captured = struct.unpack(endian + 'HHIII', body[:16])
+            if interface >= len(interfaces):
+                continue
+            linktype, resolution = interfaces[interface]
+            yield linktype, ((ts_high << 32) | ts_low) * resolution, body[20:20 + captured]
+        elif block_type == 3 and interfaces:
+            # Simple Packet Block：没有时间戳，固定使用第一个接口
+            original = struct.unpack(endian + 'I', body[:4])[0]
+            yield interfaces[0][0], None, body[4:4 + original]
+
+
+def _pcapng_resolution(options: bytes, endian: str) -> float:
+    """解析IDB中的if_tsresol选项，默认微秒"""
+    position = 0
+    while position + 4 <= len(options):
+        code, length = struct.unpack(endian + 'HH', options[position:position + 4])
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = options[position + 4]
+            if value & 0x80:
+                return 2.0 ** -(value & 0x7F)
+            return 10.0 ** -value
+        position += 4 + ((length + 3) & ~3)
+    return 1e-6
+
+
+def _network_layer(linktype: int, frame: bytes) -> Optional[Tuple[int, bytes]]:
+    """剥离链路层，返回 (IP版本, IP报文)"""
+    if linktype == _LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return None
+        ethertype = struct.unpack('!H', frame[12:14])[0]
+        offset = 14
+        while ethertype in _ETHERTYPE_VLAN and len(frame) >= offset + 4:
+            ethertype = struct.unpack('!H', frame[offset + 2:offset + 4])[0]
+            offset += 4
+        payload = frame[offset:]
+    elif linktype == _LINKTYPE_LINUX_SLL:
+        if len(frame) < 16:
+            return None
+        ethertype = struct.unpack('!H', frame[14:16])[0]
+        payload = frame[16:]
+    elif linktype == _LINKTYPE_LINUX_SLL2:
+        if len(frame) < 20:
+            return None
+        ethertype = struct.unpack('!H', frame[:2])[0]
+        payload = frame[20:]
+    elif linktype == _LINKTYPE_NULL:
+        if len(frame) < 4:
+            return None
+        family = struct.unpack('<I', frame[:4])[0]
+        if family > 0xFFFF:
+            family = struct.unpack('>I', frame[:4])[0]
+        ethertype = _ETHERTYPE_IPV4 if family == 2 else _ETHERTYPE_IPV6
+        payload = frame[4:]
+    elif linktype in _LINKTYPE_RAW or linktype in (_LINKTYPE_IPV4, _LINKTYPE_IPV6):
+        if not frame:
+            return None
+        version = frame[0] >> 4
+        ethertype = _ETHERTYPE_IPV4 if version == 4 else _ETHERTYPE_IPV6
+        payload = frame
+    else:
+        return None
+    if ethertype == _ETHERTYPE_IPV4:
+        return 4, payload
+    if ethertype == _ETHERTYPE_IPV6:
+        return 6, payload
+    return None
+
+
+def _tcp_segment(version: int, packet: bytes) -> Optional[Tuple[str, str, bytes]]:
+    """解析IP头，返回 (源地址, 目的地址, TCP报文)；非TCP或分片报文返回None"""
+    if version == 4:
+        if len(packet) < 20:
+            return None
+        header_length = (packet[0] & 0x0F) * 4
+        total_length = struct.unpack('!H', packet[2:4])[0]
+        fragment = struct.unpack('!H', packet[6:8])[0]
+        if packet[9] != 6 or fragment & 0x3FFF:
+            return None
+        end = total_length if header_length <= total_length <= len(packet) else len(packet)
+        return (socket.inet_ntop(socket.AF_INET, packet[12:16]),
+                socket.inet_ntop(socket.AF_INET, packet[16:20]),
+                packet[header_length:end])
+    if len(packet) < 40:
+        return None
+    payload_length = struct.unpack('!H', packet[4:6])[0]
+    next_header = packet[6]
+    offset = 40
+    while next_header in _IPV6_EXTENSION_HEADERS and len(packet) >= offset + 8:
+        next_header = packet[offset]
+        offset += (packet[offset + 1] + 1) * 8
+    if next_header != 6:
+        return None
+    end = 40 + payload_length if payload_length and 40 + payload_length <= len(packet) else len(packet)
+    return (socket.inet_ntop(socket.AF_INET6, packet[8:24]),
+            socket.inet_ntop(socket.AF_INET6, packet[24:40]),
+            packet[offset:end])
+
+
+def _format_endpoint(address: str, port: int) -> str:
+    return f"[{address}]:{port}" if ':' in address else f"{address}:{port}"
+
+
+def _extract_requests(stream: _TcpStream) -> Iterator[bytes]:
+    """从重组后的字节流中切分出完整的HTTP请求"""
+    buffer = stream.buffer
+    while buffer:
+        if stream.is_http is None:
+            if len(buffer) < 16 and b'\n' not in buffer:
+                return
+            stream.is_http = bool(_REQUEST_LINE_RE.match(buffer))
+        if not stream.is_http:
+            buffer.clear()
+            return
+        if not _REQUEST_LINE_RE.match(buffer):
+            # 缺口导致的错位：跳到下一个请求行
+            match = _REQUEST_LINE_RE.search(buffer, 1)
+            if not match:
+                if len(buffer) > 65536:
+                    del buffer[:-4096]
+                return
+            del buffer[:match.start()]
+        header_end = buffer.find(b'\r\n\r\n')
+        separator = 4
+        if header_end < 0:
+            header_end = buffer.find(b'\n\n')
+            separator = 2
+        if header_end < 0:
+            return
+        head = bytes(buffer[:header_end])
+        body_start = header_end + separator
+        body_end = _body_end(head, buffer, body_start)
+        if body_end is None:
+            return
+        yield bytes(buffer[:body_end])
+        del buffer[:body_end]
+
+
+def _body_end(head: bytes, buffer: bytearray, body_start: int) -> Optional[int]:
+    """根据Content-Length或分块编码计算请求结束位置；数据不完整时返回None"""
+    content_length = 0
+    chunked = False
+    for line in head.split(b'\n')[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            try:
+                content_length = int(value.strip())
+            except ValueError:
+                content_length = 0
+        elif name == b'transfer-encoding' and b'chunked' in value.lower():
+            chunked = True
+    if not chunked:
+        end = body_start + content_length
+        return end if len(buffer) >= end else None
+    position = body_start
+    while True:
+        line_end = buffer.find(b'\n', position)
+        if line_end < 0:
+            return None
+        size_text = bytes(buffer[position:line_end]).split(b';')[0].strip()
+        try:
+            size = int(size_text, 16)
+        except ValueError:
+            return line_end + 1
+        position = line_end + 1
+        if size == 0:
+            # 结尾的trailer，以空行结束
+            trailer_end = buffer.find(b'\r\n\r\n', position - 2)
+            if trailer_end < 0:
+                return None
+            return trailer_end + 4
+        position += size
+        if len(buffer) < position + 2:
+            return None
+        position += 2 if buffer[position:position + 2] == b'\r\n' else 1
+
+
+def _build_request(raw: bytes, index: int, timestamp: Optional[float],
+                   client: str = "", server: str = "") -> CapturedRequest:
+    text = raw.decode('utf-8', errors='replace')
+    head, separator, body = text.partition('\r\n\r\n')
+    if not separator:
+        head, separator, body = text.partition('\n\n')
+    if len(body) > _MAX_BODY_BYTES:
+        body = body[:_MAX_BODY_BYTES] + f"\n...[请求体过长，已截断，原长度 {len(body)} 字符]"
+    request_line = head.split('\n', 1)[0].strip()
+    parts = request_line.split(' ')
+    method = parts[0] if parts else ''
+    uri = parts[1] if len(parts) > 1 else ''
+    host_match = re.search(r'^host:[ \t]*(\S+)', head, re.I | re.M)
+    return CapturedRequest(
+        index=index,
+        method=method,
+        uri=uri,
+        host=host_match.group(1) if host_match else server,
+        raw=head + separator + body,
+        timestamp=timestamp,
+        client=client,
+        server=server
+    )
+
+
+class TrafficCaptureParser(LoggerMixin):
+    """HAR/PCAP/PCAPNG 抓包解析器"""
+
+    def parse(self, stream: BinaryIO, stats: Optional[CaptureStats] = None) -> Iterator[CapturedRequest]:
+        """流式解析抓包文件，按出现顺序产出HTTP请求"""
+        stats = stats if stats is not None else CaptureStats()
+        head = stream.read(4)
+        if not head:
+            raise ValidationError("抓包文件不能为空")
+        stats.format = _detect_format(head)
+        remainder = _Prefixed(head, stream)
+        if stats.format == 'har':
+            yield from self._parse_har(remainder, stats)
+            return
+        packets = _iter_pcap(remainder) if stats.format == 'pcap' else _iter_pcapng(remainder)
+        try:
+            yield from self._reassemble(packets, stats)
+        except (EOFError, struct.error, IndexError) as e:
+            raise ValidationError(f"抓包文件已损坏: {e}")
+
+    def _parse_har(self, stream: BinaryIO, stats: CaptureStats) -> Iterator[CapturedRequest]:
+        try:
+            har = json.load(stream)
+        except (ValueError, UnicodeDecodeError) as e:
+            raise ValidationError(f"HAR文件不是有效的JSON: {e}")
+        entries = har.get('log', {}).get('entries') if isinstance(har, dict) else None
+        if not isinstance(entries, list):
+            raise ValidationError("HAR文件缺少 log.entries")
+        for index, entry in enumerate(entries):
+            stats.packets += 1
+            request = entry.get('request') if isinstance(entry, dict) else None
+            if not isinstance(request, dict) or not request.get('url'):
+                stats.skipped_packets += 1
+                continue
+            raw = self._har_to_http(request)
+            yield _build_request(raw.encode('utf-8'), index, None,
+                                 server=str(entry.get('serverIPAddress', '')))
+
+    @staticmethod
+    def _har_to_http(request: Dict) -> str:
+        url = urlsplit(request['url'])
+        target = (url.path or '/') + (f"?{url.query}" if url.query else '')
+        version = str(request.get('httpVersion', ''))
+        version = version if version.upper().startswith('HTTP/1') else 'HTTP/1.1'
+        lines = [f"{request.get('method', 'GET')} {target} {version}"]
+        has_host = False
+        for header in request.get('headers') or []:
+            name = str(header.get('name', ''))
+            if not name or name.startswith(':'):
+                # HTTP/2伪头部
+                continue
+            has_host = has_host or name.lower() == 'host'
+            lines.append(f"{name}: {header.get('value', '')}")
+        if not has_host and url.netloc:
+            lines.insert(1, f"Host: {url.netloc}")
+        body = (request.get('postData') or {}).get('text') or ''
+        return '\r\n'.join(lines) + '\r\n\r\n' + body
+
+    def _reassemble(self, packets: Iterator[Tuple[int, float, bytes]],
+                    stats: CaptureStats) -> Iterator[CapturedRequest]:
+        streams: Dict[Tuple[str, int, str, int], _TcpStream] = {}
+        index = 0
+        for linktype, timestamp, frame in packets:
+            stats.packets += 1
+            network = _network_layer(linktype, frame)
+            segment = _tcp_segment(*network) if network else None
+            if not segment or len(segment[2]) < 20:
+                stats.skipped_packets += 1
+                continue
+            source, destination, tcp = segment
+            source_port, destination_port, seq = struct.unpack('!HHI', tcp[:8])
+            flags = tcp[13]
+            payload = tcp[(tcp[12] >> 4) * 4:]
+            key = (source, source_port, destination, destination_port)
+            stats.tcp_segments += 1
+
+            stream = streams.get(key)
+            if stream is None:
+                if flags & (_TCP_FIN | _TCP_RST) and not payload:
+                    continue
+                stream = streams[key] = _TcpStream()
+                stats.streams += 1
+            if flags & _TCP_SYN:
+                stream.next_seq = (seq + 1) & 0xFFFFFFFF
+            if payload and stream.is_http is not False:
+                if stream.timestamp is None or not stream.buffer:
+                    stream.timestamp = timestamp
+                stream.add(seq, payload)
+                if len(stream.buffer) > _MAX_STREAM_BUFFER:
+                    stream.is_http = False
+            closing = bool(flags & (_TCP_FIN | _TCP_RST))
+            if closing:
+                stream.flush()
+            for raw in _extract_requests(stream):
+                yield _build_request(raw, index, stream.timestamp,
+                                     _format_endpoint(source, source_port),
+                                     _format_endpoint(destination, destination_port))
+                index += 1
+            if closing:
+                stats.gaps += stream.gaps
+                del streams[key]
+        for key, stream in streams.items():
+            stream.flush()
+            stats.gaps += stream.gaps
+            for raw in _extract_requests(stream):
+                yield _build_request(raw, index, stream.timestamp,
+                                     _format_endpoint(key[0], key[1]), _format_endpoint(key[2], key[3]))
+                index += 1
+
+    @staticmethod
+    def signature(request: CapturedRequest) -> str:
+        """近似重复判定的请求签名
+
+        保留方法、主机、路径和参数名，参数值中的数字串和长十六进制串归一化，
+        Cookie、时间戳、会话ID等每次不同的部分不影响签名；含特殊字符的攻击载荷仍会保持区分。
+        """
+        path, _, query = request.uri.partition('?')
+        body = request.raw.partition('\r\n\r\n')[2] or request.raw.partition('\n\n')[2]
+        params = parse_qsl(query, keep_blank_values=True)
+        if body and '=' in body and not body.lstrip().startswith(('{', '[', '<')):
+            params += parse_qsl(body, keep_blank_values=True)
+            body = ''
+        values = sorted(f"{name}={_normalize_value(value)}" for name, value in params)
+        user_agent = re.search(r'^user-agent:[ \t]*(.*)$', request.raw, re.I | re.M)
+        return '\x00'.join([
+            request.method.upper(),
+            request.host.lower(),
+            _normalize_value(path),
+            '&'.join(values),
+            _normalize_value(body[:2048]),
+            _normalize_value(user_agent.group(1)) if user_agent else ''
+        ])
+
+    def deduplicate(self, requests: Iterator[CapturedRequest]) -> List[RequestGroup]:
+        """按签名合并近似重复请求，保持首次出现顺序"""
+        groups: Dict[str, RequestGroup] = {}
+        for request in requests:
+            signature = self.signature(request)
+            group = groups.get(signature)
+            if group is None:
+                group = groups[signature] = RequestGroup(signature, request)
+            group.indexes.append(request.index)
+        return list(groups.values())
+
+
+def _normalize_value(value: str) -> str:
+    value = re.sub(r'[0-9a-fA-F]{16,}', 'H', value)
+    return re.sub(r'\d+', '0', value)
+
+
+class _Prefixed:
+    """把已读出的文件头重新拼回流的开头"""
+
+    def __init__(self, prefix: bytes, stream: BinaryIO):
+        self._prefix = prefix
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._prefix:
+            return self._stream.read(size)
+        if size is None or size < 0:
+            data = self._prefix + self._stream.read()
+            self._prefix = b''
+            return data
+        data = self._prefix[:size]
+        self._prefix = self._prefix[size:]
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+
+
+# 全局抓包解析器实例
+traffic_capture_parser = TrafficCaptureParser()
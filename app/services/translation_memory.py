@@ -0,0 +1,171 @@
+"""翻译记忆库
+
+把待翻译文本切分为段落级片段，按规范化后的片段哈希、语言对和模型持久化译文。
+再次翻译更新过的文档时只有新增或修改的片段需要交给大模型。
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from ..config import config_manager
+from ..utils import LoggerMixin
+
+# 围栏代码块整体保留，不参与翻译
+_FENCE_RE = re.compile(r'^(```|~~~)[^\n]*\n.*?^\1[ \t]*$', re.M | re.S)
+# 段落之间的空行
+_PARAGRAPH_SEP_RE = re.compile(r'(\n[ \t]*\n\s*)')
+# 含有字母（任意语言）的片段才需要翻译
+_TRANSLATABLE_RE = re.compile(r'[^\W\d_]')
+
+
+@dataclass
+class Segment:
+    """文本片段，translatable 为假的片段（代码块、空白、纯数字符号）原样保留"""
+    text: str
+    translatable: bool
+
+    @property
+    def key(self) -> str:
+        return segment_hash(self.text)
+
+
+def normalize_segment(text: str) -> str:
+    """规范化片段：去除首尾空白，合并连续空白"""
+    return re.sub(r'\s+', ' ', text.strip())
+
+
+def segment_hash(text: str) -> str:
+    return hashlib.sha256(normalize_segment(text).encode('utf-8')).hexdigest()
+
+
+def _split_paragraphs(text: str) -> List[Segment]:
+    segments = []
+    for index, part in enumerate(_PARAGRAPH_SEP_RE.split(text)):
+        if not part:
+            continue
+        if index % 2 == 1:
+            segments.append(Segment(part, False))
+            continue
+        # 段落首尾的空白单独保留，保证重新拼接后格式不变
+        body = part.strip()
+        leading = part[:len(part) - len(part.lstrip())]
+        trailing = part[len(part.rstrip()):]
+        if leading:
+            segments.append(Segment(leading, False))
+        if body:
+            segments.append(Segment(body, bool(_TRANSLATABLE_RE.search(body))))
+        if trailing:
+            segments.append(Segment(trailing, False))
+    return segments
+
+
+def split_segments(text: str) -> List[Segment]:
+    """按代码块和空行切分文本，拼接所有片段即为原文"""
+    segments: List[Segment] = []
+    position = 0
+    for match in _FENCE_RE.finditer(text):
+        segments.extend(_split_paragraphs(text[position:match.start()]))
+        segments.append(Segment(match.group(), False))
+        position = match.end()
+    segments.extend(_split_paragraphs(text[position:]))
+    return segments
+
+
+class TranslationMemory(LoggerMixin):
+    """基于SQLite的片段级翻译记忆库"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    connection.execute("""
+                        CREATE TABLE IF NOT EXISTS translation_memory (
+                            segment_hash TEXT NOT NULL,
+                            source_lang TEXT NOT NULL,
+                            target_lang TEXT NOT NULL,
+                            model TEXT NOT NULL,
+                            source_text TEXT NOT NULL,
+                            translation TEXT NOT NULL,
+                            created_at REAL NOT NULL,
+                            hits INTEGER NOT NULL DEFAULT 0,
+                            PRIMARY KEY (segment_hash, source_lang, target_lang, model)
+                        )
+                    """)
+                    connection.commit()
+                    self._initialized = True
+        return connection
+
+    def ensure_directory(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def lookup(self, keys: List[str], source_lang: str, target_lang: str, model: str) -> Dict[str, str]:
+        """批量查询已有译文，返回 {片段哈希: 译文}"""
+        if not self.enabled or not keys:
+            return {}
+        self.ensure_directory()
+        found: Dict[str, str] = {}
+        unique = list(dict.fromkeys(keys))
+        connection = self._connect()
+        try:
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = connection.execute(
+                    f"SELECT segment_hash, translation FROM translation_memory "
+                    f"WHERE source_lang = ? AND target_lang = ? AND model = ? AND segment_hash IN ({placeholders})",
+                    [source_lang, target_lang, model] + batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                connection.executemany(
+                    "UPDATE translation_memory SET hits = hits + 1 "
+                    "WHERE segment_hash = ? AND source_lang = ? AND target_lang = ? AND model = ?",
+                    [(key, source_lang, target_lang, model) for key in found]
+                )
+                connection.commit()
+        finally:
+            connection.close()
+        return found
+
+    def store(self, entries: List[Tuple[str, str]], source_lang: str, target_lang: str, model: str) -> None:
+        """保存译文，entries 为 [(原文片段, 译文), ...]"""
+        if not self.enabled or not entries:
+            return
+        self.ensure_directory()
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO translation_memory "
+                "(segment_hash, source_lang, target_lang, model, source_text, translation, created_at, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                [(segment_hash(source), source_lang, target_lang, model, source, translation, now)
+                 for source, translation in entries]
+            )
+            connection.commit()
+        finally:
+            connection.close()
+        self.logger.info(f"翻译记忆库新增 {len(entries)} 个片段", extra={'high_volume': True})
+
+
+# 全局翻译记忆库实例
+translation_memory = TranslationMemory(
+    config_manager.get_config_value('translation', 'memory_db', 'data/translation_memory.db').strip()
+)
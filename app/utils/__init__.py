@@ -1,15 +1,35 @@
 from .exceptions import (
     APIException, ConfigurationError, ValidationError, 
-    AIServiceError, AuthenticationError, RateLimitError
+    AIServiceError, AuthenticationError, RateLimitError, OverloadError, RequestCancelledError,
+    DeadlineExceededError
 )
 from .validators import Validator, ConfigValidator
 from .logger import setup_logger, get_logger, LoggerMixin
+from .request_context import (
+    set_request_id, get_request_id, get_elapsed_ms, clear_request_context,
+    set_client_context, get_client_id, get_endpoint,
+    set_deadline, get_remaining_time, set_partial_result, get_partial_result
+)
 from .error_handler import handle_api_error, handle_service_error, ErrorHandler, create_error_response
+from .assets import AssetPipeline, asset_pipeline
+from .deadline import DeadlinePolicy, deadline_policy, check_deadline
+from .cancellation import (
+    CancelToken, cancellation_registry, cancellable_session, get_cancel_token, raise_if_cancelled
+)
+from .cpu_pool import CpuPool, cpu_pool
 
 __all__ = [
     'APIException', 'ConfigurationError', 'ValidationError', 
-    'AIServiceError', 'AuthenticationError', 'RateLimitError',
+    'AIServiceError', 'AuthenticationError', 'RateLimitError', 'OverloadError', 'RequestCancelledError',
+    'DeadlineExceededError',
     'Validator', 'ConfigValidator',
     'setup_logger', 'get_logger', 'LoggerMixin',
-    'handle_api_error', 'handle_service_error', 'ErrorHandler', 'create_error_response'
+    'set_request_id', 'get_request_id', 'get_elapsed_ms', 'clear_request_context',
+    'set_client_context', 'get_client_id', 'get_endpoint',
+    'set_deadline', 'get_remaining_time', 'set_partial_result', 'get_partial_result',
+    'handle_api_error', 'handle_service_error', 'ErrorHandler', 'create_error_response',
+    'AssetPipeline', 'asset_pipeline',
+    'DeadlinePolicy', 'deadline_policy', 'check_deadline',
+    'CancelToken', 'cancellation_registry', 'cancellable_session', 'get_cancel_token', 'raise_if_cancelled',
+    'CpuPool', 'cpu_pool'
 ]
\ No newline at end of file
@@ -0,0 +1,256 @@
+"""静态资源处理
+
+启动时压缩前端脚本和样式，按内容摘要生成带指纹的文件名，并预先生成gzip和brotli版本。
+模板通过 asset_url 引用带指纹的地址；文件名随内容变化，因此可以设置一年的不可变缓存。
+"""
+
+import gzip
+import hashlib
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from flask import request, send_file, url_for
+from ..config import config_manager
+from .logger import LoggerMixin
+from .error_handler import create_error_response
+
+try:
+    import brotli
+except ImportError:  # 未安装时只生成gzip版本
+    brotli = None
+
+_MIMETYPES = {'.js': 'application/javascript', '.css': 'text/css'}
+
+# 出现在这些字符或关键字之后的 / 是正则字面量的开始，而不是除号
+_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void', 'delete', 'throw', 'new', 'instanceof'}
+
+
+def minify_js(source: str) -> str:
+    """保守的脚本压缩：去掉注释、缩进、行尾空白和空行
+
+    保留换行以免改变自动分号插入的语义；字符串、模板字符串和正则字面量原样保留。
+    """
+    out: List[str] = []
+    # 模板字符串中 ${ } 表达式的花括号深度栈
+    template_stack: List[int] = []
+    in_template = False
+    i, n = 0, len(source)
+
+    def newline():
+        while out and out[-1] in ' \t':
+            out.pop()
+        if out and out[-1] != '\n':
+            out.append('\n')
+
+    def previous_token() -> Tuple[str, str]:
+        """输出中最后一个非空白字符及其所在的标识符；以 ++ 或 -- 结尾时返回该运算符"""
+        j = len(out) - 1
+        while j >= 0 and out[j] in ' \t\n':
+            j -= 1
+        if j < 0:
+            return '', ''
+        if out[j] in '+-' and j > 0 and out[j - 1] == out[j]:
+            return out[j], out[j] * 2
+        k = j
+        while k >= 0 and (out[k].isalnum() or out[k] in '_$'):
+            k -= 1
+        return out[j], ''.join(out[k + 1:j + 1])
+
+    while i < n:
+        c = source[i]
+        if in_template:
+            if c == '\\':
+                out.append(source[i:i + 2])
+                i += 2
+            elif c == '`':
+                out.append(c)
+                in_template = False
+                i += 1
+            elif source.startswith('${', i):
+                out.append('${')
+                template_stack.append(0)
+                in_template = False
+                i += 2
+            else:
+                out.append(c)
+                i += 1
+            continue
+
+        if c in '\r\n':
+            newline()
+            i += 1
+            continue
+        if c in ' \t' and (not out or out[-1] == '\n'):
+            i += 1
+            continue
+        if source.startswith('//', i):
+            end = source.find('\n', i)
+            i = n if end < 0 else end
+            continue
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            if '\n' in source[i:end]:
+                newline()
+            i = end
+            continue
+        if c in '"\'':
+            j = i + 1
+            while j < n and source[j] != c and source[j] != '\n':
+                j += 2 if source[j] == '\\' else 1
+            out.append(source[i:j + 1])
+            i = j + 1
+            continue
+        if c == '`':
+            out.append(c)
+            in_template = True
+            i += 1
+            continue
+        if c == '/':
+            last, word = previous_token()
+            # a++ / b、x-- / y 中的 / 是除号
+            if not last or (last in _REGEX_PRECEDERS and word not in ('++', '--')) or word in _REGEX_KEYWORDS:
+                j, in_class = i + 1, False
+                while j < n and source[j] != '\n':
+                    if source[j] == '\\':
+                        j += 2
+                        continue
+                    if source[j] == '[':
+                        in_class = True
+                    elif source[j] == ']':
+                        in_class = False
+                    elif source[j] == '/' and not in_class:
+                        break
+                    j += 1
+                out.append(source[i:j + 1])
+                i = j + 1
+                continue
+        if template_stack:
+            if c == '{':
+                template_stack[-1] += 1
+            elif c == '}':
+                if template_stack[-1] == 0:
+                    template_stack.pop()
+                    out.append(c)
+                    in_template = True
+                    i += 1
+                    continue
+                template_stack[-1] -= 1
+        out.append(c)
+        i += 1
+
+    newline()
+    return ''.join(out)
+
+
+def minify_css(source: str) -> str:
+    """去掉注释并压缩空白，字符串原样保留"""
+    parts = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', source)
+    for index in range(0, len(parts), 2):
+        text = re.sub(r'/\*.*?\*/', '', parts[index], flags=re.S)
+        text = re.sub(r'\s+', ' ', text)
+        # 选择器中 : 前的空格有含义（后代伪类），只去掉其后的空格
+        text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+        text = re.sub(r':\s+', ':', text)
+        parts[index] = text.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+class AssetPipeline(LoggerMixin):
+    """构建并提供带指纹的预压缩静态资源"""
+
+    def __init__(self, enabled: bool, static_dir: str, output_dir: str, files: List[str]):
+        self.enabled = enabled
+        self.static_dir = static_dir
+        self.output_dir = output_dir
+        self.files = files
+        # 逻辑路径（如 js/index.js）-> 带指纹的相对路径
+        self.manifest: Dict[str, str] = {}
+        # 带指纹的相对路径 -> 文件类型
+        self._built: Dict[str, str] = {}
+
+    def build(self) -> None:
+        """压缩、加指纹并生成压缩版本；单个文件失败时该文件回退为原始地址"""
+        if not self.enabled:
+            return
+        for logical in self.files:
+            try:
+                self._build_one(logical)
+            except (OSError, UnicodeDecodeError) as e:
+                self.logger.warning(f"静态资源构建失败，使用原始文件: {logical}, {str(e)}")
+        self.logger.info("静态资源构建完成", extra={"assets": self.manifest, "brotli": brotli is not None})
+
+    def _build_one(self, logical: str) -> None:
+        base, ext = os.path.splitext(logical)
+        with open(os.path.join(self.static_dir, logical), encoding='utf-8') as handle:
+            source = handle.read()
+        minified = minify_js(source) if ext == '.js' else minify_css(source) if ext == '.css' else source
+        data = minified.encode('utf-8')
+        fingerprinted = f"{base}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+        path = os.path.join(self.output_dir, fingerprinted)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            variants = [('', data), ('.gz', gzip.compress(data, 9, mtime=0))]
+            if brotli is not None:
+                variants.append(('.br', brotli.compress(data, quality=11)))
+            for suffix, content in variants:
+                # 先写临时文件再改名，多进程同时启动时不会读到不完整的文件
+                tmp_path = f"{path}{suffix}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as handle:
+                    handle.write(content)
+                os.replace(tmp_path, path + suffix)
+            self.logger.info(f"静态资源 {logical}: {len(source.encode('utf-8'))} -> {len(data)} 字节")
+        self._remove_stale(fingerprinted)
+        self.manifest[logical] = fingerprinted
+        self._built[fingerprinted] = _MIMETYPES.get(ext, 'application/octet-stream')
+
+    def _remove_stale(self, fingerprinted: str) -> None:
+        """删除同一资源此前内容生成的带指纹文件及其压缩版本，避免输出目录随每次修改增长"""
+        directory, current = os.path.split(os.path.join(self.output_dir, fingerprinted))
+        base, ext = os.path.splitext(current)
+        stale = re.compile(re.escape(base.rsplit('.', 1)[0]) + r'\.[0-9a-f]{10}' + re.escape(ext) + r'(?:\.gz|\.br)?$')
+        for name in os.listdir(directory):
+            if stale.match(name) and not name.startswith(current):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def url(self, logical: str) -> str:
+        """模板中引用静态资源的地址，未构建时回退为原始静态文件地址"""
+        fingerprinted = self.manifest.get(logical)
+        if fingerprinted is None:
+            return url_for('static', filename=logical)
+        return url_for('serve_asset', filename=fingerprinted)
+
+    def serve(self, filename: str):
+        """按 Accept-Encoding 返回预压缩版本，并设置不可变缓存"""
+        mimetype = self._built.get(filename)
+        if mimetype is None:
+            return create_error_response("资源未找到", "ASSET_NOT_FOUND", 404)
+        path = os.path.join(self.output_dir, filename)
+        encoding: Optional[str] = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and os.path.exists(path + suffix):
+                encoding, path = candidate, path + suffix
+                break
+        response = send_file(os.path.abspath(path), mimetype=mimetype, conditional=True, max_age=31536000)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+
+# 全局静态资源实例
+asset_pipeline = AssetPipeline(
+    enabled=config_manager.get_config_value('assets', 'enabled', 'true').lower() == 'true',
+    static_dir=config_manager.get_config_value('assets', 'static_dir', 'static'),
+    output_dir=config_manager.get_config_value('assets', 'output_dir', 'static/dist'),
+    files=[
+        name.strip() for name in config_manager.get_config_value(
+            'assets', 'files', 'js/index.js, js/hash-worker.js, css/style.css'
+        ).split(',') if name.strip()
+    ]
+)
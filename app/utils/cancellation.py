@@ -0,0 +1,252 @@
+"""请求取消
+
+每个请求持有一个取消令牌。客户端断开连接（后台线程定期探测请求的套接字）或前端显式取消时，
+令牌被触发：正在进行的模型HTTP调用的连接被立即关闭，排队中的调用退出等待，
+分块分析不再发起后续分块和总结。令牌放在上下文变量中，随 copy_context 传给工作线程。
+"""
+
+import contextvars
+import select
+import socket
+import threading
+import time
+from typing import Dict, List, Optional, Set
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from ..config import config_manager
+from .exceptions import RequestCancelledError
+from .logger import LoggerMixin
+
+_cancel_token: contextvars.ContextVar = contextvars.ContextVar('cancel_token', default=None)
+
+# Windows 没有 MSG_DONTWAIT，只在 select 判定可读后才偷看
+_MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+
+class CancelToken:
+    """一个请求的取消状态，以及该请求当前占用的上游HTTP连接"""
+
+    def __init__(self, request_id: str, client_id: Optional[str] = None):
+        self.request_id = request_id
+        self.client_id = client_id
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._connections: Set = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str) -> None:
+        """触发取消，并关闭正在使用的连接使阻塞中的读取立即失败"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            connections = list(self._connections)
+        for connection in connections:
+            _shutdown(connection)
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise RequestCancelledError("请求已取消", "REQUEST_CANCELLED", {"reason": self.reason})
+
+    def attach(self, connection) -> None:
+        with self._lock:
+            self._connections.add(connection)
+            cancelled = self._event.is_set()
+        if cancelled:
+            _shutdown(connection)
+
+    def detach(self, connection) -> None:
+        with self._lock:
+            self._connections.discard(connection)
+
+
+def _shutdown(connection) -> None:
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def get_cancel_token() -> Optional[CancelToken]:
+    """当前请求的取消令牌，请求上下文之外为 None"""
+    return _cancel_token.get()
+
+
+def raise_if_cancelled() -> None:
+    """当前请求已被取消时抛出 RequestCancelledError"""
+    token = _cancel_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+class _CancellableMixin:
+    """取出连接时登记到当前请求的令牌，归还时注销，取消时可从其他线程关闭"""
+
+    def _get_conn(self, timeout=None):
+        connection = super()._get_conn(timeout)
+        token = _cancel_token.get()
+        if token is not None:
+            connection._cancel_token = token
+            token.attach(connection)
+        return connection
+
+    def _put_conn(self, conn):
+        token = getattr(conn, '_cancel_token', None)
+        if token is not None:
+            token.detach(conn)
+            conn._cancel_token = None
+            if token.cancelled:
+                # 被关闭的连接不再放回连接池复用
+                conn.close()
+        super()._put_conn(conn)
+
+
+class _CancellableHTTPPool(_CancellableMixin, HTTPConnectionPool):
+    pass
+
+
+class _CancellableHTTPSPool(_CancellableMixin, HTTPSConnectionPool):
+    pass
+
+
+class _CancellableAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _CancellableHTTPPool, 'https': _CancellableHTTPSPool}
+
+
+def cancellable_session() -> requests.Session:
+    """连接可被当前请求的取消令牌关闭的HTTP会话"""
+    session = requests.Session()
+    adapter = _CancellableAdapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class CancellationRegistry(LoggerMixin):
+    """进行中请求的取消令牌，以及探测客户端断开的后台线程"""
+
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, CancelToken] = {}
+        # 请求ID -> 客户端连接的套接字
+        self._sockets: Dict[str, socket.socket] = {}
+        self._watcher: Optional[threading.Thread] = None
+
+    def open(self, request_id: str, client_id: Optional[str], client_socket=None) -> CancelToken:
+        """为当前请求创建令牌并绑定到上下文；提供 client_socket 时探测客户端是否断开"""
+        token = CancelToken(request_id, client_id)
+        _cancel_token.set(token)
+        with self._lock:
+            self._tokens[request_id] = token
+            if client_socket is not None and self.poll_interval > 0:
+                self._sockets[request_id] = client_socket
+                if self._watcher is None:
+                    self._watcher = threading.Thread(target=self._watch, name='disconnect-watcher', daemon=True)
+                    self._watcher.start()
+        return token
+
+    def close(self, request_id: Optional[str]) -> None:
+        _cancel_token.set(None)
+        with self._lock:
+            self._tokens.pop(request_id, None)
+            self._sockets.pop(request_id, None)
+
+    def cancel(self, request_id: str, client_id: Optional[str], reason: str = "客户端取消") -> bool:
+        """取消进行中的请求，只允许同一客户端取消；请求不存在时返回 False"""
+        with self._lock:
+            token = self._tokens.get(request_id)
+        if token is None or token.client_id != client_id:
+            return False
+        token.cancel(reason)
+        self.logger.info(f"请求已取消: {request_id}, 原因: {reason}")
+        return True
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                watched = list(self._sockets.items())
+            if not watched:
+                continue
+            # 已被服务器关闭的套接字不再探测
+            closed_ids = [request_id for request_id, sock in watched if sock.fileno() == -1]
+            if closed_ids:
+                with self._lock:
+                    for request_id in closed_ids:
+                        self._sockets.pop(request_id, None)
+                watched = [(request_id, sock) for request_id, sock in watched if request_id not in closed_ids]
+            readable = _readable([sock for _, sock in watched])
+            for request_id, sock in watched:
+                if sock not in readable:
+                    continue
+                closed = _peer_closed(sock)
+                if closed is False:
+                    continue
+                with self._lock:
+                    self._sockets.pop(request_id, None)
+                    token = self._tokens.get(request_id)
+                if closed and token is not None:
+                    token.cancel("客户端已断开")
+                    self.logger.info(f"客户端已断开，取消请求: {request_id}")
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "active": len(self._tokens),
+                "watched": len(self._sockets),
+                "cancelled": sum(1 for token in self._tokens.values() if token.cancelled)
+            }
+
+
+def _readable(sockets: List[socket.socket]) -> List[socket.socket]:
+    """可读（有数据、EOF或出错）的套接字；poll 不受 select 的文件描述符不超过1024的限制"""
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        by_fd = {}
+        for sock in sockets:
+            by_fd[sock.fileno()] = sock
+            poller.register(sock.fileno(), select.POLLIN | select.POLLPRI)
+        return [by_fd[fd] for fd, _ in poller.poll(0) if fd in by_fd]
+    readable = []
+    for sock in sockets:
+        try:
+            if select.select([sock], [], [], 0)[0]:
+                readable.append(sock)
+        except (OSError, ValueError):
+            # 检查期间被关闭，下一轮按 fileno() == -1 移除
+            continue
+    return readable
+
+
+def _peer_closed(sock) -> Optional[bool]:
+    """套接字可读时偷看一个字节：读到EOF或连接已重置说明客户端已断开；无法探测时返回 None
+
+    请求套接字是阻塞的，偷看时使用非阻塞标志，客户端空闲时不会卡住探测线程。
+    """
+    try:
+        return sock.recv(1, socket.MSG_PEEK | _MSG_DONTWAIT) == b''
+    except (BlockingIOError, InterruptedError):
+        return False
+    except ValueError:
+        # TLS套接字不支持 MSG_PEEK
+        return None
+    except OSError:
+        return True
+
+
+# 全局请求取消实例
+cancellation_registry = CancellationRegistry(
+    poll_interval=float(config_manager.get_config_value('cancellation', 'poll_interval', '1'))
+)
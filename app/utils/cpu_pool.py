@@ -0,0 +1,232 @@
+"""CPU密集型任务的进程池
+
+日志解析与评分、JavaScript拆包与切片、分块时的token估算都是纯Python计算，在请求线程中执行时
+会因GIL阻塞其他请求。这些阶段提交到共享的进程池执行：较大的输入先写入内存映射的临时文件，
+工作进程通过mmap读取，不经过pickle复制；较小的输入直接在当前线程执行，进程间通信的开销比计算本身更大。
+工作进程的地址空间受 task_memory_mb 限制，超出时任务以内存不足失败而不会拖垮整个服务。
+"""
+
+import mmap
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+from ..config import config_manager
+from .cancellation import raise_if_cancelled
+from .deadline import check_deadline
+from .exceptions import APIException, ValidationError
+from .logger import LoggerMixin
+
+try:
+    import resource
+except ImportError:  # 非Unix平台不限制工作进程内存
+    resource = None
+
+# 等待任务结果时检查取消和截止时间的间隔（秒）
+WAIT_POLL_SECONDS = 0.2
+
+# 工作进程中为 True，任务内再次提交时直接执行
+_in_worker = False
+
+
+@dataclass(frozen=True)
+class _Spooled:
+    """写入临时文件的任务输入"""
+    path: str
+    size: int
+
+    def read(self) -> str:
+        if not self.size:
+            return ""
+        with open(self.path, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return str(mapped, 'utf-8')
+
+
+def _init_worker(memory_limit_mb: int) -> None:
+    global _in_worker
+    _in_worker = True
+    if resource is not None and memory_limit_mb > 0:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _run_task(func: Callable, payload: Any, args: tuple):
+    """在工作进程中执行任务，返回结果和占用的CPU时间"""
+    started = time.process_time()
+    text = payload.read() if isinstance(payload, _Spooled) else payload
+    return func(text, *args), time.process_time() - started
+
+
+class CpuPool(LoggerMixin):
+    """共享的CPU任务进程池
+
+    任务函数必须是模块级函数，第一个参数为待处理的文本。
+    """
+
+    def __init__(self, workers: int, inline_chars: int, spool_chars: int, memory_limit_mb: int,
+                 max_tasks_per_child: int, start_method: str, spool_dir: str):
+        self.workers = workers
+        self.inline_chars = inline_chars
+        self.spool_chars = spool_chars
+        self.memory_limit_mb = memory_limit_mb
+        self.max_tasks_per_child = max_tasks_per_child
+        self.start_method = start_method
+        self.spool_dir = spool_dir
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._started = 0.0
+        self._active = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._inline = 0
+        self._spooled = 0
+        self._spooled_bytes = 0
+        self._cpu_seconds = 0.0
+
+    def run(self, func: Callable, text: str, *args):
+        """在进程池中执行 func(text, *args) 并等待结果
+
+        进程池关闭、输入较小或已在工作进程中时直接执行。等待期间请求被取消或超过截止时间时不再等待；
+        已开始执行的任务会在工作进程中运行完，结果被丢弃。
+        """
+        executor = None
+        if self.workers > 0 and not _in_worker and len(text) >= self.inline_chars:
+            executor = self._get_executor()
+        if executor is None:
+            with self._lock:
+                self._inline += 1
+            return func(text, *args)
+
+        spooled = self._spool(text) if len(text) >= self.spool_chars else None
+        try:
+            try:
+                future = executor.submit(_run_task, func, spooled or text, args)
+            except BrokenProcessPool:
+                self._reset(executor)
+                raise APIException("本地处理进程池已失效，请重试", "CPU_POOL_BROKEN")
+            with self._lock:
+                self._submitted += 1
+                self._active += 1
+            try:
+                result, cpu_seconds = self._wait(future)
+            except MemoryError:
+                self._record(failed=True)
+                raise ValidationError("输入内容过大，超出本地处理的内存限制", "INPUT_TOO_LARGE")
+            except BrokenProcessPool:
+                self._record(failed=True)
+                self._reset(executor)
+                raise APIException("本地处理进程异常退出", "CPU_POOL_BROKEN")
+            except Exception:
+                self._record(failed=True)
+                raise
+            self._record(cpu_seconds=cpu_seconds)
+            return result
+        finally:
+            if spooled is not None:
+                try:
+                    os.unlink(spooled.path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _wait(future):
+        while True:
+            try:
+                return future.result(timeout=WAIT_POLL_SECONDS)
+            except FutureTimeoutError:
+                try:
+                    raise_if_cancelled()
+                    check_deadline()
+                except APIException:
+                    future.cancel()
+                    raise
+
+    def _record(self, failed: bool = False, cpu_seconds: float = 0.0) -> None:
+        with self._lock:
+            self._active -= 1
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+                self._cpu_seconds += cpu_seconds
+
+    def _spool(self, text: str) -> _Spooled:
+        """把输入写入临时文件，工作进程通过mmap读取"""
+        data = text.encode('utf-8')
+        with tempfile.NamedTemporaryFile(dir=self.spool_dir, prefix='cpu-pool-', delete=False) as handle:
+            handle.write(data)
+        with self._lock:
+            self._spooled += 1
+            self._spooled_bytes += len(data)
+        return _Spooled(handle.name, len(data))
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        with self._lock:
+            if self._executor is not None:
+                return self._executor
+            method = self.start_method if self.start_method in multiprocessing.get_all_start_methods() else 'spawn'
+            try:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(method),
+                    initializer=_init_worker,
+                    initargs=(self.memory_limit_mb,),
+                    # fork 方式不支持按任务数回收工作进程
+                    max_tasks_per_child=(self.max_tasks_per_child or None) if method != 'fork' else None
+                )
+            except (OSError, ValueError, NotImplementedError) as e:
+                self.logger.warning(f"CPU进程池启动失败，改为在请求线程中执行: {e}")
+                self.workers = 0
+                return None
+            self._started = time.time()
+            self.logger.info(f"CPU进程池已启动，工作进程: {self.workers}, 启动方式: {method}")
+            return self._executor
+
+    def _reset(self, executor: ProcessPoolExecutor) -> None:
+        """工作进程异常退出后丢弃失效的进程池，下次提交时重新创建"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        self.logger.warning("CPU进程池已失效，将在下次提交时重建")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.time() - self._started if self._executor is not None else 0.0
+            capacity = self.workers * elapsed
+            return {
+                "workers": self.workers,
+                "running": self._executor is not None,
+                "active": self._active,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "inline": self._inline,
+                "spooled": self._spooled,
+                "spooled_bytes": self._spooled_bytes,
+                "cpu_seconds": round(self._cpu_seconds, 2),
+                # 进程池启动以来工作进程的平均CPU占用率
+                "utilization": round(self._cpu_seconds / capacity, 3) if capacity else 0.0
+            }
+
+
+def _default_spool_dir() -> str:
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+# 全局CPU进程池实例
+cpu_pool = CpuPool(
+    workers=int(config_manager.get_config_value('cpu_pool', 'workers', '2')),
+    inline_chars=int(config_manager.get_config_value('cpu_pool', 'inline_kb', '64')) * 1024,
+    spool_chars=int(config_manager.get_config_value('cpu_pool', 'spool_kb', '256')) * 1024,
+    memory_limit_mb=int(config_manager.get_config_value('cpu_pool', 'task_memory_mb', '1024')),
+    max_tasks_per_child=int(config_manager.get_config_value('cpu_pool', 'max_tasks_per_child', '200')),
+    start_method=config_manager.get_config_value('cpu_pool', 'start_method', 'forkserver').strip(),
+    spool_dir=config_manager.get_config_value('cpu_pool', 'spool_dir', '').strip() or _default_spool_dir()
+)
@@ -0,0 +1,69 @@
+"""请求截止时间
+
+每个请求有一个总的截止时间：客户端可通过请求头指定（不超过上限），否则按接口取默认值。
+截止时间随请求上下文传到模型调用：排队等待和每次HTTP调用的读取超时都不超过剩余时间，
+分块分析按剩余分块数分配时间，到期时返回已完成的部分结果。
+"""
+
+from typing import Dict, Optional
+from ..config import config_manager
+from .exceptions import DeadlineExceededError
+from .request_context import get_remaining_time
+
+
+class DeadlinePolicy:
+    """按接口和请求头确定请求的截止时间"""
+
+    def __init__(self, default_seconds: float, max_seconds: float, endpoint_seconds: Dict[str, float],
+                 connect_timeout: float, min_call_seconds: float):
+        self.default_seconds = default_seconds
+        self.max_seconds = max_seconds
+        self.endpoint_seconds = endpoint_seconds
+        self.connect_timeout = connect_timeout
+        self.min_call_seconds = min_call_seconds
+
+    def resolve(self, endpoint: Optional[str], requested: Optional[str] = None) -> Optional[float]:
+        """请求的时限（秒）；请求头的值无效时使用接口默认值，0 表示不限"""
+        seconds = self.endpoint_seconds.get(endpoint, self.default_seconds)
+        if requested:
+            try:
+                seconds = float(requested)
+            except ValueError:
+                pass
+        if self.max_seconds > 0:
+            seconds = min(seconds, self.max_seconds) if seconds > 0 else self.max_seconds
+        return seconds if seconds > 0 else None
+
+    def call_budget(self, calls_left: int) -> Optional[float]:
+        """剩余时间按还要进行的调用数平分，每次调用至少 min_call_seconds（不超过剩余时间）"""
+        remaining = get_remaining_time()
+        if remaining is None:
+            return None
+        return max(remaining / max(calls_left, 1), min(remaining, self.min_call_seconds))
+
+
+def check_deadline() -> None:
+    """当前请求已超过截止时间时抛出 DeadlineExceededError"""
+    remaining = get_remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceededError("请求已超过截止时间", "DEADLINE_EXCEEDED")
+
+
+def _parse_endpoint_seconds(value: str) -> Dict[str, float]:
+    """解析 "接口名:秒数" 列表，逗号分隔"""
+    seconds = {}
+    for entry in value.split(','):
+        name, _, limit = entry.partition(':')
+        if name.strip() and limit.strip():
+            seconds[name.strip()] = float(limit)
+    return seconds
+
+
+# 全局截止时间策略实例
+deadline_policy = DeadlinePolicy(
+    default_seconds=float(config_manager.get_config_value('deadline', 'default_seconds', '300')),
+    max_seconds=float(config_manager.get_config_value('deadline', 'max_seconds', '1800')),
+    endpoint_seconds=_parse_endpoint_seconds(config_manager.get_config_value('deadline', 'endpoint_seconds', '')),
+    connect_timeout=float(config_manager.get_config_value('deadline', 'connect_timeout', '5')),
+    min_call_seconds=float(config_manager.get_config_value('deadline', 'min_call_seconds', '30'))
+)
@@ -4,7 +4,10 @@ import functools
 import traceback
 from flask import jsonify
 from typing import Callable, Any
-from .exceptions import APIException, ValidationError, ConfigurationError, AIServiceError
+from .exceptions import (
+    APIException, ValidationError, ConfigurationError, AIServiceError, OverloadError, RequestCancelledError,
+    DeadlineExceededError
+)
 from .logger import get_logger
 
 logger = get_logger('error_handler')
@@ -30,6 +33,30 @@ def handle_api_error(func: Callable) -> Callable:
                 "error_code": e.error_code or "CONFIG_ERROR",
                 "details": e.details
             }), 500
+        except OverloadError as e:
+            logger.warning(f"服务过载: {e.message}", extra={'details': e.details})
+            response = jsonify({
+                "error": e.message,
+                "error_code": e.error_code or "OVERLOADED",
+                "details": e.details
+            })
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, e.status_code
+        except RequestCancelledError as e:
+            logger.info(f"请求已取消: {e.message}", extra={'details': e.details})
+            # 499：客户端关闭请求，客户端多半已收不到该响应
+            return jsonify({
+                "error": e.message,
+                "error_code": e.error_code or "REQUEST_CANCELLED",
+                "details": e.details
+            }), 499
+        except DeadlineExceededError as e:
+            logger.warning(f"请求超过截止时间: {e.message}", extra={'details': e.details})
+            return jsonify({
+                "error": e.message,
+                "error_code": e.error_code or "DEADLINE_EXCEEDED",
+                "details": e.details
+            }), 504
         except AIServiceError as e:
             logger.error(f"AI服务错误: {e.message}", extra={'details': e.details})
             return jsonify({
@@ -33,4 +33,26 @@ class AuthenticationError(APIException):
 
 class RateLimitError(APIException):
     """请求限制错误"""
-    pass
\ No newline at end of file
+    pass
+
+class OverloadError(APIException):
+    """服务过载错误
+
+    status_code 为 429（等待队列已满）或 503（排队超时），retry_after 为建议的重试间隔秒数。
+    """
+    
+    def __init__(self, message: str, status_code: int = 503, retry_after: int = 1,
+                 error_code: str = None, details: dict = None):
+        super().__init__(message, error_code, details)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(AIServiceError):
+    """请求已超过截止时间，且没有可返回的部分结果"""
+    pass
+
+
+class RequestCancelledError(APIException):
+    """请求已被取消（客户端断开或显式取消）"""
+    pass
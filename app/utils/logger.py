@@ -1,69 +1,276 @@
 """日志配置模块"""
 
+import atexit
+import copy
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from typing import Optional
 from ..config import config_manager
+from .request_context import get_request_id
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 根logger名称，所有业务logger均挂在其下
+ROOT_LOGGER_NAME = 'app'
+
+# LogRecord自带属性，序列化时不作为额外字段输出
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {
+    'message', 'asctime', 'request_id', 'high_volume'
+}
+
+# 后台日志监听器
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化JSON日志格式化器"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, 'request_id', None),
+            "process": record.process,
+            "thread": record.threadName,
+            "location": f"{record.filename}:{record.lineno}"
+        }
+
+        # 附加通过extra传入的字段（如duration_ms、data_length等）
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                data[key] = value
+
+        # 异常堆栈在入队前已格式化为 exc_text（见 NonBlockingQueueHandler.prepare）
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = record.stack_info
+
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """在调用线程中注入请求ID"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'request_id'):
+            record.request_id = get_request_id()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """对高频INFO日志进行采样
+
+    仅对通过 extra={'high_volume': True} 标记的INFO日志生效，
+    WARNING及以上级别始终保留。
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.INFO or not getattr(record, 'high_volume', False):
+            return True
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """非阻塞队列处理器，队列满时丢弃日志而不阻塞请求线程"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._exc_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """在调用线程中完成消息格式化
+
+        标准实现会把异常堆栈拼接进 msg，这里单独保存在 exc_text 中，
+        使JSON日志可以输出独立的 exception 字段。
+        """
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.message = record.msg
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class ProcessSafeRotatingFileHandler(RotatingFileHandler):
+    """多进程安全的滚动文件处理器
+
+    写入与滚动都在文件锁内完成，并在其他进程完成滚动后重新打开日志文件。
+    """
+
+    def __init__(self, filename: str, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._lock_file = open(f"{self.baseFilename}.lock", 'a+b')
+
+    def _acquire_file_lock(self) -> None:
+        if fcntl:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._lock_file.seek(0)
+            msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _release_file_lock(self) -> None:
+        if fcntl:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._lock_file.seek(0)
+            msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _reopen_if_rotated(self) -> None:
+        """其他进程已滚动日志时重新打开文件"""
+        if self.stream is None:
+            return
+        try:
+            current = os.stat(self.baseFilename)
+            opened = os.fstat(self.stream.fileno())
+            if (current.st_ino, current.st_dev) == (opened.st_ino, opened.st_dev):
+                return
+        except FileNotFoundError:
+            pass
+        self.stream.close()
+        self.stream = self._open()
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        # 以磁盘上的实际文件大小为准，避免多个进程各自滚动
+        if self.maxBytes <= 0:
+            return False
+        try:
+            size = os.path.getsize(self.baseFilename)
+        except OSError:
+            return False
+        msg = f"{self.format(record)}\n"
+        return size + len(msg.encode(self.encoding or 'utf-8')) >= self.maxBytes
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self._acquire_file_lock()
+        except OSError:
+            super().emit(record)
+            return
+        try:
+            self._reopen_if_rotated()
+            super().emit(record)
+        finally:
+            self._release_file_lock()
+
+    def close(self) -> None:
+        super().close()
+        if not self._lock_file.closed:
+            self._lock_file.close()
+
+
+def setup_logger(app=None, logger_name: str = ROOT_LOGGER_NAME) -> logging.Logger:
+    """设置日志配置
+
+    业务代码只向内存队列写入日志，由后台监听线程负责格式化和文件写入。
+    """
+    global _listener
 
-def setup_logger(app=None, logger_name: str = 'app') -> logging.Logger:
-    """设置日志配置"""
     # 获取日志配置
     log_config = config_manager.get_logging_config()
-    
+    level = getattr(logging, log_config.level.upper(), logging.INFO)
+
     # 创建日志目录
     log_dir = os.path.dirname(log_config.file)
     if log_dir and not os.path.exists(log_dir):
         os.makedirs(log_dir)
-    
+
     # 创建logger
     logger = logging.getLogger(logger_name)
-    logger.setLevel(getattr(logging, log_config.level.upper(), logging.INFO))
-    
+    logger.setLevel(level)
+
     # 避免重复添加handler
     if logger.handlers:
         return logger
-    
+
     # 创建格式化器
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s [%(filename)s:%(lineno)d]'
+    text_formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s [%(filename)s:%(lineno)d]'
     )
-    
+    file_formatter = JsonFormatter() if log_config.format == 'json' else text_formatter
+
+    handlers = []
+
     # 文件处理器
     try:
         # 解析文件大小
         max_bytes = parse_size(log_config.max_size)
-        file_handler = RotatingFileHandler(
+        file_handler = ProcessSafeRotatingFileHandler(
             log_config.file,
             maxBytes=max_bytes,
             backupCount=log_config.backup_count,
             encoding='utf-8'
         )
-        file_handler.setLevel(getattr(logging, log_config.level.upper(), logging.INFO))
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        file_handler.setLevel(level)
+        file_handler.setFormatter(file_formatter)
+        handlers.append(file_handler)
     except Exception as e:
         print(f"设置文件日志处理器失败: {e}")
-    
+
     # 控制台处理器
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    
+    console_handler.setFormatter(text_formatter)
+    handlers.append(console_handler)
+
+    # 队列处理器：请求线程只做入队操作
+    log_queue = queue.Queue(maxsize=log_config.queue_size)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(SamplingFilter(log_config.sample_rate))
+    logger.addHandler(queue_handler)
+
+    # 启动后台监听线程
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logger)
+
     # 如果传入了Flask app，也为app设置日志
     if app:
         app.logger.handlers = logger.handlers
         app.logger.setLevel(logger.level)
-    
+
     return logger
 
 
+def shutdown_logger() -> None:
+    """停止后台日志监听线程并刷新剩余日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 def parse_size(size_str: str) -> int:
     """解析文件大小字符串"""
     size_str = size_str.upper().strip()
-    
+
     if size_str.endswith('KB'):
         return int(size_str[:-2]) * 1024
     elif size_str.endswith('MB'):
@@ -75,17 +282,22 @@ def parse_size(size_str: str) -> int:
         return int(size_str)
 
 
-def get_logger(name: str = 'app') -> logging.Logger:
-    """获取logger实例"""
+def get_logger(name: str = ROOT_LOGGER_NAME) -> logging.Logger:
+    """获取logger实例
+
+    所有logger统一挂在根logger下，以共享队列处理器。
+    """
+    if name != ROOT_LOGGER_NAME and not name.startswith(f"{ROOT_LOGGER_NAME}."):
+        name = f"{ROOT_LOGGER_NAME}.{name}"
     return logging.getLogger(name)
 
 
 class LoggerMixin:
     """日志混入类"""
-    
+
     @property
     def logger(self) -> logging.Logger:
         """获取logger"""
         if not hasattr(self, '_logger'):
             self._logger = get_logger(self.__class__.__name__)
-        return self._logger
\ No newline at end of file
+        return self._logger
@@ -0,0 +1,93 @@
+"""请求上下文模块"""
+
+import time
+import uuid
+import contextvars
+from typing import Optional
+
+# 当前请求ID，在请求线程内有效
+_request_id: contextvars.ContextVar = contextvars.ContextVar('request_id', default=None)
+# 当前请求开始时间
+_request_start: contextvars.ContextVar = contextvars.ContextVar('request_start', default=None)
+# 当前请求的客户端标识和接口名，用于模型调用的公平调度
+_client_id: contextvars.ContextVar = contextvars.ContextVar('client_id', default=None)
+_endpoint: contextvars.ContextVar = contextvars.ContextVar('endpoint', default=None)
+# 当前请求的截止时间（time.monotonic），以及截止时间到达时已完成的部分结果信息
+_deadline: contextvars.ContextVar = contextvars.ContextVar('deadline', default=None)
+_partial_result: contextvars.ContextVar = contextvars.ContextVar('partial_result', default=None)
+
+
+def new_request_id() -> str:
+    """生成新的请求ID"""
+    return uuid.uuid4().hex[:16]
+
+
+def set_request_id(request_id: Optional[str] = None) -> str:
+    """设置当前请求ID，并记录请求开始时间"""
+    request_id = request_id or new_request_id()
+    _request_id.set(request_id)
+    _request_start.set(time.perf_counter())
+    return request_id
+
+
+def get_request_id() -> Optional[str]:
+    """获取当前请求ID"""
+    return _request_id.get()
+
+
+def get_elapsed_ms() -> Optional[float]:
+    """获取当前请求已耗时（毫秒）"""
+    start = _request_start.get()
+    if start is None:
+        return None
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def set_client_context(client_id: Optional[str], endpoint: Optional[str]) -> None:
+    """设置当前请求的客户端标识和接口名"""
+    _client_id.set(client_id)
+    _endpoint.set(endpoint)
+
+
+def get_client_id() -> Optional[str]:
+    """获取当前请求的客户端标识"""
+    return _client_id.get()
+
+
+def get_endpoint() -> Optional[str]:
+    """获取当前请求的接口名"""
+    return _endpoint.get()
+
+
+def set_deadline(seconds: Optional[float]) -> None:
+    """设置当前请求的截止时间（从现在起的秒数），None 表示不限"""
+    _deadline.set(None if seconds is None else time.monotonic() + seconds)
+    _partial_result.set(None)
+
+
+def get_remaining_time() -> Optional[float]:
+    """距当前请求截止时间的秒数，可能为负；未设置截止时间时返回 None"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def set_partial_result(info: Optional[dict]) -> None:
+    """记录截止时间到达时只完成了部分分析"""
+    _partial_result.set(info)
+
+
+def get_partial_result() -> Optional[dict]:
+    """当前请求的部分结果信息，分析完整时为 None"""
+    return _partial_result.get()
+
+
+def clear_request_context() -> None:
+    """清除当前请求上下文"""
+    _request_id.set(None)
+    _request_start.set(None)
+    _client_id.set(None)
+    _endpoint.set(None)
+    _deadline.set(None)
+    _partial_result.set(None)
@@ -0,0 +1,18 @@
+/**
+ * 内容摘要计算Worker
+ * 在后台线程计算文本UTF-8编码的SHA-256，避免大文件哈希阻塞界面
+ */
+
+self.onmessage = async (event) => {
+    const { id, text } = event.data;
+    try {
+        if (!self.crypto || !self.crypto.subtle) {
+            throw new Error('当前环境不支持SubtleCrypto');
+        }
+        const digest = await self.crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+        const hash = Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, '0')).join('');
+        self.postMessage({ id, hash });
+    } catch (error) {
+        self.postMessage({ id, error: error.message });
+    }
+};
@@ -3,10 +3,36 @@
  * 使用模块化架构重构
  */
 
+// 超过该长度的文本先按SHA-256上传到服务端，之后以摘要引用
+const BLOB_MIN_LENGTH = 64 * 1024;
+
 // API客户端类
 class APIClient {
     constructor() {
         this.baseURL = '/api';
+        this.hashWorker = null;
+        this.hashRequests = new Map();
+        this.hashSeq = 0;
+        this.lastHashed = { text: null, hash: null };
+        this.uploadedBlobs = new Set();
+        // 进行中的分析请求ID，页面关闭时通知服务端取消，避免继续消耗模型调用
+        this.pendingRequests = new Set();
+        window.addEventListener('pagehide', () => this.cancelPending());
+    }
+
+    newRequestId() {
+        const bytes = new Uint8Array(8);
+        crypto.getRandomValues(bytes);
+        return Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    // 取消所有进行中的请求；keepalive 保证页面卸载后请求仍能发出
+    cancelPending() {
+        for (const requestId of this.pendingRequests) {
+            fetch(`${this.baseURL}/requests/${requestId}/cancel`, { method: 'POST', keepalive: true })
+                .catch(() => {});
+        }
+        this.pendingRequests.clear();
     }
 
     async request(endpoint, data = null, method = 'GET') {
@@ -21,24 +47,116 @@ class APIClient {
             options.body = JSON.stringify(data);
         }
 
+        const requestId = method === 'POST' ? this.newRequestId() : null;
+        if (requestId) {
+            options.headers['X-Request-ID'] = requestId;
+            this.pendingRequests.add(requestId);
+        }
+
         try {
             const response = await fetch(`${this.baseURL}${endpoint}`, options);
             const result = await response.json();
             
             if (!response.ok) {
-                throw new Error(result.error || `HTTP ${response.status}`);
+                const error = new Error(result.error || `HTTP ${response.status}`);
+                error.code = result.error_code;
+                throw error;
             }
             
             return result;
         } catch (error) {
             console.error(`API请求失败 [${method} ${endpoint}]:`, error);
             throw error;
+        } finally {
+            if (requestId) {
+                this.pendingRequests.delete(requestId);
+            }
+        }
+    }
+
+    // 在Web Worker中计算文本的SHA-256，避免阻塞界面
+    hashText(text) {
+        if (this.lastHashed.text === text) {
+            return Promise.resolve(this.lastHashed.hash);
+        }
+        if (!this.hashWorker) {
+            this.hashWorker = new Worker(window.HASH_WORKER_URL || '/static/js/hash-worker.js');
+            this.hashWorker.onmessage = (event) => {
+                const { id, hash, error } = event.data;
+                const pending = this.hashRequests.get(id);
+                if (!pending) {
+                    return;
+                }
+                this.hashRequests.delete(id);
+                if (error) {
+                    pending.reject(new Error(error));
+                } else {
+                    pending.resolve(hash);
+                }
+            };
+        }
+        const id = ++this.hashSeq;
+        return new Promise((resolve, reject) => {
+            this.hashRequests.set(id, { resolve, reject });
+            this.hashWorker.postMessage({ id, text });
+        }).then((hash) => {
+            this.lastHashed = { text, hash };
+            return hash;
+        });
+    }
+
+    // 确保服务端已有该文本，返回摘要；文本较短、环境不支持或上传失败时返回null，由调用方内联提交
+    async ensureBlob(text) {
+        if (typeof text !== 'string' || text.length < BLOB_MIN_LENGTH || !window.Worker) {
+            return null;
+        }
+        try {
+            const hash = await this.hashText(text);
+            if (!this.uploadedBlobs.has(hash)) {
+                const check = await fetch(`${this.baseURL}/blobs/${hash}`, { method: 'HEAD' });
+                if (!check.ok) {
+                    const upload = await fetch(`${this.baseURL}/blobs/${hash}`, {
+                        method: 'PUT',
+                        headers: { 'Content-Type': 'application/octet-stream' },
+                        body: new TextEncoder().encode(text)
+                    });
+                    if (!upload.ok) {
+                        return null;
+                    }
+                }
+                this.uploadedBlobs.add(hash);
+            }
+            return hash;
+        } catch (error) {
+            console.warn('内容摘要计算或上传失败，改为内联提交:', error);
+            return null;
+        }
+    }
+
+    // 大字段改为引用已上传内容；服务端内容已被淘汰时改为内联重新提交
+    async requestWithBlobs(endpoint, data, fields) {
+        const payload = { ...data };
+        for (const field of fields) {
+            const hash = await this.ensureBlob(data[field]);
+            if (hash) {
+                delete payload[field];
+                payload[`${field}_blob`] = hash;
+            }
+        }
+        try {
+            return await this.request(endpoint, payload, 'POST');
+        } catch (error) {
+            if (error.code !== 'BLOB_NOT_FOUND') {
+                throw error;
+            }
+            this.uploadedBlobs.clear();
+            return this.request(endpoint, data, 'POST');
         }
     }
 
     // 分析服务API
     async analyzeTraffic(httpData) {
-        return this.request('/analyze_traffic', { http_data: httpData }, 'POST');
+        return this.requestWithBlobs('/analyze_traffic', { http_data: httpData }, ['http_data']);
     }
 
     async decode(encodedStr) {
@@ -46,48 +164,48 @@ class APIClient {
     }
 
     async auditJS(jsCode) {
-        return this.request('/audit_js', { js_code: jsCode }, 'POST');
+        return this.requestWithBlobs('/audit_js', { js_code: jsCode }, ['js_code']);
     }
 
     async analyzeProcess(processData) {
-        return this.request('/analyze_process', { process_data: processData }, 'POST');
+        return this.requestWithBlobs('/analyze_process', { process_data: processData }, ['process_data']);
     }
 
     async generateRegex(sourceText, targetText) {
-        return this.request('/generate_regex', { 
+        return this.requestWithBlobs('/generate_regex', { 
             source_text: sourceText, 
             target_text: targetText 
-        }, 'POST');
+        }, ['source_text']);
     }
 
     async analyzeWebshell(fileContent, fileName = '') {
-        return this.request('/detect_webshell', { 
+        return this.requestWithBlobs('/detect_webshell', { 
             file_content: fileContent, 
             file_name: fileName 
-        }, 'POST');
+        }, ['file_content']);
     }
 
     async analyzeWeblog(logContent, analysisTypes) {
-        return this.request('/analyze_weblog', { 
+        return this.requestWithBlobs('/analyze_weblog', { 
             log_content: logContent, 
             analysis_types: analysisTypes 
-        }, 'POST');
+        }, ['log_content']);
     }
 
     async chatWeblog(question, logContent, analysisResult) {
-        return this.request('/chat_weblog', {
+        return this.requestWithBlobs('/chat_weblog', {
             question: question,
             log_content: logContent,
             analysis_result: analysisResult
-        }, 'POST');
+        }, ['log_content', 'analysis_result']);
     }
 
     async translate(text, sourceLang, targetLang) {
-        return this.request('/translate', { 
+        return this.requestWithBlobs('/translate', { 
             text, 
             source_lang: sourceLang,
             target_lang: targetLang 
-        }, 'POST');
+        }, ['text']);
     }
 
     // 配置管理API